@@ -5,14 +5,10 @@
 
 __docformat__ = "restructuredtext en"
 
-from base64 import b64encode
-from datetime import datetime, timedelta
-import functools
-from hashlib import sha256
-import hmac
+from itertools import islice
 import socket
 import sys
-from time import strftime, gmtime, sleep
+import threading
 import warnings
 
 import six
@@ -20,20 +16,21 @@ import six
 # support Python 2 and Python 3 without conversion
 try:
     from io import StringIO
-    from urllib.request import HTTPError
-    from urllib.parse import quote
 except ImportError:
     from cStringIO import StringIO
-    from urllib2 import HTTPError
-    from urllib2 import quote
-
-import requests
 
 from amazonproduct.version import VERSION
+from amazonproduct.batch import BatchRequest
 from amazonproduct.errors import *
+from amazonproduct.metrics import Call, TimedReader
+from amazonproduct import profiling
+from amazonproduct.retry import retry_after
+from amazonproduct.signing import PlannedRequest, Signer
 from amazonproduct.utils import load_config, load_class
 from amazonproduct.utils import running_on_gae, REQUIRED_KEYS
 from amazonproduct.processors import ITEMS_PAGINATOR, BaseProcessor
+from amazonproduct.throttling import TokenBucket
+from amazonproduct.transport import SessionTransport
 
 USER_AGENT = ('python-amazon-product-api/%s '
     '+http://pypi.python.org/pypi/python-amazon-product-api/' % VERSION)
@@ -84,10 +81,15 @@ class API (object):
     VERSION = '2011-08-01'  #: supported Amazon API version
     REQUESTS_PER_SECOND = 1  #: max requests per second
     TIMEOUT = 5  #: timeout in seconds
+    MAX_ITEM_IDS = 10  #: max item IDs per ItemLookup request
+    MAX_BATCH_REQUESTS = 2  #: max requests per operation in a batch request
+
+    _throttle_lock = threading.Lock()
 
     def __init__(self, access_key_id=None, secret_access_key=None, locale=None,
              associate_tag=None, processor='amazonproduct.processors.objectify',
-             cfg=None):
+             cfg=None, transport=None, throttle=None, observers=None,
+             retry=None):
         """
         .. versionchanged:: 0.2.6
            Passing parameters ``access_key_id``, ``secret_access_key`` and
@@ -100,7 +102,25 @@ class API (object):
         :param locale: localise results by using one value from ``LOCALES``.
         :param processor: module containing result processing functions. Look
         in package ``amazonproduct.processors`` for values.
+        :param transport: :class:`~amazonproduct.transport.BaseTransport`
+        instance used to send requests. If omitted, a
+        :class:`~amazonproduct.transport.SessionTransport` (which keeps
+        connections alive) is created and closed again with :meth:`close`.
+        :param throttle: :class:`~amazonproduct.throttling.TokenBucket` which
+        can be shared with other API instances. If omitted, the API will use
+        its own allowing :const:`REQUESTS_PER_SECOND`.
+        :param observers: list of
+        :class:`~amazonproduct.metrics.BaseObserver` instances which are told
+        about every call (see :mod:`amazonproduct.metrics`). If profiling is
+        switched on in the config file (unless ``cfg`` is a ``dict``) or
+        environment, the shared
+        :class:`~amazonproduct.profiling.SamplingProfiler` is added.
+        :param retry: :class:`~amazonproduct.retry.RetryPolicy` deciding
+        whether failed requests are sent again (default: never).
         """
+        cfg_path = cfg if isinstance(cfg, six.string_types) else None
+        # a config dict replaces the config files (profiling included)
+        cfg_files = not isinstance(cfg, dict)
 
         if any([access_key_id, secret_access_key, associate_tag]):
             warnings.warn('Please use a config file!', DeprecationWarning,
@@ -136,19 +156,81 @@ class API (object):
             self._processor_module = processor.__class__.__name__
             self.processor = processor
 
-        self.last_call = datetime(1970, 1, 1)
+        # a transport passed in may be shared with other API instances, hence
+        # we only close the ones we created ourselves
+        self._owns_transport = transport is None
+        if transport is None:
+            transport = self._create_transport()
+        self.transport = transport
+
+        self._throttle = throttle
+        self._signer = None
+        self.retry = retry
+        self.observers = list(observers or [])
+        profiler = profiling.from_config(cfg_path, cfg_files)
+        if profiler is not None and profiler not in self.observers:
+            self.observers.append(profiler)
+        self._local = threading.local()
         self.debug = 0  # set to 1 if you want to see HTTP headers
 
     def __repr__(self):
         return '<API(%s/%s/%s) at %s>' % (
             self.VERSION, self.locale, self._processor_module, hex(id(self)))
 
+    @property
+    def throttle(self):
+        """
+        Rate limiter used for all requests. Unless one was passed to the
+        constructor, it is created on first use allowing
+        :const:`REQUESTS_PER_SECOND`.
+        """
+        if self._throttle is None:
+            with self._throttle_lock:
+                if self._throttle is None:
+                    self._throttle = TokenBucket(self.REQUESTS_PER_SECOND)
+        return self._throttle
+
+    @property
+    def current_call(self):
+        """
+        :class:`~amazonproduct.metrics.Call` which is being measured in this
+        thread (``None`` if there are no observers).
+        """
+        return getattr(self._local, 'call', None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _create_transport(self):
+        """
+        Returns the transport used if none was passed to the constructor.
+        """
+        return SessionTransport()
+
+    def close(self):
+        """
+        Closes all connections kept alive by the API's transport. This will not
+        close a transport passed to the constructor!
+        """
+        if self._owns_transport and self.transport is not None:
+            self.transport.close()
+
     def _build_url(self, **qargs):
         """
         Builds a signed URL for querying Amazon AWS.  This function is based
         on code by Adam Cox (found at
         http://blog.umlungu.co.uk/blog/2009/jul/12/pyaws-adding-request-authentication/)
         """
+        return self._sign_query(self._prepare_query(**qargs))
+
+    def _prepare_query(self, **qargs):
+        """
+        Returns the complete (but unsigned) query parameters for a request
+        including all defaults.
+        """
         # remove empty (=None) parameters
         for key in list(qargs):
             if qargs[key] is None:
@@ -170,49 +252,92 @@ class API (object):
         if isinstance(qargs.get('ResponseGroup'), list):
             qargs['ResponseGroup'] = ','.join(qargs['ResponseGroup'])
 
-        # add timestamp (this is required when using a signature)
-        qargs['Timestamp'] = strftime("%Y-%m-%dT%H:%M:%SZ", gmtime())
+        return qargs
+
+    @property
+    def signer(self):
+        """
+        :class:`~amazonproduct.signing.Signer` for the current :attr:`host`
+        and secret key. It is created again if either of them is changed.
+        """
+        signer = self._signer
+        if (signer is None or signer.host != self.host
+                or signer.secret_key != self.secret_key):
+            signer = self._signer = Signer(self.secret_key, self.host)
+        return signer
+
+    def _sign_query(self, qargs):
+        """
+        Adds a timestamp to the query parameters ``qargs`` and returns the
+        signed URL.
+        """
+        return self.signer.sign(qargs)
 
-        # create signature
-        keys = sorted(qargs.keys())
-        args = '&'.join('%s=%s' % (
-            key, quote(str(qargs[key]).encode('utf-8'))) for key in keys)
+    def plan(self, queries):
+        """
+        Turns query parameters (one ``dict`` per request, each with at least
+        an ``Operation``) into :class:`~amazonproduct.signing.PlannedRequest`
+        objects: complete and canonical, but not yet signed. This is a
+        generator, so any number of requests can be planned::
 
-        msg = 'GET'
-        msg += '\n' + self.host
-        msg += '\n/onca/xml'
-        msg += '\n' + args
+            for request in api.plan(queries):
+                queue.put(request)  # request.key identifies the request
 
-        key = self.secret_key or ''
-        # On python3, HMAC needs bytes for key and msg.
-        try:
-            hash = hmac.new(key, msg, sha256)
-        except TypeError:
-            hash = hmac.new(key.encode(), msg.encode(), sha256)
+        Planned requests are signed with :meth:`sign` right before they are
+        sent, possibly by another process with its own API instance for the
+        same locale and account.
+        """
+        for qargs in queries:
+            yield PlannedRequest.from_query(
+                self._prepare_query(**qargs), self.locale)
 
-        signature = quote(b64encode(hash.digest()))
-        return 'http://%s/onca/xml?%s&Signature=%s' % (
-            self.host, args, signature)
+    def sign(self, request):
+        """
+        Returns the signed URL for a planned request (or a ``dict`` of query
+        parameters) with the current time as ``Timestamp``. Sign requests just
+        before they are sent -- Amazon refuses old timestamps.
+
+        :param request: :class:`~amazonproduct.signing.PlannedRequest` (see
+          :meth:`plan`) or ``dict`` of query parameters.
+        """
+        return self._sign_request(self.signer, request)
+
+    def sign_many(self, requests):
+        """
+        Returns a list of signed URLs for a batch of requests (see
+        :meth:`sign`), all of them with the same timestamp.
+        """
+        signer = self.signer
+        timestamp = signer.timestamp()
+        return [self._sign_request(signer, request, timestamp)
+                for request in requests]
+
+    def _sign_request(self, signer, request, timestamp=None):
+        if not isinstance(request, PlannedRequest):
+            return signer.sign(self._prepare_query(**request), timestamp)
+        if request.locale not in (None, self.locale):
+            raise ValueError('Request was planned for locale %r, not %r!' % (
+                request.locale, self.locale))
+        if request.query.get('AWSAccessKeyId') != self.access_key:
+            raise ValueError('Request was planned for another access key!')
+        return signer.sign_canonical(request.canonical, timestamp)
 
     def _fetch(self, url):
         """
         Calls the Amazon Product Advertising API and returns the response.
         """
-        # Be nice and wait for some time
-        # before submitting the next request
-        delta = datetime.now() - self.last_call
-        throttle = timedelta(seconds=1/self.REQUESTS_PER_SECOND)
-        if delta < throttle:
-            wait = throttle-delta
-            sleep(wait.seconds+wait.microseconds/1000000.0) # pragma: no cover
-        self.last_call = datetime.now()
-
-        response = requests.get(url, stream=True, headers={
-            'User-Agent': USER_AGENT
-        })
-        # https://github.com/kennethreitz/requests/issues/2155
-        response.raw.read = functools.partial(response.raw.read, decode_content=True)
-        return response.raw
+        call = self.current_call
+        if call is None:
+            # Be nice and wait for some time
+            # before submitting the next request
+            self.throttle.acquire()
+            return self.transport.fetch(url, headers={'User-Agent': USER_AGENT})
+
+        with call.measure('throttle'):
+            self.throttle.acquire()
+        with call.measure('fetch'):
+            fp = self.transport.fetch(url, headers={'User-Agent': USER_AGENT})
+        return TimedReader(fp, call)
 
     def _reg(self, key):
         """
@@ -229,58 +354,73 @@ class API (object):
         usable output comes out. It will use a different result_processor if
         you have defined one.
         """
+        call = self.current_call
         try:
-            return self.processor.parse(fp)
+            if call is None:
+                return self.processor.parse(fp)
+            with call.measure('parse'):
+                return self.processor.parse(fp)
         except AWSError:
             e = sys.exc_info()[1]  # Python 2/3 compatible
+            if call is None:
+                self._map_error(e)
+            with call.measure('map_error'):
+                self._map_error(e)
 
-            # simple errors
-
-            errors = {
-                'InternalError': InternalError,
-                'InvalidClientTokenId': InvalidClientTokenId,
-                'MissingClientTokenId': MissingClientTokenId,
-                'RequestThrottled': TooManyRequests,
-                'Deprecated': DeprecatedOperation,
-                'AWS.ECommerceService.NoExactMatches': NoExactMatchesFound,
-                'AccountLimitExceeded': AccountLimitExceeded,
-                'AWS.ECommerceService.ItemNotEligibleForCart': InvalidCartItem,
-                'AWS.ECommerceService.CartInfoMismatch': CartInfoMismatch,
-                'AWS.ParameterOutOfRange': ParameterOutOfRange,  # TODO regexp?
-                'AWS.InvalidAccount': InvalidAccount,
-                'SignatureDoesNotMatch': InvalidSignature,
-            }
-
-            if e.code in errors:
-                raise _e(errors[e.code])
-
-            if e.code == 'AWS.MissingParameters':
-                m = self._reg('missing-parameters').search(e.msg)
-                raise _e(MissingParameters, m.group('parameter'))
-
-            if e.code == 'AWS.InvalidEnumeratedParameter':
-                m = self._reg('invalid-value').search(e.msg)
-                if m is not None:
-                    if m.group('parameter') == 'ResponseGroup':
-                        raise _e(InvalidResponseGroup)
-                    elif m.group('parameter') == 'SearchIndex':
-                        raise _e(InvalidSearchIndex)
-
-            if e.code == 'AWS.InvalidParameterValue':
-                m = self._reg('invalid-parameter-value').search(e.msg)
-                raise _e(InvalidParameterValue,
-                         m.group('parameter'), m.group('value'))
-
-            if e.code == 'AWS.RestrictedParameterValueCombination':
-                m = self._reg('invalid-parameter-combination').search(e.msg)
-                raise _e(InvalidParameterCombination, m.group('message'))
-
-            if e.code == 'AWS.ECommerceService.ItemAlreadyInCart':
-                item = self._reg('already-in-cart').search(e.msg).group('item')
-                raise _e(ItemAlreadyInCart, item)
-
-            # otherwise simply re-raise
-            raise
+    def _map_error(self, e):
+        """
+        Raises the appropriate exception for the :class:`AWSError` ``e``
+        currently being handled.
+        """
+        # simple errors
+
+        errors = {
+            'InternalError': InternalError,
+            'InvalidClientTokenId': InvalidClientTokenId,
+            'MissingClientTokenId': MissingClientTokenId,
+            'RequestThrottled': TooManyRequests,
+            'Deprecated': DeprecatedOperation,
+            'AWS.ECommerceService.NoExactMatches': NoExactMatchesFound,
+            'AccountLimitExceeded': AccountLimitExceeded,
+            'AWS.ECommerceService.ItemNotEligibleForCart': InvalidCartItem,
+            'AWS.ECommerceService.CartInfoMismatch': CartInfoMismatch,
+            'AWS.ParameterOutOfRange': ParameterOutOfRange,  # TODO regexp?
+            'AWS.InvalidAccount': InvalidAccount,
+            'SignatureDoesNotMatch': InvalidSignature,
+            'AWS.ExceededMaxBatchRequestsPerOperation':
+                ExceededMaxBatchRequestsPerOperation,
+        }
+
+        if e.code in errors:
+            raise _e(errors[e.code])
+
+        if e.code == 'AWS.MissingParameters':
+            m = self._reg('missing-parameters').search(e.msg)
+            raise _e(MissingParameters, m.group('parameter'))
+
+        if e.code == 'AWS.InvalidEnumeratedParameter':
+            m = self._reg('invalid-value').search(e.msg)
+            if m is not None:
+                if m.group('parameter') == 'ResponseGroup':
+                    raise _e(InvalidResponseGroup)
+                elif m.group('parameter') == 'SearchIndex':
+                    raise _e(InvalidSearchIndex)
+
+        if e.code == 'AWS.InvalidParameterValue':
+            m = self._reg('invalid-parameter-value').search(e.msg)
+            raise _e(InvalidParameterValue,
+                     m.group('parameter'), m.group('value'))
+
+        if e.code == 'AWS.RestrictedParameterValueCombination':
+            m = self._reg('invalid-parameter-combination').search(e.msg)
+            raise _e(InvalidParameterCombination, m.group('message'))
+
+        if e.code == 'AWS.ECommerceService.ItemAlreadyInCart':
+            item = self._reg('already-in-cart').search(e.msg).group('item')
+            raise _e(ItemAlreadyInCart, item)
+
+        # otherwise simply re-raise
+        raise
 
     def call(self, **qargs):
         """
@@ -296,23 +436,89 @@ class API (object):
         * ``_build_url(**query_parameters)``
         * ``_fetch(url)``
         * ``_parse(fp)``
+
+        If the API has :attr:`observers`, each stage of the call is measured
+        (see :mod:`amazonproduct.metrics`).
         """
-        url = self._build_url(**qargs)
+        if not self.observers:
+            return self._call(qargs)
+
+        call = self._call_started(qargs)
+        self._local.call = call
+        try:
+            root = self._call(qargs, call)
+        except Exception:
+            self._local.call = None
+            self._call_finished(call, sys.exc_info()[0])
+            raise
+        self._local.call = None
+        self._call_finished(call)
+        return root
+
+    def _call_started(self, qargs):
+        """
+        Returns a new :class:`~amazonproduct.metrics.Call` for the request
+        ``qargs`` and tells all observers about it.
+        """
+        call = Call(qargs.get('Operation'), self.locale)
+        for observer in self.observers:
+            observer.call_started(call)
+        return call
+
+    def _call_finished(self, call, error=None):
+        call.finish(error)
+        for observer in self.observers:
+            observer.call_finished(call)
+
+    def _call(self, qargs, call=None):
+        if self.retry is None:
+            return self._attempt(qargs, call)
+        return self.retry.call(lambda: self._attempt(qargs, call), self.host,
+                               qargs.get('Operation'), call)
+
+    def _attempt(self, qargs, call=None):
+        """
+        Sends the request for ``qargs`` once and returns the parsed response.
+        """
+        if call is None:
+            url = self._build_url(**qargs)
+        else:
+            with call.measure('sign'):
+                url = self._build_url(**qargs)
         try:
             fp = self._fetch(url)
+        except ServerError:
+            e = sys.exc_info()[1]  # Python 2/3 compatible
+            response, e.response = e.response, None
+            if response is not None:
+                self._parse_server_error(response)
+                e.retry_after = retry_after(response)
+            raise e
+        return self._parse_response(fp)
+
+    def _parse_server_error(self, fp):
+        """
+        Raises the error if the body of a server error response (e.g. 503 when
+        throttled) is an error message of Amazon's. Anything else (an HTML
+        page from a proxy, a truncated body) is ignored.
+        """
+        try:
+            self._parse_response(fp)
+        except AWSError:
+            raise
+        except Exception:
+            pass
+
+    def _parse_response(self, fp):
+        """
+        Parses ``fp``. Errors are given the ``retry_after`` hint sent with the
+        response.
+        """
+        try:
             return self._parse(fp)
-        except HTTPError:
-            # Some HTTP send a more detailed error message as body which can be
-            # parsed too.
-            # - 400 (Bad Request)
-            # - 403 (Unauthorised)
-            # - 410 (Gone)
-            # - 503 (Service unavailable)
+        except AWSError:
             e = sys.exc_info()[1]  # Python 2/3 compatible
-            if e.code in (400, 403, 410, 503):
-                return self._parse(e.fp)
-            if e.code == 500:
-                raise InternalError
+            e.retry_after = retry_after(fp)
             raise
 
     def item_lookup(self, *ids, **params):
@@ -425,6 +631,85 @@ class API (object):
         except InvalidResponseGroup:
             raise _e(InvalidResponseGroup, params.get('ResponseGroup'))
 
+    def bulk_item_lookup(self, ids, **params):
+        """
+        Looks up an arbitrary number of items. Unlike :meth:`item_lookup`, the
+        item identifiers can be any iterable (of any length). They are packed
+        into as few requests as possible: up to :const:`MAX_ITEM_IDS` IDs per
+        ``ItemLookup`` and :const:`MAX_BATCH_REQUESTS` lookups per HTTP call
+        using a batch request. For ASINs that are 20 items per request. ::
+
+            >>> for asin, item, error in api.bulk_item_lookup(asins):
+            ...     if error is None:
+            ...         print '%s (%s)' % (item.ItemAttributes.Title, asin)
+
+        Results are yielded as ``(item_id, item, error)`` tuples in the order
+        of ``ids`` as soon as each request is answered. ``item`` is ``None`` if
+        the ID could not be looked up, in which case ``error`` holds the
+        :exc:`~amazonproduct.errors.AWSError` explaining why. Errors affecting
+        the request as a whole (e.g. an invalid ``ResponseGroup``) are raised.
+
+        Other IdTypes than ``ASIN`` (e.g. ``ISBN`` or ``EAN``) may match more
+        than one item in which case one tuple is yielded for each match. Since
+        these items cannot be told apart by ID, only one ID is sent per lookup
+        (2 per HTTP call).
+
+        All other ``params`` are shared by all lookups.
+
+        .. versionadded:: 0.3
+
+        :param ids: iterable of item identifiers.
+        """
+        params.pop('paginate', None)
+        id_type = params.get('IdType', 'ASIN')
+        per_lookup = self.MAX_ITEM_IDS if id_type == 'ASIN' else 1
+        ids = iter(ids)
+        while True:
+            chunk = list(islice(ids, per_lookup * self.MAX_BATCH_REQUESTS))
+            if not chunk:
+                break
+            lookups = [chunk[i:i+per_lookup]
+                       for i in range(0, len(chunk), per_lookup)]
+
+            batch = self.batch(**params)
+            for lookup in lookups:
+                batch.item_lookup(*lookup)
+
+            try:
+                root = self.call(**batch.build())
+                error = None
+            except (InvalidParameterValue, NoExactMatchesFound):
+                error = sys.exc_info()[1]  # Python 2/3 compatible
+                root = error.xml
+            except InvalidSearchIndex:
+                raise _e(InvalidSearchIndex, params.get('SearchIndex'))
+            except InvalidResponseGroup:
+                raise _e(InvalidResponseGroup, params.get('ResponseGroup'))
+
+            # one list of (ASIN, item) per lookup
+            groups = self.processor.parse_items(root)
+            groups += [[]] * (len(lookups) - len(groups))
+
+            if id_type == 'ASIN':
+                found = dict((asin.upper(), item)
+                             for group in groups for asin, item in group)
+                for item_id in chunk:
+                    item = found.get(item_id.upper())
+                    if item is not None:
+                        yield item_id, item, None
+                    else:
+                        yield item_id, None, _missing_item_error(
+                            item_id, error)
+            else:
+                for no, lookup in enumerate(lookups):
+                    item_id = lookup[0]
+                    items = groups[no]
+                    for _, item in items:
+                        yield item_id, item, None
+                    if not items:
+                        yield item_id, None, _missing_item_error(
+                            item_id, error)
+
     def item_search(self, search_index, paginate=ITEMS_PAGINATOR, **params):
         """
         .. versionchanged:: 2011-08-01
@@ -932,6 +1217,39 @@ class API (object):
     seller_lookup = deprecated_operation
     seller_listing_lookup = seller_listing_search = deprecated_operation
 
-    #: MultiOperation is supported outside this API
-    multi_operation = None
+    def batch(self, **shared):
+        """
+        Returns a :class:`~amazonproduct.batch.BatchRequest` which collects
+        several requests to be sent in one HTTP call. The results are returned
+        in the order the requests were added::
+
+            >>> batch = api.batch(ItemLookup={'ResponseGroup': 'Small'})
+            >>> batch.item_lookup('0201896834').item_lookup('0201896842')
+            >>> batch.item_search('Books', Keywords='Python')
+            >>> vol1, vol2, search = batch.execute()
 
+        There may be up to :const:`MAX_BATCH_REQUESTS` requests per operation.
+
+        .. versionadded:: 0.3
+
+        :param shared: parameters shared by the requests of an operation,
+          passed as a ``dict`` per operation (e.g. ``ItemLookup={...}``).
+          Other parameters are sent with every operation (see
+          :class:`~amazonproduct.batch.BatchRequest`).
+        """
+        return BatchRequest(self, **shared)
+
+    #: MultiOperation is done with batch requests
+    multi_operation = batch
+
+
+def _missing_item_error(item_id, error):
+    """
+    Returns the error to report for an item ID which is missing from the
+    response of a bulk lookup. ``error`` is the one raised for the whole
+    request (if any) and may refer to another ID.
+    """
+    if isinstance(error, InvalidParameterValue):
+        return InvalidParameterValue('ItemId', item_id,
+                                     code=error.code, xml=error.xml)
+    return error or NoExactMatchesFound(item_id)
@@ -0,0 +1,184 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Support for batch requests and MultiOperation.
+
+Amazon allows to combine up to two requests of the same operation (*batch
+request*) and requests of different operations (*MultiOperation*) in one HTTP
+call. Use :meth:`API.batch() <amazonproduct.api.API.batch>` to collect them::
+
+    batch = api.batch(ItemLookup={'ResponseGroup': 'Small'})
+    batch.item_lookup('0201896834')
+    batch.item_lookup('0201896842')
+    batch.browse_node_lookup(541686)
+    first, second, node = batch.execute()
+
+See http://docs.aws.amazon.com/AWSECommerceService/latest/DG/BatchandMultipleOperationRequests.html
+"""
+
+from collections import defaultdict
+
+from amazonproduct.errors import ExceededMaxBatchRequestsPerOperation
+
+
+def _value(val):
+    """
+    Lists (e.g. of response groups) are sent as comma-separated values.
+    """
+    if isinstance(val, list):
+        return ','.join(val)
+    return val
+
+
+class BatchRequest (object):
+
+    """
+    Collects requests which are then sent to Amazon in a single HTTP call.
+
+    Parameters passed to the constructor are shared by several requests (they
+    are sent as ``<Operation>.Shared.<Parameter>``). Each request is encoded
+    as ``<Operation>.<N>.<Parameter>``. A request consisting of a single
+    operation is sent in the normal format.
+    """
+
+    def __init__(self, api, **shared):
+        """
+        :param api: :class:`~amazonproduct.api.API` instance used to send the
+          request.
+        :param shared: parameters shared by the requests of one operation,
+          passed as a ``dict`` named after the operation (e.g.
+          ``ItemLookup={'ResponseGroup': 'Small'}``). Any other parameter is
+          shared by *all* operations, which must all accept it then.
+        """
+        self.api = api
+        self.shared = {}  # parameters shared by all operations
+        self.operations = {}  # parameters shared by requests of an operation
+        for key, val in shared.items():
+            if isinstance(val, dict):
+                self.operations[key] = val
+            else:
+                self.shared[key] = val
+        self.requests = []
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s) at %s>' % (
+            self.__class__.__name__, ', '.join(
+                operation for operation, _ in self.requests), hex(id(self)))
+
+    def add(self, operation, **params):
+        """
+        Adds a request for ``operation`` with parameters ``params``. Returns
+        the batch request itself so that calls can be chained.
+
+        :raises: :exc:`~amazonproduct.errors.ExceededMaxBatchRequestsPerOperation`
+          if there are already :const:`~amazonproduct.api.API.MAX_BATCH_REQUESTS`
+          requests for ``operation``.
+        """
+        count = sum(1 for op, _ in self.requests if op == operation)
+        if count >= self.api.MAX_BATCH_REQUESTS:
+            raise ExceededMaxBatchRequestsPerOperation(operation)
+        self.requests.append((operation, params))
+        return self
+
+    def item_lookup(self, *ids, **params):
+        """
+        Adds an ``ItemLookup`` request (see
+        :meth:`~amazonproduct.api.API.item_lookup`).
+        """
+        if ids:
+            params['ItemId'] = ','.join(ids)
+        return self.add('ItemLookup', **params)
+
+    def item_search(self, search_index, **params):
+        """
+        Adds an ``ItemSearch`` request (see
+        :meth:`~amazonproduct.api.API.item_search`).
+        """
+        return self.add('ItemSearch', SearchIndex=search_index, **params)
+
+    def similarity_lookup(self, *ids, **params):
+        """
+        Adds a ``SimilarityLookup`` request (see
+        :meth:`~amazonproduct.api.API.similarity_lookup`).
+        """
+        return self.add('SimilarityLookup', ItemId=','.join(ids), **params)
+
+    def browse_node_lookup(self, browse_node_id, response_group=None,
+                           **params):
+        """
+        Adds a ``BrowseNodeLookup`` request (see
+        :meth:`~amazonproduct.api.API.browse_node_lookup`).
+        """
+        return self.add('BrowseNodeLookup', BrowseNodeId=browse_node_id,
+                        ResponseGroup=response_group, **params)
+
+    def _shared(self, operation):
+        params = dict(self.shared)
+        params.update(self.operations.get(operation, {}))
+        return params
+
+    def build(self):
+        """
+        Returns the query parameters for :meth:`~amazonproduct.api.API.call`.
+        """
+        if not self.requests:
+            raise ValueError('Batch request is empty!')
+
+        if len(self.requests) == 1:
+            operation, params = self.requests[0]
+            qargs = self._shared(operation)
+            qargs.update(params)
+            qargs['Operation'] = operation
+            return qargs
+
+        operations = []
+        counters = defaultdict(int)
+        qargs = {}
+        for operation, params in self.requests:
+            if operation not in counters:
+                operations.append(operation)
+                for key, val in self._shared(operation).items():
+                    qargs['%s.Shared.%s' % (operation, key)] = _value(val)
+            counters[operation] += 1
+            for key, val in params.items():
+                qargs['%s.%i.%s' % (
+                    operation, counters[operation], key)] = _value(val)
+        qargs['Operation'] = ','.join(operations)
+        return qargs
+
+    def split(self, root):
+        """
+        Splits a parsed response into the results of the individual requests
+        (using the API's processor). Returns a list with one result node per
+        request in the order they were added. Requests without a result are
+        represented by ``None``.
+
+        This is useful if :meth:`execute` failed because of an error in one of
+        the requests: the response can still be accessed via the exception's
+        ``xml`` attribute. ::
+
+            try:
+                results = batch.execute()
+            except AWSError as e:
+                results = batch.split(e.xml)
+        """
+        results = defaultdict(list)
+        for operation, node in self.api.processor.parse_batch(root):
+            results[operation].append(node)
+        for nodes in results.values():
+            nodes.reverse()
+        return [results[operation].pop() if results[operation] else None
+                for operation, _ in self.requests]
+
+    def execute(self):
+        """
+        Sends all collected requests and returns their results (see
+        :meth:`split`).
+        """
+        return self.split(self.api.call(**self.build()))
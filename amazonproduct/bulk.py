@@ -0,0 +1,272 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Running large numbers of API calls for several locales in parallel.
+
+Amazon limits requests per marketplace, so an :class:`~amazonproduct.api.API`
+instance (which is bound to one locale) can use only a fraction of your
+quota. A :class:`BulkExecutor` runs jobs ``(locale, operation, params)`` on a
+pool of threads (or processes) with one API instance, rate limiter and
+connection pool per locale::
+
+    jobs = [(locale, 'ItemLookup', {'ItemId': asin, 'ResponseGroup': 'Offers'})
+            for locale in ('de', 'fr', 'uk') for asin in asins]
+    with BulkExecutor(workers_per_locale=2) as executor:
+        for job, result, error in executor.run(jobs):
+            if error is None:
+                update_prices(job[0], result)
+
+Results are yielded as soon as they arrive (not in the order of the jobs).
+"""
+
+from collections import defaultdict, deque
+import os
+import tempfile
+import threading
+import uuid
+
+from amazonproduct.api import API, HOSTS
+from amazonproduct.errors import UnknownLocale
+from amazonproduct.throttling import FileBackend, TokenBucket
+from amazonproduct.transport import SessionTransport
+
+#: number of jobs read ahead of those being run
+DEFAULT_BACKLOG = 1000
+
+
+class BulkExecutor (object):
+
+    """
+    Runs API calls on a pool of threads (or processes). Calls for the same
+    locale share one API instance with its own
+    :class:`~amazonproduct.throttling.TokenBucket` and
+    :class:`~amazonproduct.transport.SessionTransport`; no more than
+    ``workers_per_locale`` of them are run at the same time, so one busy
+    locale cannot hold up the others.
+
+    With ``processes=True`` every worker process has its own API instances.
+    Their rate limits are shared through a
+    :class:`~amazonproduct.throttling.FileBackend` (unless another ``backend``
+    is given). Results and errors must be picklable then, which rules out
+    processors returning :mod:`xml.etree.ElementTree` elements.
+    """
+
+    def __init__(self, workers_per_locale=2, max_workers=None,
+                 processes=False, rate=None, burst=1, backend=None,
+                 backlog=DEFAULT_BACKLOG, api_class=API, **kwargs):
+        """
+        :param workers_per_locale: maximum number of calls run at the same
+          time for one locale.
+        :param max_workers: size of the pool (default: ``workers_per_locale``
+          for every locale in :data:`~amazonproduct.api.HOSTS`).
+        :param processes: use a process pool instead of threads.
+        :param rate: requests per second allowed per locale (default:
+          ``api_class.REQUESTS_PER_SECOND``).
+        :param burst: maximum burst of requests per locale.
+        :param backend: :class:`~amazonproduct.throttling.BaseBackend` keeping
+          the rate limits (one bucket per locale).
+        :param backlog: number of jobs read ahead of those being run. While
+          a locale has idle workers, up to ``backlog`` jobs per locale are
+          read ahead to find work for it.
+        :param api_class: API class (a subclass of
+          :class:`~amazonproduct.api.API`) to use.
+        :param kwargs: passed to ``api_class`` (e.g. ``cfg`` or
+          ``processor``).
+        """
+        if workers_per_locale < 1:
+            raise ValueError('Need at least one worker per locale!')
+        self.workers_per_locale = workers_per_locale
+        self.max_workers = max_workers or workers_per_locale * len(HOSTS)
+        self.processes = processes
+        self.rate = rate or api_class.REQUESTS_PER_SECOND
+        self.burst = burst
+        self.backlog = backlog
+        self.api_class = api_class
+        self.api_kwargs = kwargs
+
+        self._throttle_file = None
+        if processes and backend is None:
+            fd, self._throttle_file = tempfile.mkstemp(suffix='.throttle')
+            os.close(fd)
+            backend = FileBackend(self._throttle_file)
+        self.backend = backend
+
+        self.apis = {}  #: API instance by locale (thread pool only)
+        self._transports = []
+        self._cancelled = threading.Event()
+        self._pool = None
+        self._token = uuid.uuid4().hex  # identifies settings in processes
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s x %s) at %s>' % (self.__class__.__name__,
+            'processes' if self.processes else 'threads', self.max_workers,
+            hex(id(self)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _settings(self):
+        return (self.api_class, self.api_kwargs, self.rate, self.burst,
+                self.backend, self.workers_per_locale)
+
+    def api(self, locale):
+        """
+        Returns the API instance used for ``locale`` (thread pool only).
+        """
+        try:
+            return self.apis[locale]
+        except KeyError:
+            api = _create_api(locale, *self._settings())
+            self._transports.append(api.transport)
+            return self.apis.setdefault(locale, api)
+
+    def _submit(self, job):
+        from concurrent.futures import Future
+        locale, operation, params = job
+        if locale not in HOSTS:
+            future = Future()
+            future.set_exception(UnknownLocale(locale))
+            return future
+        if self.processes:
+            return self._pool.submit(_run_in_process, self._token,
+                self._settings(), locale, operation, params)
+        api = self.api(locale)
+        return self._pool.submit(_run, api, operation, params)
+
+    def run(self, jobs):
+        """
+        Runs ``jobs`` (any iterable of ``(locale, operation, params)`` tuples
+        where ``operation`` is the name of an Amazon operation, e.g.
+        ``'ItemLookup'``, and ``params`` a ``dict`` of its parameters) and
+        yields ``(job, result, error)`` tuples as the calls are finished.
+        ``result`` is what :meth:`~amazonproduct.api.API.call` returned or
+        ``None`` if an exception was raised, in which case ``error`` holds it.
+
+        Jobs are read from ``jobs`` only as needed (see ``backlog``) and need
+        not be interleaved by locale. Once the iteration is stopped (or
+        :meth:`cancel` is called), no further calls are started; calls
+        already running are waited for but their results are dropped.
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+        if self.processes:
+            from concurrent.futures import ProcessPoolExecutor as Executor
+        else:
+            from concurrent.futures import ThreadPoolExecutor as Executor
+
+        self._cancelled.clear()
+        self._pool = Executor(self.max_workers)
+        jobs = iter(jobs)
+        running = {}  # future -> job
+        per_locale = defaultdict(int)
+        waiting = {}  # locale -> deque of jobs
+        queued = [0]  # jobs in waiting
+
+        def start(job):
+            future = self._submit(job)
+            running[future] = job
+            per_locale[job[0]] += 1
+
+        def idle():
+            return any(per_locale[locale] < self.workers_per_locale
+                       for locale in HOSTS)
+
+        def hungry():
+            # if jobs are grouped by locale, the other locales' jobs are
+            # found only by reading further ahead (up to backlog per locale)
+            if queued[0] < self.backlog:
+                return True
+            return queued[0] < self.backlog * len(HOSTS) and idle()
+
+        def schedule():
+            for locale, queue in waiting.items():
+                while queue and per_locale[locale] < self.workers_per_locale:
+                    start(queue.popleft())
+                    queued[0] -= 1
+            while hungry():
+                try:
+                    job = next(jobs)
+                except StopIteration:
+                    return
+                locale, operation, params = job
+                if per_locale[locale] < self.workers_per_locale:
+                    start(job)
+                else:
+                    waiting.setdefault(locale, deque()).append(job)
+                    queued[0] += 1
+
+        try:
+            schedule()
+            while running and not self._cancelled.is_set():
+                done, _ = wait(list(running), timeout=.1,
+                               return_when=FIRST_COMPLETED)
+                finished = []
+                for future in done:
+                    job = running.pop(future)
+                    per_locale[job[0]] -= 1
+                    finished.append((job, future))
+                if not self._cancelled.is_set():
+                    schedule()
+                for job, future in finished:
+                    error = future.exception()
+                    if error is None:
+                        yield job, future.result(), None
+                    else:
+                        yield job, None, error
+        finally:
+            for future in running:
+                future.cancel()
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def cancel(self):
+        """
+        Stops :meth:`run` (from any thread) after the calls which are already
+        running have finished.
+        """
+        self._cancelled.set()
+
+    def close(self):
+        """
+        Closes the connections of all API instances.
+        """
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+        self.apis = {}
+        if self._throttle_file is not None:
+            try:
+                os.remove(self._throttle_file)
+            except OSError:  # pragma: no cover
+                pass
+            self._throttle_file = None
+
+
+def _run(api, operation, params):
+    return api.call(Operation=operation, **params)
+
+
+def _create_api(locale, api_class, api_kwargs, rate, burst, backend,
+                connections):
+    throttle = TokenBucket(rate, burst, backend=backend, key=locale)
+    transport = SessionTransport(pool_maxsize=connections)
+    return api_class(locale=locale, throttle=throttle, transport=transport,
+                     **api_kwargs)
+
+
+# API instances of a worker process by executor and locale
+_process_apis = {}
+
+
+def _run_in_process(token, settings, locale, operation, params):
+    key = (token, locale)
+    try:
+        api = _process_apis[key]
+    except KeyError:
+        api = _process_apis[key] = _create_api(locale, *settings)
+    return _run(api, operation, params)
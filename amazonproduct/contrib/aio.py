@@ -0,0 +1,322 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+API for use with :mod:`asyncio` (Python 3.5+). It needs aiohttp_ to be
+installed.
+
+.. _aiohttp: http://aiohttp.readthedocs.org/
+"""
+
+import asyncio
+from io import BytesIO
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from amazonproduct.api import API, USER_AGENT
+from amazonproduct.errors import *
+from amazonproduct.retry import retry_after
+
+
+class _Response (BytesIO):
+
+    """
+    Body and headers of an HTTP response which has been read completely.
+    """
+
+    def __init__(self, content, headers):
+        BytesIO.__init__(self, content)
+        self.headers = headers
+
+
+class AsyncAPI (API):
+
+    """
+    API whose operations are coroutines. Requests are sent with a
+    non-blocking HTTP client, so many of them can be in flight at once without
+    needing a thread each. ::
+
+        async def main():
+            async with AsyncAPI(locale='de') as api:
+                roots = await asyncio.gather(*[
+                    api.item_lookup(asin) for asin in asins])
+
+    Requests are still throttled (see :attr:`~API.throttle`) and retried
+    according to the API's :class:`~amazonproduct.retry.RetryPolicy` (waiting
+    without blocking the event loop). Responses are parsed in an executor so
+    that large XML documents do not block the event loop.
+
+    The following operations are supported:
+
+    * :meth:`item_lookup`
+    * :meth:`item_search`
+    * :meth:`similarity_lookup`
+    * :meth:`browse_node_lookup`
+    * :meth:`cart_create`, :meth:`cart_add`, :meth:`cart_modify`,
+      :meth:`cart_get` and :meth:`cart_clear`
+
+    .. note:: Results are never paginated. Use parameter ``ItemPage`` to fetch
+       a particular page.
+    """
+
+    #: Maximum number of simultaneous connections
+    CONNECTIONS = 100
+
+    def __init__(self, *args, **kwargs):
+        """
+        Takes the same arguments as :class:`~amazonproduct.api.API` and
+        additionally:
+
+        :param executor: :class:`concurrent.futures.Executor` used for
+          parsing responses (default: the event loop's default executor).
+        :param session: :class:`aiohttp.ClientSession` to use. If omitted, one
+          is created on first use and closed again with :meth:`close`.
+        """
+        if aiohttp is None:  # pragma: no cover
+            raise ImportError('%s needs aiohttp!' % self.__class__.__name__)
+        self.executor = kwargs.pop('executor', None)
+        self._session = kwargs.pop('session', None)
+        self._owns_session = self._session is None
+        API.__init__(self, *args, **kwargs)
+
+    @property
+    def session(self):
+        """
+        :class:`aiohttp.ClientSession` used for all requests.
+        """
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.CONNECTIONS),
+                timeout=aiohttp.ClientTimeout(total=self.TIMEOUT),
+                headers={'User-Agent': USER_AGENT})
+        return self._session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """
+        Closes the HTTP session unless it was passed to the constructor.
+        """
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+        API.close(self)
+
+    def _create_transport(self):
+        return None  # requests are sent with aiohttp
+
+    async def _fetch(self, url):
+        """
+        Calls the Amazon Product Advertising API and returns the response
+        body.
+
+        :raises: :exc:`~amazonproduct.errors.ServerError` if Amazon answered
+          with a status of 500 or above.
+        """
+        await self.throttle.acquire_async()
+        async with self.session.get(url) as response:
+            content = await response.read()
+            if response.status >= 500:
+                raise ServerError(response.status,
+                                  _Response(content, response.headers))
+            return content
+
+    async def _parse(self, content):
+        """
+        Parses the response body in the executor.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, API._parse, self, BytesIO(content))
+
+    async def call(self, **qargs):
+        """
+        Coroutine version of :meth:`API.call`.
+
+        If the API has observers, the stages ``sign``, ``fetch`` (including
+        waiting for the rate limiter and reading the response), ``parse``
+        (including mapping errors) and ``backoff`` are measured. Since other
+        coroutines run in the meantime, these are wall-clock times.
+        """
+        if not self.observers:
+            return await self._call(qargs)
+
+        call = self._call_started(qargs)
+        try:
+            root = await self._call(qargs, call)
+        except Exception as e:
+            self._call_finished(call, type(e))
+            raise
+        self._call_finished(call)
+        return root
+
+    async def _call(self, qargs, call=None):
+        """
+        Coroutine version of :meth:`API._call
+        <amazonproduct.api.API._call>`.
+        """
+        policy = self.retry
+        if policy is None:
+            return await self._attempt(qargs, call)
+        breaker = policy._started(self.host)
+        tries = 0
+        while True:
+            tries += 1
+            policy._trying(breaker, self.host)
+            try:
+                result = await self._attempt(qargs, call)
+            except Exception as e:
+                delay = policy._failed(
+                    breaker, e, tries, qargs.get('Operation'))
+                if delay is None:
+                    raise
+            else:
+                policy._succeeded(breaker)
+                return result
+
+            if call is None:
+                await asyncio.sleep(delay)
+            else:
+                call.retries += 1
+                with call.measure('backoff'):
+                    await asyncio.sleep(delay)
+
+    async def _attempt(self, qargs, call=None):
+        """
+        Sends the request for ``qargs`` once and returns the parsed response.
+        The body of a server error is mapped if it is an error message of
+        Amazon's.
+        """
+        if call is None:
+            url = self._build_url(**qargs)
+            try:
+                content = await self._fetch(url)
+            except ServerError as e:
+                await self._parse_server_error(e)
+                raise
+            return await self._parse(content)
+
+        with call.measure('sign'):
+            url = self._build_url(**qargs)
+        try:
+            with call.measure('fetch'):
+                content = await self._fetch(url)
+        except ServerError as e:
+            with call.measure('parse'):
+                await self._parse_server_error(e)
+            raise
+        call.response_size = len(content)
+        with call.measure('parse'):
+            return await self._parse(content)
+
+    async def _parse_server_error(self, error):
+        response, error.response = error.response, None
+        if response is None:
+            return
+        error.retry_after = retry_after(response)
+        try:
+            await self._parse(response.getvalue())
+        except AWSError as e:
+            e.retry_after = error.retry_after
+            raise
+        except Exception:
+            pass
+
+    async def item_lookup(self, *ids, **params):
+        """
+        Coroutine version of :meth:`API.item_lookup`.
+        """
+        params.pop('paginate', None)
+        try:
+            return await self.call(Operation='ItemLookup',
+                                   ItemId=','.join(ids), **params)
+        except InvalidSearchIndex:
+            raise _e(InvalidSearchIndex, params.get('SearchIndex'))
+        except InvalidResponseGroup:
+            raise _e(InvalidResponseGroup, params.get('ResponseGroup'))
+
+    async def item_search(self, search_index, **params):
+        """
+        Coroutine version of :meth:`API.item_search`.
+        """
+        params.pop('paginate', None)
+        try:
+            return await self.call(Operation='ItemSearch',
+                                   SearchIndex=search_index, **params)
+        except InvalidSearchIndex:
+            raise _e(InvalidSearchIndex, search_index)
+        except InvalidResponseGroup:
+            raise _e(InvalidResponseGroup, params.get('ResponseGroup'))
+
+    async def similarity_lookup(self, *ids, **params):
+        """
+        Coroutine version of :meth:`API.similarity_lookup`.
+        """
+        try:
+            return await self.call(Operation='SimilarityLookup',
+                                   ItemId=','.join(ids), **params)
+        except AWSError as e:
+            if e.code == 'AWS.ECommerceService.NoSimilarities':
+                asin = self._reg('no-similarities').search(e.msg).group('ASIN')
+                raise _e(NoSimilarityForASIN, asin)
+            raise
+
+    async def browse_node_lookup(self, browse_node_id, response_group=None,
+                                 **params):
+        """
+        Coroutine version of :meth:`API.browse_node_lookup`.
+        """
+        try:
+            return await self.call(Operation='BrowseNodeLookup',
+                BrowseNodeId=browse_node_id, ResponseGroup=response_group,
+                **params)
+        except AWSError as e:
+            if e.code == 'AWS.InvalidResponseGroup':
+                raise _e(InvalidResponseGroup, params.get('ResponseGroup'))
+            raise
+
+    async def cart_create(self, items, **params):
+        """
+        Coroutine version of :meth:`API.cart_create`.
+        """
+        params.update(self._convert_cart_items(items))
+        return await self.call(Operation='CartCreate', **params)
+
+    async def cart_add(self, cart_id, hmac, items, **params):
+        """
+        Coroutine version of :meth:`API.cart_add`.
+        """
+        params.update({'CartId': cart_id, 'HMAC': hmac})
+        params.update(self._convert_cart_items(items))
+        return await self.call(Operation='CartAdd', **params)
+
+    async def cart_modify(self, cart_id, hmac, item_ids, **params):
+        """
+        Coroutine version of :meth:`API.cart_modify`.
+        """
+        params.update({'CartId': cart_id, 'HMAC': hmac})
+        params.update(self._convert_cart_items(item_ids, key='CartItemId'))
+        return await self.call(Operation='CartModify', **params)
+
+    async def cart_get(self, cart_id, hmac, **params):
+        """
+        Coroutine version of :meth:`API.cart_get`.
+        """
+        params.update({'CartId': cart_id, 'HMAC': hmac})
+        return await self.call(Operation='CartGet', **params)
+
+    async def cart_clear(self, cart_id, hmac, **params):
+        """
+        Coroutine version of :meth:`API.cart_clear`.
+        """
+        params.update({'CartId': cart_id, 'HMAC': hmac})
+        return await self.call(Operation='CartClear', **params)
@@ -1,67 +1,1381 @@
+"""
+Response caches for the Amazon Product Advertising API.
+
+Responses are stored as raw bytes in a *cache backend*. Depending on your needs
+use one of the following (or combine them with :class:`TieredCache`):
+
+* :class:`MemoryCache` keeps the most recently used responses in memory,
+* :class:`FileCache` stores responses on disk (bounded in size and age),
+* :class:`SQLiteCache` stores responses in an SQLite database which can be
+  queried (and invalidated) by operation, locale or item ID,
+* :class:`SharedCache` uses a memcached-like server which can be shared
+  between processes and hosts (:class:`LocalClient` is an in-process stand-in
+  for development and testing).
+
+Entries can be compressed by wrapping a backend in a :class:`CompressedCache`.
+
+Any API class can use a cache by mixing in :class:`CachingMixin`::
+
+    class CachingAPI (CachingMixin, API):
+        pass
+
+    api = CachingAPI(locale='de', cache=MemoryCache(), cachetime=3600)
+"""
+
+from collections import OrderedDict, defaultdict
+from io import BytesIO
+import errno
+import mmap
 import os
-import time
+import re
+import sqlite3
+import struct
+import sys
 import tempfile
-from lxml import etree
+import threading
+import time
+import zlib
 
 try: # make it python2.4 compatible!
     from hashlib import md5 # pylint: disable-msg=E0611
 except ImportError: # pragma: no cover
     from md5 import new as md5
 
+# support Python 2 and Python 3 without conversion
+try:
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    from urlparse import urlparse, parse_qsl
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
 from amazonproduct.api import API
+from amazonproduct.signing import request_key
 
 DEFAULT_CACHE_DIR = tempfile.mkdtemp(prefix='amzn_')
 
-class ResponseCachingAPI (API):
 
+def _read_all(fp):
     """
-    This API stores each response from Amazon in an XML file and uses these for
-    subsequent requests. File are name with a hash based on submitted parameters
-    in URL (excluding Timestamp and Signature).
+    Reads the rest of ``fp`` (memory maps need a size on Python 2).
+    """
+    if isinstance(fp, mmap.mmap):
+        return fp.read(len(fp) - fp.tell())
+    return fp.read()
 
-    Using this class is an excellent idea during development!
 
-    This class is based on code by Dmitry Chaplinsky
-    https://gist.github.com/657174
+class BaseCache (object):
+
+    """
+    Skeleton class for cache backends.
+
+    A backend maps keys (hex digests as returned by
+    :meth:`CachingMixin.cache_key`) to raw responses and the time they were
+    fetched. If you like to store responses elsewhere, subclass
+    :class:`BaseCache` and override the methods.
+    """
+
+    def get(self, key):
+        """
+        Returns ``(data, created)`` for ``key`` or ``None`` if it is not
+        cached. ``created`` is the time (in seconds since the epoch) at which
+        the response was fetched.
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def set(self, key, data, created=None):
+        """
+        Stores ``data`` (bytes) under ``key``. ``created`` defaults to now.
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def delete(self, key):
+        """
+        Removes ``key`` from the cache (if present).
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def open(self, key):
+        """
+        Returns ``(file-like object, created)`` for ``key`` or ``None`` if it
+        is not cached. Backends which can serve entries without copying them
+        (e.g. from a memory-mapped file) should override this.
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        # BytesIO shares the buffer with the bytes object until written to
+        return BytesIO(entry[0]), entry[1]
+
+    def writer(self, key, meta=None):
+        """
+        Returns a :class:`CacheWriter` to which an entry for ``key`` can be
+        written in chunks. Backends which can store chunks right away (e.g. in
+        a file) should override this.
+
+        :param meta: dict describing the request (``operation``, ``locale``
+          and ``item_ids``) which backends may store along with the entry.
+        """
+        return CacheWriter(self, key, meta)
+
+
+class CacheWriter (object):
+
+    """
+    Collects the chunks of an entry which is stored with :meth:`commit` (or
+    discarded with :meth:`abort`). This default implementation buffers all
+    chunks and passes them to :meth:`BaseCache.set`.
+    """
+
+    def __init__(self, cache, key, meta=None):
+        self.cache = cache
+        self.key = key
+        self.meta = meta or {}
+        self._chunks = []
+
+    def write(self, chunk):
+        self._chunks.append(chunk)
+
+    def commit(self, created=None):
+        """
+        Stores the entry.
+        """
+        self.cache.set(self.key, b''.join(self._chunks), created)
+        self._chunks = []
+
+    def abort(self):
+        """
+        Discards the entry.
+        """
+        self._chunks = []
+
+
+class MemoryCache (BaseCache):
+
+    """
+    Thread-safe in-process cache which keeps up to ``max_entries`` responses
+    and discards the least recently used ones first.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None, clock=time.time):
+        """
+        :param max_entries: maximum number of responses kept.
+        :param ttl: seconds after which entries are discarded (default: keep
+          them until they are displaced).
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if self.ttl is not None and entry[1] + self.ttl < self.clock():
+                return None
+            self._entries[key] = entry  # most recently used
+            return entry
+
+    def set(self, key, data, created=None):
+        if created is None:
+            created = self.clock()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (data, created)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileCache (BaseCache):
+
+    """
+    Stores each response in a file below ``path``. Files are spread over 256
+    sub-directories and written atomically so that several processes can share
+    a cache directory.
+
+    If ``max_size`` is given, the least recently written files are removed
+    whenever the total size of all responses exceeds it (until it has dropped
+    to ``low_water`` times ``max_size``). Files older than ``ttl`` are not
+    returned and can be removed with :meth:`purge`.
+
+    The total size is counted per process: the directory is scanned once and
+    only the files written by this process are added after that. If several
+    processes write to the same directory, the size limit is not exact; call
+    :meth:`prune` (e.g. from a cron job) to enforce it. Without ``max_size``
+    the directory is never scanned when writing.
+    """
+
+    #: fraction of ``max_size`` to which the cache is shrunk when full
+    low_water = 0.9
+
+    def __init__(self, path, max_size=None, ttl=None, clock=time.time):
+        """
+        :param path: cache directory. It will be created if necessary.
+        :param max_size: maximum total size of all responses in bytes.
+        :param ttl: maximum age of entries in seconds.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._index = None  # key -> (size, created), loaded on demand
+        self._size = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def _load_index(self):
+        """
+        Scans the cache directory once to find out which files are present.
+        """
+        self._index = {}
+        self._size = 0
+        for dirpath, _, filenames in os.walk(self.path):
+            for name in filenames:
+                if name.startswith('.'):
+                    continue  # incomplete file
+                try:
+                    stat = os.stat(os.path.join(dirpath, name))
+                except OSError:  # pragma: no cover
+                    continue  # removed by another process
+                self._index[name] = (stat.st_size, stat.st_mtime)
+                self._size += stat.st_size
+
+    @property
+    def size(self):
+        """
+        Total size of all cached responses in bytes.
+        """
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            return self._size
+
+    def get(self, key):
+        entry = self.open(key)
+        if entry is None:
+            return None
+        fp, created = entry
+        try:
+            return _read_all(fp), created
+        finally:
+            fp.close()
+
+    def open(self, key):
+        """
+        Returns the entry for ``key`` as read-only memory map (so that it is
+        not copied before it is parsed).
+        """
+        try:
+            fp = open(self._path(key), 'rb')
+        except IOError:
+            return None
+        with fp:
+            stat = os.fstat(fp.fileno())
+            created = stat.st_mtime
+            if self.ttl is not None and created + self.ttl < self.clock():
+                return None
+            if stat.st_size == 0:
+                return BytesIO(), created  # empty files cannot be mapped
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ), created
+
+    def set(self, key, data, created=None):
+        writer = self.writer(key)
+        writer.write(data)
+        writer.commit(created)
+
+    def writer(self, key, meta=None):
+        """
+        Returns a :class:`CacheWriter` which writes the chunks to a temporary
+        file right away. The file replaces the entry once it is committed.
+        """
+        return _FileWriter(self, key, meta)
+
+    def _added(self, key, size, created):
+        """
+        Accounts for a new file and evicts old ones if necessary.
+        """
+        with self._lock:
+            if self._index is None:
+                if self.max_size is None:
+                    return  # nothing to account for
+                self._load_index()
+            else:
+                self._forget(key)
+                self._index[key] = (size, created)
+                self._size += size
+            if self.max_size is not None and self._size > self.max_size:
+                self._evict(int(self.max_size * self.low_water))
+
+    def _forget(self, key):
+        size, _ = self._index.pop(key, (0, None))
+        self._size -= size
+
+    def _remove(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            e = sys.exc_info()[1]  # Python 2/3 compatible
+            if e.errno != errno.ENOENT:  # pragma: no cover
+                raise
+
+    def _evict(self, target):
+        """
+        Removes the oldest entries until the total size is below ``target``.
+        """
+        for key, _ in sorted(self._index.items(), key=lambda x: x[1][1]):
+            if self._size <= target:
+                break
+            self._remove(key)
+            self._forget(key)
+
+    def prune(self):
+        """
+        Scans the cache directory again (including files written by other
+        processes) and removes the least recently written files if the total
+        size exceeds ``max_size``.
+        """
+        if self.max_size is None:
+            return
+        with self._lock:
+            self._load_index()
+            if self._size > self.max_size:
+                self._evict(int(self.max_size * self.low_water))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+            if self._index is not None:
+                self._forget(key)
+
+    def purge(self):
+        """
+        Removes all entries older than ``ttl``.
+        """
+        if self.ttl is None:
+            return
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            expires = self.clock() - self.ttl
+            for key, (_, created) in list(self._index.items()):
+                if created < expires:
+                    self._remove(key)
+                    self._forget(key)
+
+    def clear(self):
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            for key in list(self._index):
+                self._remove(key)
+            self._index = {}
+            self._size = 0
+
+
+class _FileWriter (CacheWriter):
+
+    """
+    Writes an entry of a :class:`FileCache` to a temporary file which is
+    renamed once committed.
+    """
+
+    def __init__(self, cache, key, meta=None):
+        CacheWriter.__init__(self, cache, key, meta)
+        self.path = cache._path(key)
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # pragma: no cover
+                pass  # created by another thread or process
+        fd, self.tmp = tempfile.mkstemp(prefix='.', dir=directory)
+        self._fp = os.fdopen(fd, 'wb')
+        self.size = 0
+
+    def write(self, chunk):
+        self._fp.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self, created=None):
+        if created is None:
+            created = self.cache.clock()
+        try:
+            self._fp.close()
+            os.chmod(self.tmp, 0o644)  # mkstemp creates files private to user
+            os.utime(self.tmp, (created, created))
+            os.rename(self.tmp, self.path)
+        except:
+            self.abort()
+            raise
+        self.cache._added(self.key, self.size, created)
+
+    def abort(self):
+        self._fp.close()
+        try:
+            os.unlink(self.tmp)
+        except OSError:  # pragma: no cover
+            pass
+
+
+class SQLiteCache (BaseCache):
+
+    """
+    Stores responses in an SQLite database (in WAL mode, so that several
+    processes can read and write it at the same time). Along with each
+    response its operation, locale, item IDs, time of fetching and size are
+    recorded, so that entries can be inspected and invalidated by content::
+
+        cache = SQLiteCache('/var/cache/amazon.db')
+        cache.invalidate(item_id='0747532745')
+        cache.invalidate(operation='ItemSearch', before=time.time() - 3600)
+
+    Entries older than ``ttl`` are not returned and can be removed with
+    :meth:`purge`.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            operation TEXT,
+            locale TEXT,
+            created REAL NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_operation ON entries (operation);
+        CREATE INDEX IF NOT EXISTS entries_created ON entries (created);
+        CREATE TABLE IF NOT EXISTS entry_items (
+            item_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (item_id, key)
+        );
+        CREATE INDEX IF NOT EXISTS entry_items_key ON entry_items (key);
+    """
+
+    def __init__(self, path, ttl=None, clock=time.time, timeout=30):
+        """
+        :param path: path to the database file. It will be created if
+          necessary.
+        :param ttl: maximum age of entries in seconds.
+        :param timeout: seconds to wait for a lock held by another process.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(self.SCHEMA)
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self._lock:
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    @property
+    def size(self):
+        """
+        Total size of all cached responses in bytes.
+        """
+        with self._lock:
+            return self._db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT data, created FROM entries WHERE key = ?',
+                (key, )).fetchone()
+        if row is None:
+            return None
+        data, created = row
+        if self.ttl is not None and created + self.ttl < self.clock():
+            return None
+        return bytes(data), created
+
+    def set(self, key, data, created=None):
+        self._store(key, data, created, {})
+
+    def writer(self, key, meta=None):
+        return _SQLiteWriter(self, key, meta)
+
+    def _store(self, key, data, created, meta):
+        if created is None:
+            created = self.clock()
+        item_ids = set(meta.get('item_ids') or [])
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute(
+                    'DELETE FROM entry_items WHERE key = ?', (key, ))
+                self._db.execute(
+                    'INSERT OR REPLACE INTO entries '
+                    '(key, operation, locale, created, size, data) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, meta.get('operation'), meta.get('locale'), created,
+                     len(data), sqlite3.Binary(data)))
+                self._db.executemany(
+                    'INSERT INTO entry_items (item_id, key) VALUES (?, ?)',
+                    [(item_id, key) for item_id in item_ids])
+                self._db.execute('COMMIT')
+            except:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def _where(self, item_id=None, operation=None, locale=None, before=None):
+        clauses, args = [], []
+        if item_id is not None:
+            clauses.append(
+                'key IN (SELECT key FROM entry_items WHERE item_id = ?)')
+            args.append(item_id)
+        if operation is not None:
+            clauses.append('operation = ?')
+            args.append(operation)
+        if locale is not None:
+            clauses.append('locale = ?')
+            args.append(locale)
+        if before is not None:
+            clauses.append('created < ?')
+            args.append(before)
+        return clauses and ' WHERE ' + ' AND '.join(clauses) or '', args
+
+    def entries(self, **filters):
+        """
+        Returns a list of dicts describing all entries (without their
+        content). The same ``filters`` as for :meth:`invalidate` can be
+        used.
+        """
+        where, args = self._where(**filters)
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT key, operation, locale, created, size FROM entries'
+                + where + ' ORDER BY created', args).fetchall()
+        return [dict(zip(('key', 'operation', 'locale', 'created', 'size'),
+                         row)) for row in rows]
+
+    def invalidate(self, item_id=None, operation=None, locale=None,
+                   before=None):
+        """
+        Removes all entries matching the given criteria and returns their
+        number.
+
+        :param item_id: item ID (e.g. ASIN) which was part of the request.
+        :param operation: operation (e.g. ``'ItemLookup'``).
+        :param locale: locale (e.g. ``'de'``).
+        :param before: remove only entries fetched before this time (seconds
+          since the epoch).
+        """
+        where, args = self._where(item_id, operation, locale, before)
+        if not where:
+            raise ValueError('Use clear() to remove all entries!')
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute(
+                    'CREATE TEMP TABLE doomed AS SELECT key FROM entries'
+                    + where, args)
+                count = self._db.execute(
+                    'DELETE FROM entries WHERE key IN '
+                    '(SELECT key FROM doomed)').rowcount
+                self._db.execute(
+                    'DELETE FROM entry_items WHERE key IN '
+                    '(SELECT key FROM doomed)')
+                self._db.execute('DROP TABLE doomed')
+                self._db.execute('COMMIT')
+            except:
+                self._db.execute('ROLLBACK')
+                raise
+        return count
+
+    def purge(self):
+        """
+        Removes all entries older than ``ttl``.
+        """
+        if self.ttl is not None:
+            self.invalidate(before=self.clock() - self.ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            self._db.execute('DELETE FROM entries WHERE key = ?', (key, ))
+            self._db.execute('DELETE FROM entry_items WHERE key = ?', (key, ))
+            self._db.execute('COMMIT')
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            self._db.execute('DELETE FROM entries')
+            self._db.execute('DELETE FROM entry_items')
+            self._db.execute('COMMIT')
+
+
+class _SQLiteWriter (CacheWriter):
+
+    """
+    Collects the chunks of an entry and stores them with its metadata.
+    """
+
+    def commit(self, created=None):
+        self.cache._store(self.key, b''.join(self._chunks), created, self.meta)
+        self._chunks = []
+
+
+class LocalClient (object):
+
+    """
+    In-process stand-in for a memcached client (supporting the subset of
+    methods used by :class:`SharedCache`). Useful for development and tests.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._values.get(key, (None, None))
+            if expires and expires < self.clock():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, time=0):
+        with self._lock:
+            self._values[key] = (value, time and self.clock() + time)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+        return True
+
+    def flush_all(self):
+        with self._lock:
+            self._values.clear()
+
+
+class SharedCache (BaseCache):
+
+    """
+    Stores responses with a memcached client (e.g. from python-memcached or
+    pymemcache) so that they can be shared between processes and hosts. ::
+
+        import memcache
+        cache = SharedCache(memcache.Client(['127.0.0.1:11211']), ttl=3600)
+
+    Any object with methods ``get(key)``, ``set(key, value, time)`` and
+    ``delete(key)`` will do (see :class:`LocalClient`).
+
+    .. note:: :meth:`clear` calls ``flush_all()`` which removes *all* keys
+       from the server (not only those of this cache).
+    """
+
+    def __init__(self, client, ttl=0, prefix='amzn:', clock=time.time):
+        """
+        :param client: memcached client.
+        :param ttl: seconds after which the server discards entries (``0``
+          means never).
+        :param prefix: prefix for all keys.
+        """
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.clock = clock
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        # first line holds creation time
+        created, data = value.split(b'\n', 1)
+        return data, float(created)
+
+    def set(self, key, data, created=None):
+        if created is None:
+            created = self.clock()
+        value = ('%.6f\n' % created).encode('ascii') + data
+        self.client.set(self.prefix + key, value, self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        self.client.flush_all()
+
+
+class TieredCache (BaseCache):
+
+    """
+    Combines several caches, fastest first. Entries found in a lower tier are
+    copied to all tiers above it. ::
+
+        cache = TieredCache(MemoryCache(), FileCache('/var/cache/amazon'))
+    """
+
+    def __init__(self, *tiers):
+        self.tiers = tiers
+
+    def get(self, key):
+        for no, tier in enumerate(self.tiers):
+            entry = tier.get(key)
+            if entry is not None:
+                for upper in self.tiers[:no]:
+                    upper.set(key, *entry)
+                return entry
+        return None
+
+    def set(self, key, data, created=None):
+        for tier in self.tiers:
+            tier.set(key, data, created)
+
+    def delete(self, key):
+        for tier in self.tiers:
+            tier.delete(key)
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def open(self, key):
+        # the top tier can serve its entries without copying them
+        entry = self.tiers[0].open(key)
+        if entry is not None:
+            return entry
+        entry = self.get(key)
+        if entry is None:
+            return None
+        return BytesIO(entry[0]), entry[1]
+
+    def writer(self, key, meta=None):
+        return _TieredWriter(self, key, meta)
+
+
+class _TieredWriter (CacheWriter):
+
+    """
+    Writes an entry to all tiers of a :class:`TieredCache` at once.
+    """
+
+    def __init__(self, cache, key, meta=None):
+        CacheWriter.__init__(self, cache, key, meta)
+        self.writers = [tier.writer(key, meta) for tier in cache.tiers]
+
+    def write(self, chunk):
+        for writer in self.writers:
+            writer.write(chunk)
+
+    def commit(self, created=None):
+        for writer in self.writers:
+            writer.commit(created)
+
+    def abort(self):
+        for writer in self.writers:
+            writer.abort()
+
+
+class ZlibCodec (object):
+
+    """
+    Compresses entries with :mod:`zlib`. Compression of the many small (and
+    similar) responses from Amazon improves a lot when using a preset
+    ``dictionary`` (see :meth:`train`).
+
+    .. note:: Dictionaries need Python 3.3+.
+    """
+
+    #: identifies the codec in stored entries
+    tag = b'z'
+
+    def __init__(self, level=6, dictionary=None):
+        """
+        :param level: compression level (1-9).
+        :param dictionary: preset dictionary (bytes).
+        """
+        self.level = level
+        self.dictionary = dictionary
+
+    def compressor(self):
+        """
+        Returns an object with methods ``compress(data)`` and ``flush()``.
+        """
+        if self.dictionary:
+            return zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS,
+                                    9, zlib.Z_DEFAULT_STRATEGY, self.dictionary)
+        return zlib.compressobj(self.level)
+
+    def decompressor(self):
+        """
+        Returns an object with methods ``decompress(data)`` and ``flush()``.
+        """
+        if self.dictionary:
+            return zlib.decompressobj(zlib.MAX_WBITS, self.dictionary)
+        return zlib.decompressobj()
+
+    @classmethod
+    def train(cls, samples, size=32768):
+        """
+        Builds a dictionary of up to ``size`` bytes from the XML fragments
+        (tags and their text) which occur in most of the ``samples``. The most
+        valuable fragments are put at the end where zlib can reference them
+        with the shortest distances.
+        """
+        counts = defaultdict(int)
+        for sample in samples:
+            for fragment in set(_FRAGMENTS.findall(sample)):
+                counts[fragment] += 1
+        fragments = sorted(counts, key=lambda f: counts[f] * len(f))
+        dictionary = []
+        length = 0
+        for fragment in reversed(fragments):
+            if counts[fragment] < 2 or length + len(fragment) > size:
+                continue
+            dictionary.append(fragment)
+            length += len(fragment)
+        return b''.join(reversed(dictionary))
+
+
+_FRAGMENTS = re.compile(br'<[^<]+')
+
+
+class ZstdCodec (object):
+
+    """
+    Compresses entries with Zstandard_ (needs package zstandard). It is faster
+    than :class:`ZlibCodec` and compresses better, especially with a trained
+    ``dictionary`` (see :meth:`train`).
+
+    .. _Zstandard: https://pypi.python.org/pypi/zstandard
+    """
+
+    tag = b's'
+
+    def __init__(self, level=3, dictionary=None):
+        """
+        :param level: compression level (1-22).
+        :param dictionary: dictionary (bytes) as returned by :meth:`train`.
+        """
+        if zstandard is None:  # pragma: no cover
+            raise ImportError('%s needs zstandard!' % self.__class__.__name__)
+        self.level = level
+        self.dictionary = dictionary
+        if dictionary:
+            dict_data = zstandard.ZstdCompressionDict(dictionary)
+            self._compressor = zstandard.ZstdCompressor(
+                level=level, dict_data=dict_data)
+            self._decompressor = zstandard.ZstdDecompressor(
+                dict_data=dict_data)
+        else:
+            self._compressor = zstandard.ZstdCompressor(level=level)
+            self._decompressor = zstandard.ZstdDecompressor()
+
+    def compressor(self):
+        return self._compressor.compressobj()
+
+    def decompressor(self):
+        return self._decompressor.decompressobj()
+
+    @classmethod
+    def train(cls, samples, size=112640):
+        """
+        Trains a dictionary of up to ``size`` bytes on ``samples``.
+        """
+        if zstandard is None:  # pragma: no cover
+            raise ImportError('%s needs zstandard!' % cls.__name__)
+        return zstandard.train_dictionary(size, list(samples)).as_bytes()
+
+
+class _DecompressingReader (object):
+
+    """
+    File-like object decompressing ``fp`` as it is read.
+    """
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, fp, decompressor):
+        self.fp = fp
+        self.decompressor = decompressor
+        self._buffer = b''
+        self._pos = 0
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (
+                size < 0 or len(self._buffer) - self._pos < size):
+            chunk = self.fp.read(self.CHUNK_SIZE)
+            if chunk:
+                data = self.decompressor.decompress(chunk)
+            else:
+                data = self.decompressor.flush()
+                self._eof = True
+            if data:
+                # only keep what has not been read yet
+                self._buffer = self._buffer[self._pos:] + data
+                self._pos = 0
+        if size < 0:
+            end = len(self._buffer)
+        else:
+            end = min(self._pos + size, len(self._buffer))
+        data = self._buffer[self._pos:end]
+        self._pos = end
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+class _CompressingWriter (CacheWriter):
+
     """
+    Compresses chunks before passing them on to the writer of the wrapped
+    cache.
+    """
+
+    def __init__(self, cache, key, meta=None):
+        CacheWriter.__init__(self, cache, key, meta)
+        self.writer = cache.cache.writer(key, meta)
+        self.writer.write(cache.header)
+        self.compressor = cache.codec.compressor()
+
+    def write(self, chunk):
+        data = self.compressor.compress(chunk)
+        if data:
+            self.writer.write(data)
+
+    def commit(self, created=None):
+        self.writer.write(self.compressor.flush())
+        self.writer.commit(created)
+
+    def abort(self):
+        self.writer.abort()
+
+
+class CompressedCache (BaseCache):
+
+    """
+    Compresses the entries of another cache. ::
+
+        samples = [open(path, 'rb').read() for path in some_responses]
+        codec = ZstdCodec(dictionary=ZstdCodec.train(samples))
+        cache = CompressedCache(FileCache('/var/cache/amazon'), codec)
+
+    Entries are decompressed while being parsed. Each entry starts with a
+    short header identifying codec and dictionary. Entries written with a
+    different one (e.g. before a dictionary was re-trained) are treated as
+    missing.
+    """
+
+    MAGIC = b'AZ'
+
+    def __init__(self, cache, codec=None):
+        """
+        :param cache: :class:`BaseCache` used to store the compressed entries.
+        :param codec: :class:`ZlibCodec` (default) or :class:`ZstdCodec`.
+        """
+        self.cache = cache
+        self.codec = codec or ZlibCodec()
+        dict_id = zlib.crc32(self.codec.dictionary or b'') & 0xffffffff
+        self.header = self.MAGIC + self.codec.tag + struct.pack('>I', dict_id)
+
+    def open(self, key):
+        entry = self.cache.open(key)
+        if entry is None:
+            return None
+        fp, created = entry
+        if fp.read(len(self.header)) != self.header:
+            fp.close()
+            return None
+        return _DecompressingReader(fp, self.codec.decompressor()), created
+
+    def get(self, key):
+        entry = self.open(key)
+        if entry is None:
+            return None
+        fp, created = entry
+        try:
+            return fp.read(), created
+        finally:
+            fp.close()
+
+    def set(self, key, data, created=None):
+        writer = self.writer(key)
+        writer.write(data)
+        writer.commit(created)
+
+    def writer(self, key, meta=None):
+        return _CompressingWriter(self, key, meta)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class _Flight (object):
+
+    """
+    A request in progress. Identical requests wait for it to land and share
+    its response body (``data``) as long as the ``leader`` (the thread sending
+    it) is alive.
+    """
+
+    def __init__(self):
+        self.landed = threading.Event()
+        self.data = None
+        self.leader = threading.current_thread()
+
+
+class _TeeResponse (object):
+
+    """
+    Passes the response body on to the processor and writes every chunk read
+    to a :class:`CacheWriter` at the same time. The complete body is kept for
+    requests waiting for the same response (see :class:`_Flight`).
+    """
+
+    def __init__(self, fp, writer, key, flight):
+        self.fp = fp
+        self.writer = writer
+        self.key = key
+        self.flight = flight
+        self._chunks = []
+
+    def read(self, size=-1):
+        chunk = self.fp.read(size)
+        self.writer.write(chunk)
+        self._chunks.append(chunk)
+        return chunk
+
+    def _drain(self):
+        # the processor may not have read the last bytes
+        while self.read(65536):
+            pass
+        return b''.join(self._chunks)
+
+    def commit(self):
+        data = self._drain()
+        self.writer.commit()
+        return data
+
+    def abort(self):
+        self.writer.abort()
+        try:
+            return self._drain()
+        except Exception:
+            return None
+
+
+class _CachedResponse (object):
+
+    """
+    Cached response body (e.g. a memory map) which is closed after parsing.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.close = fp.close
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return _read_all(self.fp)
+        return self.fp.read(size)
+
+
+class CachingMixin (object):
+
+    """
+    Mixin for :class:`~amazonproduct.api.API` (or any subclass) which looks up
+    responses in a cache before sending the request to Amazon::
+
+        class CachingAPI (CachingMixin, API):
+            pass
+
+        api = CachingAPI(locale='de', cache=FileCache('/var/cache/amazon'),
+                         cachetime=24*3600)
+
+    The response body is written to the cache while it is being parsed, so
+    that it is read (and parsed) only once. It is only stored if it could be
+    parsed successfully (i.e. errors are never cached). Entries older than
+    ``cachetime`` seconds are fetched again.
+
+    Identical requests sent at the same time (e.g. by several threads) are
+    coalesced: only one of them is sent to Amazon, the others wait for and
+    share its response (however long it takes, unless the thread sending it
+    dies). If it fails, each of them sends its own request.
+
+    With ``stale_while_revalidate`` an expired response is returned right away
+    while it is refreshed in the background (within the usual rate limit).
+    Make sure the cache backend keeps entries at least ``cachetime +
+    stale_while_revalidate`` seconds.
+    """
+
+    #: number of threads refreshing stale responses in the background
+    REVALIDATION_WORKERS = 2
 
     def __init__(self, *args, **kwargs):
         """
-        :param cachedir: Path to directory containing cached responses.
+        :param cache: :class:`BaseCache` instance (default: a new
+          :class:`MemoryCache`). Passing ``None`` disables caching.
+        :param cachetime: maximum age of cached responses in seconds (default:
+          no limit).
+        :param stale_while_revalidate: number of seconds after ``cachetime``
+          during which a stale response is still returned while a fresh one is
+          fetched in the background.
+        """
+        self.cache = kwargs.pop('cache', MemoryCache())
+        self.cachetime = kwargs.pop('cachetime', None)
+        self.stale_while_revalidate = kwargs.pop(
+            'stale_while_revalidate', None)
+        if self.stale_while_revalidate is not None and not self.cachetime:
+            raise ValueError('stale_while_revalidate needs a cachetime!')
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._revalidator = None
+        super(CachingMixin, self).__init__(*args, **kwargs)
+
+    @staticmethod
+    def cache_key(query):
+        """
+        Returns the key under which the response for the (unsigned) query
+        parameters ``query`` is stored. It is the hash of a canonical query
+        string (sorted and URL-encoded) without ``Timestamp`` and
+        ``Signature``, so the order and encoding in which parameters were
+        passed make no difference.
+        """
+        return request_key(query)
+
+    def _build_url(self, **qargs):
+        query = self._prepare_query(**qargs)
+        url = self._sign_query(query)
+        if self.cache is not None:
+            # remember the query so _fetch need not parse the URL again (only
+            # the last one per thread, which is fetched right away)
+            self._local.query = url, query
+        return url
+
+    def _describe(self, query):
+        """
+        Returns the metadata stored along with a response for ``query``.
+        """
+        item_ids = []
+        for key, val in query.items():
+            if key == 'ItemId' or key.endswith('.ItemId'):
+                item_ids.extend(str(val).split(','))
+        return {
+            'operation': query.get('Operation'),
+            'locale': self.locale,
+            'item_ids': item_ids,
+        }
+
+    def _is_fresh(self, created):
+        return not self.cachetime or created + self.cachetime > time.time()
+
+    def _is_usable(self, created):
+        # stale, but may be served while being revalidated
+        return (self.stale_while_revalidate is not None and
+                created + self.cachetime + self.stale_while_revalidate
+                > time.time())
+
+    def _take_off(self, key):
         """
-        self.cache = kwargs.pop('cachedir', DEFAULT_CACHE_DIR)
-        self.cachetime = kwargs.pop('cachetime', False) # i.e. indefinite
-        API.__init__(self, *args, **kwargs)
-        if self.cache and not os.path.isdir(self.cache):
-            os.mkdir(self.cache)
+        Returns the :class:`_Flight` for ``key`` and whether the caller is the
+        one to fetch the response.
+        """
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _land(self, key, flight, data):
+        with self._flights_lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.data = data
+        flight.landed.set()
 
     def _fetch(self, url):
-        if self.cache:
-            path = os.path.join(self.cache, '%s.xml' % self.get_hash(url))
-            # if response was fetched previously, use that one
-            if os.path.isfile(path):
-                if self.cachetime:
-                    if os.path.getmtime(path) + self.cachetime > time.time():
-                        return open(path)
+        if self.cache is None:
+            return super(CachingMixin, self)._fetch(url)
+
+        last = getattr(self._local, 'query', None)
+        self._local.query = None
+        if last is not None and last[0] == url:
+            query = last[1]
+        else:
+            query = dict(parse_qsl(urlparse(url).query))
+        key = self.cache_key(query)
+        call = self.current_call
+        entry = self.cache.open(key)
+        if entry is not None:
+            fp, created = entry
+            if self._is_fresh(created):
+                if call is not None:
+                    call.cache = 'hit'
+                return _CachedResponse(fp)
+            if self._is_usable(created):
+                if call is not None:
+                    call.cache = 'stale'
+                self._revalidate(key, query)
+                return _CachedResponse(fp)
+            fp.close()
+
+        flight, leader = self._take_off(key)
+        if call is not None:
+            call.cache = 'miss' if leader else 'coalesced'
+        if not leader:
+            # the same request is already being sent
+            while not flight.landed.wait(self.TIMEOUT):
+                if not flight.leader.is_alive():
+                    break
+            if flight.data is not None:
+                return BytesIO(flight.data)
+            return super(CachingMixin, self)._fetch(url)
+
+        try:
+            fp = super(CachingMixin, self)._fetch(url)
+        except:
+            self._land(key, flight, None)
+            raise
+        writer = self.cache.writer(key, self._describe(query))
+        return _TeeResponse(fp, writer, key, flight)
+
+    def _parse(self, fp):
+        # streaming processors go on reading after _parse() has returned
+        streaming = getattr(self.processor, 'streaming', False)
+
+        if isinstance(fp, _CachedResponse):
+            try:
+                if streaming:
+                    return super(CachingMixin, self)._parse(BytesIO(fp.read()))
+                return super(CachingMixin, self)._parse(fp)
+            finally:
+                fp.close()
+
+        if isinstance(fp, _TeeResponse):
+            try:
+                if streaming:
+                    root = super(CachingMixin, self)._parse(
+                        BytesIO(fp._drain()))
                 else:
-                    return open(path)
+                    root = super(CachingMixin, self)._parse(fp)
+            except:
+                self._land(fp.key, fp.flight, fp.abort())
+                raise
+            self._land(fp.key, fp.flight, fp.commit())
+            return root
 
-        # fetch original response from Amazon
-        resp = API._fetch(self, url)
+        return super(CachingMixin, self)._parse(fp)
 
-        if self.cache:
-            fp = open(path, 'w+')
-            fp.write(etree.tostring(etree.parse(resp), pretty_print=True))
-            fp.seek(0)
-            return fp
+    def _revalidate(self, key, query):
+        """
+        Fetches a fresh response for ``query`` in the background (unless this
+        is already happening).
+        """
+        flight, leader = self._take_off(key)
+        if not leader:
+            return
+        with self._flights_lock:
+            if self._revalidator is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._revalidator = ThreadPoolExecutor(
+                    self.REVALIDATION_WORKERS)
+        self._revalidator.submit(self._refresh, key, query, flight)
+
+    def _refresh(self, key, query, flight):
+        flight.leader = threading.current_thread()
+        try:
+            # requests are throttled as usual
+            fp = super(CachingMixin, self)._fetch(self._sign_query(query))
+        except Exception:
+            self._land(key, flight, None)
+            return
+        writer = self.cache.writer(key, self._describe(query))
+        try:
+            self._parse(_TeeResponse(fp, writer, key, flight))
+        except Exception:
+            pass  # keep the stale entry
+
+    def close(self):
+        """
+        Waits for background revalidations to finish and closes the API.
+        """
+        if self._revalidator is not None:
+            self._revalidator.shutdown(wait=True)
+            self._revalidator = None
+        super(CachingMixin, self).close()
 
-        return resp
+
+class ResponseCachingAPI (CachingMixin, API):
+
+    """
+    This API stores each response from Amazon in a file and uses these for
+    subsequent requests (see :class:`FileCache`).
+
+    Using this class is an excellent idea during development!
+
+    This class is based on code by Dmitry Chaplinsky
+    https://gist.github.com/657174
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        :param cachedir: Path to directory containing cached responses.
+        :param cachetime: Maximum age of cached responses in seconds (default:
+          no limit).
+        """
+        cachedir = kwargs.pop('cachedir', DEFAULT_CACHE_DIR)
+        if 'cache' not in kwargs:
+            kwargs['cache'] = cachedir and FileCache(cachedir) or None
+        CachingMixin.__init__(self, *args, **kwargs)
 
     @staticmethod
     def get_hash(url):
         """
         Calculate hash value for request based on URL.
+
+        .. deprecated:: 0.3
+           Use :meth:`~CachingMixin.cache_key` instead.
         """
         cachename = "&".join([chunk for chunk in url.split('&')
               if chunk.find('Timestamp') != 0 and chunk.find('Signature') != 0])
-        return md5(cachename).hexdigest()
+        return md5(cachename.encode('utf-8')).hexdigest()
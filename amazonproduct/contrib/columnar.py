@@ -0,0 +1,322 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Columnar export of items for analytics. A :class:`ColumnarExporter` collects
+the values of each item directly into one array per column (no intermediate
+object per item) and returns them as NumPy_ arrays or as Arrow_ table::
+
+    exporter = ColumnarExporter()
+    exporter.extend(api.item_search('Books', Publisher='Galileo Press',
+                                    ResponseGroup='Large'))
+    table = exporter.to_arrow()
+
+Items can be elements of any of the included processors (``objectify``,
+``etree``, ``elementtree``, ``iterparse``) or records of
+:mod:`amazonproduct.processors.records`.
+
+.. _NumPy: http://www.numpy.org/
+.. _Arrow: https://arrow.apache.org/docs/python/
+"""
+
+from array import array
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+from amazonproduct.processors.elementtree import expand, extract_nspace
+from amazonproduct.processors.records import Record
+
+#: Value of integer columns for missing elements
+MISSING = -1
+
+# typecode of 64 bit integers ('q' is new in Python 3.3), None if there is none
+try:
+    array('q')
+except ValueError:  # pragma: no cover
+    _INT64 = 'l' if array('l').itemsize == 8 else None
+else:
+    _INT64 = 'q'
+
+
+def _int_array(values=()):
+    """
+    Returns an array of 64 bit integers (a list if there is no such type).
+    """
+    if _INT64 is None:  # pragma: no cover
+        return list(values)
+    return array(_INT64, values)
+
+
+def _int64(values):
+    """
+    Returns a NumPy ``int64`` array sharing the memory of ``values`` if
+    possible.
+    """
+    if isinstance(values, array):
+        return numpy.frombuffer(values, dtype=numpy.int64)
+    return numpy.array(values, dtype=numpy.int64)  # pragma: no cover
+
+
+class Column (object):
+
+    """
+    Column of integer (``int``) or string (``str``) values.
+    """
+
+    def __init__(self, name, path, attribute, type=str):
+        """
+        :param name: column name.
+        :param path: path of the element in an item (ElementTree syntax,
+          ``{}`` stands for the namespace).
+        :param attribute: dotted attribute path in an item record.
+        :param type: ``int`` or ``str``.
+
+        Alternatives for both paths can be separated with ``|``; the first one
+        found is used.
+        """
+        self.name = name
+        self.path = path
+        self.attributes = [alt.split('.') for alt in attribute.split('|')]
+        self.type = type
+
+    def new(self):
+        if self.type is int:
+            return _int_array()
+        return []
+
+
+class ListColumn (Column):
+
+    """
+    Column with a list of values per item, stored as Arrow does: all values in
+    one array and the offset of each item's first value in another
+    (``<name>_offsets``, one more than there are items).
+    """
+
+    def new(self):
+        values = super(ListColumn, self).new()
+        return values, _int_array([0])
+
+
+#: default columns
+COLUMNS = [
+    Column('asin', './{}ASIN', 'asin'),
+    Column('title', './{}ItemAttributes/{}Title', 'attributes.title'),
+    Column('sales_rank', './{}SalesRank', 'sales_rank', int),
+    Column('lowest_new_price',
+           './{}OfferSummary/{}LowestNewPrice/{}Amount',
+           'offer_summary.lowest_new_price.amount', int),
+    Column('lowest_used_price',
+           './{}OfferSummary/{}LowestUsedPrice/{}Amount',
+           'offer_summary.lowest_used_price.amount', int),
+    Column('currency',
+           './{}OfferSummary/{}LowestNewPrice/{}CurrencyCode'
+           '|./{}OfferSummary/{}LowestUsedPrice/{}CurrencyCode',
+           'offer_summary.lowest_new_price.currency_code'
+           '|offer_summary.lowest_used_price.currency_code'),
+    Column('total_new', './{}OfferSummary/{}TotalNew',
+           'offer_summary.total_new', int),
+    Column('total_used', './{}OfferSummary/{}TotalUsed',
+           'offer_summary.total_used', int),
+    Column('total_offers', './{}Offers/{}TotalOffers',
+           'offers.total_offers', int),
+    ListColumn('browse_node_ids',
+               './{}BrowseNodes/{}BrowseNode/{}BrowseNodeId',
+               'browse_nodes.id', int),
+]
+
+
+def _convert(value, type):
+    if value is None:
+        return MISSING if type is int else None
+    if type is int:
+        try:
+            return int(value)
+        except ValueError:
+            return MISSING
+    return value
+
+
+def _attribute(record, names):
+    for name in names:
+        if record is None:
+            return None
+        record = getattr(record, name)
+    return record
+
+
+def _first_attribute(record, alternatives):
+    for names in alternatives:
+        value = _attribute(record, names)
+        if value is not None:
+            return value
+    return None
+
+
+class ColumnarExporter (object):
+
+    """
+    Collects item values column by column. Integer columns (prices in the
+    smallest currency unit, ranks and counts) are stored in
+    :class:`array.array` objects of 64 bit integers (or lists where there is
+    no such type) with :data:`MISSING` for missing values; string columns in
+    lists (``None`` if missing).
+    """
+
+    def __init__(self, columns=None):
+        """
+        :param columns: list of :class:`Column` instances (default:
+          :data:`COLUMNS`).
+        """
+        self.columns = columns or COLUMNS
+        self.data = dict((column.name, column.new())
+                         for column in self.columns)
+        self.count = 0  #: number of items added
+        self._paths = {}
+
+    def __len__(self):
+        return self.count
+
+    def _element_paths(self, nspace):
+        try:
+            return self._paths[nspace]
+        except KeyError:
+            paths = [expand(column.path, nspace) for column in self.columns]
+            return self._paths.setdefault(nspace, paths)
+
+    def add(self, item):
+        """
+        Adds the values of one item (element or record).
+        """
+        if isinstance(item, Record):
+            self._add_record(item)
+        else:
+            self._add_element(item)
+        self.count += 1
+
+    def _add_element(self, item):
+        paths = self._element_paths(extract_nspace(item))
+        for column, alternatives in zip(self.columns, paths):
+            values = self.data[column.name]
+            if isinstance(column, ListColumn):
+                values, offsets = values
+                for path in alternatives:
+                    values.extend(_convert(node.text, column.type)
+                                  for node in item.findall(path))
+                offsets.append(len(values))
+                continue
+            for path in alternatives:
+                text = item.findtext(path)
+                if text is not None:
+                    break
+            values.append(_convert(text, column.type))
+
+    def _add_record(self, item):
+        for column in self.columns:
+            values = self.data[column.name]
+            if isinstance(column, ListColumn):
+                values, offsets = values
+                head, rest = column.attributes[0][0], column.attributes[0][1:]
+                values.extend(_convert(_attribute(value, rest), column.type)
+                              for value in getattr(item, head))
+                offsets.append(len(values))
+                continue
+            values.append(_convert(
+                _first_attribute(item, column.attributes), column.type))
+
+    def extend(self, items):
+        """
+        Adds all items of an iterable (e.g. a paginator).
+        """
+        for item in items:
+            self.add(item)
+
+    def add_response(self, root, processor):
+        """
+        Adds all items in a parsed response (using
+        :meth:`~amazonproduct.processors.BaseProcessor.parse_items` of
+        ``processor``).
+        """
+        for items in processor.parse_items(root):
+            for _, item in items:
+                self.add(item)
+
+    def to_numpy(self):
+        """
+        Returns a ``dict`` of NumPy arrays. Integer columns are ``int64``
+        arrays, strings are object arrays. List columns are returned as flat
+        values and offsets (``<name>_offsets``).
+        """
+        if numpy is None:  # pragma: no cover
+            raise ImportError('%s.to_numpy() needs numpy!' % (
+                self.__class__.__name__, ))
+        def convert(values, type):
+            if type is int:
+                return _int64(values).copy()
+            result = numpy.empty(len(values), dtype=object)
+            result[:] = values
+            return result
+        result = {}
+        for column in self.columns:
+            values = self.data[column.name]
+            if isinstance(column, ListColumn):
+                values, offsets = values
+                result['%s_offsets' % column.name] = convert(offsets, int)
+            result[column.name] = convert(values, column.type)
+        return result
+
+    def to_arrow(self):
+        """
+        Returns a :class:`pyarrow.Table`. Missing values are nulls, list
+        columns are list arrays.
+        """
+        if pyarrow is None or numpy is None:  # pragma: no cover
+            raise ImportError('%s.to_arrow() needs pyarrow and numpy!' % (
+                self.__class__.__name__, ))
+        arrays = []
+        for column in self.columns:
+            values = self.data[column.name]
+            offsets = None
+            if isinstance(column, ListColumn):
+                values, offsets = values
+            if column.type is int:
+                values = _int64(values)
+                values = pyarrow.array(values, mask=values == MISSING)
+            else:
+                values = pyarrow.array(values, type=pyarrow.string())
+            if offsets is not None:
+                values = pyarrow.ListArray.from_arrays(
+                    pyarrow.array(_int64(offsets),
+                                  type=pyarrow.int32()), values)
+            arrays.append(values)
+        return pyarrow.Table.from_arrays(
+            arrays, names=[column.name for column in self.columns])
+
+
+def export(source, processor=None, format='numpy', columns=None):
+    """
+    Exports the items of ``source`` in one go. ``source`` is either an
+    iterable of items (e.g. a paginator) or, if a ``processor`` is passed, a
+    list of parsed responses.
+
+    :param format: ``'numpy'`` (``dict`` of arrays) or ``'arrow'`` (table).
+    """
+    exporter = ColumnarExporter(columns)
+    if processor is None:
+        exporter.extend(source)
+    else:
+        for root in source:
+            exporter.add_response(root, processor)
+    if format == 'arrow':
+        return exporter.to_arrow()
+    return exporter.to_numpy()
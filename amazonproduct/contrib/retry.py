@@ -1,23 +1,15 @@
-
-import socket
-import time
-import sys
-
-# support Python 2 and Python 3 without conversion
-try:
-    from urllib.request import URLError
-except ImportError:
-    from urllib2 import URLError
-
 from amazonproduct.api import API
+from amazonproduct.retry import RetryPolicy
+
 
 class RetryAPI (API):
 
     """
     API which will try up to ``TRIES`` times to fetch a result from Amazon
-    should it run into a timeout. For the time being this will remain in
-    :mod:`amazonproduct.contrib` but its functionality may be merged into the
-    main API at a later date.
+    should it be throttled, run into a timeout or an internal error of
+    Amazon's. It is a shortcut for passing a
+    :class:`~amazonproduct.retry.RetryPolicy` to
+    :class:`~amazonproduct.api.API` which you should prefer.
 
     Based on work by Jerry Ji
     """
@@ -25,35 +17,15 @@ class RetryAPI (API):
     #: Max number of tries before giving up
     TRIES = 5
 
-    #: Delay between tries in seconds
+    #: Upper limit of the (random) delay before the first retry in seconds
     DELAY = 3
 
-    #: Between each try the delay will be lengthened by this backoff multiplier
-    BACKOFF = 1
-
-    def _fetch(self, url):
-        """
-        Retrieves XML response from Amazon. In case of a timeout, it will try
-        :const:`~RetryAPI.TRIES`` times before raising an error.
-        """
-        attempts = 0
-        delay = self.DELAY
-
-        while True:
-            try:
-                attempts += 1
-                return API._fetch(self, url)
-            except URLError:
-                e = sys.exc_info()[1]  # Python 2/3 compatible
-
-                # if a timeout occurred
-                # wait for some time before trying again
-                reason = getattr(e, 'reason', None)
-                if isinstance(reason, socket.timeout) and attempts < self.TRIES:
-                    time.sleep(delay)
-                    delay *= self.BACKOFF
-                    continue
-
-                # otherwise reraise the original error
-                raise
+    #: Between each try the limit will be lengthened by this backoff
+    #: multiplier
+    BACKOFF = 2
 
+    def __init__(self, *args, **kwargs):
+        if kwargs.get('retry') is None:
+            kwargs['retry'] = RetryPolicy(
+                tries=self.TRIES, base_delay=self.DELAY, backoff=self.BACKOFF)
+        API.__init__(self, *args, **kwargs)
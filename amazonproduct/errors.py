@@ -7,14 +7,17 @@ import re
 import sys
 
 __all__ = [
-    'AccountLimitExceeded', 'AWSError', 'CartInfoMismatch', 'DEFAULT_ERROR_REGS',
+    'AccountLimitExceeded', 'AWSError', 'CartInfoMismatch', 'CircuitOpen',
+    'DEFAULT_ERROR_REGS',
+    'ExceededMaxBatchRequestsPerOperation',
     'InvalidClientTokenId', 'InvalidSignature', 'InvalidAccount', 'MissingClientTokenId', 'MissingParameters',
     'ParameterOutOfRange', 'DeprecatedOperation', 'InternalError',
     'InvalidCartId', 'InvalidCartItem', 'InvalidListType', 'InvalidOperation',
     'InvalidParameterCombination', 'InvalidParameterValue',
     'InvalidResponseGroup', 'InvalidSearchIndex', 'ItemAlreadyInCart',
     'JAPANESE_ERROR_REGS', 'NoExactMatchesFound', 'NoSimilarityForASIN',
-    'NotEnoughParameters', 'TooManyRequests', 'UnknownLocale', '_e'
+    'NotEnoughParameters', 'ServerError', 'TooManyRequests', 'UnknownLocale',
+    '_e'
 ]
 
 class AWSError (Exception):
@@ -31,6 +34,10 @@ class AWSError (Exception):
         ``xml``
             XML returned from Amazon as processed by the API's result processor
 
+        ``retry_after``
+            Seconds Amazon asked to wait before sending the request again
+            (``Retry-After`` header) or ``None``
+
     You can (and should) still pass additional arguments to derived exceptions
     which (as with :class:`BaseException`) will be stored in ``args``.
     """
@@ -41,6 +48,7 @@ class AWSError (Exception):
         self.code = kwargs.pop('code', None)
         self.msg = kwargs.pop('msg', None)
         self.xml = kwargs.pop('xml', None)
+        self.retry_after = None
     def __str__(self): # pragma: no cover
         if self.code is not None:
             return '%(code)s: %(msg)s' % self.__dict__
@@ -144,6 +152,24 @@ class TooManyRequests (AWSError):
     request per second.
     """
 
+class ServerError (AWSError):
+    """
+    Amazon answered with an HTTP server error (status 5xx) and no error
+    message. The status is passed as first argument and kept as ``status``.
+    Transports raise it with the ``response`` (from which the body can still
+    be read).
+    """
+    def __init__(self, status, response=None):
+        AWSError.__init__(self, status)
+        self.status = status
+        self.response = response
+
+class CircuitOpen (AWSError):
+    """
+    Requests to this host failed too often recently and are not sent for a
+    while (see :class:`amazonproduct.retry.CircuitBreaker`).
+    """
+
 class NotEnoughParameters (AWSError):
     """
     Your request should have at least one parameter which you did not submit.
@@ -164,6 +190,12 @@ class InvalidOperation (AWSError):
     The specified feature (operation) is invalid.
     """
 
+class ExceededMaxBatchRequestsPerOperation (AWSError):
+    """
+    You have exceeded the maximum number of batch requests per operation. Each
+    operation may include no more than 2 batch requests.
+    """
+
 class InvalidCartItem (AWSError):
     """
     The item you specified, ???, is not eligible to be added to the cart. Check
@@ -0,0 +1,353 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Observing API calls. Observers passed to :class:`~amazonproduct.api.API` are
+told about every call once it is finished. The :class:`Call` they are given
+holds the time spent in each stage of the call:
+
+``sign``
+    preparing and signing the URL,
+``throttle``
+    waiting for the rate limiter,
+``fetch``
+    connecting to Amazon and waiting for the response headers,
+``read``
+    reading the response body,
+``parse``
+    parsing the response (without reading it),
+``map_error``
+    mapping error responses onto exceptions,
+``backoff``
+    waiting before a request is sent again (see :mod:`amazonproduct.retry`).
+
+To aggregate calls in-process, use a :class:`MetricsCollector`::
+
+    metrics = MetricsCollector()
+    api = API(locale='de', observers=[metrics])
+    ...
+    print(metrics.summary())
+
+To export them to Prometheus_, use a :class:`PrometheusObserver`.
+
+.. _Prometheus: https://prometheus.io/
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+import threading
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # pragma: no cover
+    from time import time as clock
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+#: stages of an API call (in that order)
+STAGES = ('sign', 'throttle', 'fetch', 'read', 'parse', 'map_error',
+          'backoff')
+
+#: upper bounds of histogram buckets for durations in seconds
+DURATION_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5,
+                    1, 2.5, 5, 10)
+
+#: upper bounds of histogram buckets for response sizes in bytes
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Call (object):
+
+    """
+    Measurements of a single API call.
+
+    ``operation``, ``locale``
+        Operation and locale of the request.
+    ``timings``
+        Seconds spent in each stage (see :data:`STAGES`). Stages which were
+        never entered (e.g. ``fetch`` for cached responses) are missing.
+    ``duration``
+        Total duration of the call in seconds.
+    ``response_size``
+        Number of bytes read from Amazon (``None`` if nothing was fetched).
+    ``cache``
+        ``'hit'``, ``'stale'``, ``'miss'`` or ``'coalesced'`` (if the request
+        was sent by another thread) for APIs with a cache, otherwise ``None``.
+    ``retries``
+        Number of times the request was sent again.
+    ``error``
+        Class of the exception raised (or ``None``).
+    """
+
+    def __init__(self, operation=None, locale=None):
+        self.operation = operation
+        self.locale = locale
+        self.timings = {}
+        self.duration = None
+        self.response_size = None
+        self.cache = None
+        self.retries = 0
+        self.error = None
+        self._start = clock()
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s/%s) at %s>' % (self.__class__.__name__,
+            self.operation, self.locale, hex(id(self)))
+
+    def measure(self, stage):
+        """
+        Returns a context manager adding the time spent within to ``stage``.
+        Time spent reading the response in the meantime is not included.
+        """
+        return _Measurement(self, stage)
+
+    def add(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0) + seconds
+
+    def read(self, size, seconds):
+        """
+        Records that ``size`` bytes of the response were read.
+        """
+        self.response_size = (self.response_size or 0) + size
+        self.add('read', seconds)
+
+    def finish(self, error=None):
+        self.duration = clock() - self._start
+        self.error = error
+
+
+class _Measurement (object):
+
+    def __init__(self, call, stage):
+        self.call = call
+        self.stage = stage
+
+    def __enter__(self):
+        self.read = self.call.timings.get('read', 0)
+        self.start = clock()
+
+    def __exit__(self, *exc_info):
+        elapsed = clock() - self.start
+        read = self.call.timings.get('read', 0) - self.read
+        self.call.add(self.stage, elapsed - read)
+
+
+class TimedReader (object):
+
+    """
+    File-like wrapper around a response recording the time spent reading it
+    and its size in a :class:`Call`.
+    """
+
+    def __init__(self, fp, call):
+        self.fp = fp
+        self.call = call
+
+    def read(self, size=-1):
+        start = clock()
+        data = self.fp.read(size)
+        self.call.read(len(data), clock() - start)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+
+class BaseObserver (object):
+
+    """
+    Skeleton class for observers. Override the methods you are interested in.
+
+    Observers are called from whichever thread made the call, so they need to
+    be thread-safe.
+    """
+
+    def call_started(self, call):
+        """
+        Called before a request is sent with a :class:`Call` which is yet to
+        be filled in.
+        """
+
+    def call_finished(self, call):
+        """
+        Called with the complete :class:`Call` once the response has been
+        parsed or an exception is raised.
+        """
+
+
+class Histogram (object):
+
+    """
+    Histogram with fixed buckets (not thread-safe).
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        """
+        :param buckets: sorted upper bounds of all buckets. Values greater than
+          the last one are counted in an additional bucket.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket containing the ``q``-quantile
+        (``0 < q <= 1``), ``None`` for an empty histogram or one beyond the
+        last bucket.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+
+class MetricsCollector (BaseObserver):
+
+    """
+    Thread-safe, in-process aggregation of all calls: duration histograms per
+    stage and for the whole call (``'call'``), a histogram of response sizes
+    and counters of calls, errors, cache results and retries.
+    """
+
+    def __init__(self, duration_buckets=DURATION_BUCKETS,
+                 size_buckets=SIZE_BUCKETS):
+        self._lock = threading.Lock()
+        self._duration_buckets = duration_buckets
+        self.durations = {}  #: histograms by stage
+        self.sizes = Histogram(size_buckets)
+        self.calls = defaultdict(int)  #: number of calls by operation
+        self.errors = defaultdict(int)  #: number of errors by exception name
+        self.cache = defaultdict(int)  #: number of cache results
+        self.retries = 0
+
+    def _observe(self, stage, seconds):
+        try:
+            histogram = self.durations[stage]
+        except KeyError:
+            histogram = self.durations[stage] = Histogram(
+                self._duration_buckets)
+        histogram.observe(seconds)
+
+    def call_finished(self, call):
+        with self._lock:
+            self.calls[call.operation] += 1
+            self._observe('call', call.duration)
+            for stage, seconds in call.timings.items():
+                self._observe(stage, seconds)
+            if call.response_size is not None:
+                self.sizes.observe(call.response_size)
+            if call.error is not None:
+                self.errors[call.error.__name__] += 1
+            if call.cache is not None:
+                self.cache[call.cache] += 1
+            self.retries += call.retries
+
+    def summary(self):
+        """
+        Returns a ``dict`` with count, mean and median, 90th and 99th
+        percentile (bucket bounds) of all stages as well as all counters.
+        """
+        with self._lock:
+            stages = {}
+            for stage, histogram in self.durations.items():
+                stages[stage] = {
+                    'count': histogram.count,
+                    'mean': histogram.mean,
+                    'p50': histogram.quantile(.5),
+                    'p90': histogram.quantile(.9),
+                    'p99': histogram.quantile(.99),
+                }
+            return {
+                'durations': stages,
+                'response_size': {'count': self.sizes.count,
+                                  'mean': self.sizes.mean},
+                'calls': dict(self.calls),
+                'errors': dict(self.errors),
+                'cache': dict(self.cache),
+                'retries': self.retries,
+            }
+
+
+class PrometheusObserver (BaseObserver):
+
+    """
+    Exports all calls as Prometheus metrics (requires prometheus_client_):
+
+    ``<prefix>_call_seconds``
+        histogram of durations (labels ``operation`` and ``stage``, with
+        ``stage="call"`` for the whole call),
+    ``<prefix>_response_bytes``
+        histogram of response sizes (label ``operation``),
+    ``<prefix>_errors_total``
+        counter of exceptions (labels ``operation`` and ``exception``),
+    ``<prefix>_cache_total``
+        counter of cache results (label ``result``),
+    ``<prefix>_retries_total``
+        counter of retries (label ``operation``).
+
+    .. _prometheus_client: https://github.com/prometheus/client_python
+    """
+
+    def __init__(self, registry=None, prefix='amazonproduct',
+                 duration_buckets=DURATION_BUCKETS, size_buckets=SIZE_BUCKETS):
+        """
+        :param registry: :class:`prometheus_client.CollectorRegistry` to
+          register the metrics with (default: the global registry).
+        :param prefix: prefix of all metric names.
+        """
+        if prometheus_client is None:  # pragma: no cover
+            raise ImportError('%s needs prometheus_client!' % (
+                self.__class__.__name__, ))
+        if registry is None:
+            registry = prometheus_client.REGISTRY
+        self.durations = prometheus_client.Histogram(
+            '%s_call_seconds' % prefix, 'Duration of API calls by stage',
+            ['operation', 'stage'], buckets=duration_buckets,
+            registry=registry)
+        self.sizes = prometheus_client.Histogram(
+            '%s_response_bytes' % prefix, 'Size of responses',
+            ['operation'], buckets=size_buckets, registry=registry)
+        self.errors = prometheus_client.Counter(
+            '%s_errors' % prefix, 'Exceptions raised by API calls',
+            ['operation', 'exception'], registry=registry)
+        self.cache = prometheus_client.Counter(
+            '%s_cache' % prefix, 'Cache results', ['result'],
+            registry=registry)
+        self.retries = prometheus_client.Counter(
+            '%s_retries' % prefix, 'Requests sent again', ['operation'],
+            registry=registry)
+
+    def call_finished(self, call):
+        operation = call.operation or ''
+        self.durations.labels(operation, 'call').observe(call.duration)
+        for stage, seconds in call.timings.items():
+            self.durations.labels(operation, stage).observe(seconds)
+        if call.response_size is not None:
+            self.sizes.labels(operation).observe(call.response_size)
+        if call.error is not None:
+            self.errors.labels(operation, call.error.__name__).inc()
+        if call.cache is not None:
+            self.cache.labels(call.cache).inc()
+        if call.retries:
+            self.retries.labels(operation).inc(call.retries)
@@ -1,4 +1,6 @@
 
+from collections import deque
+
 # paginator types
 ITEMS_PAGINATOR = 'ItemPage'
 RELATEDITEMS_PAGINATOR = 'RelatedItemPage'
@@ -17,6 +19,10 @@ class BaseProcessor (object):
     #: appropriate subclass of :class:`BaseResultPaginator`
     paginators = {}
 
+    #: ``True`` if :meth:`parse` returns before the response has been read
+    #: completely (i.e. ``fp`` must stay readable afterwards)
+    streaming = False
+
     def parse(self, fp):
         """
         Parses a file-like XML source returned from Amazon. This is the most
@@ -40,6 +46,32 @@ class BaseProcessor (object):
         """
         raise NotImplementedError  # pragma: no cover
 
+    @classmethod
+    def parse_items(cls, node):
+        """
+        Returns the items contained in ``node`` grouped by the ``Items``
+        element they belong to (a batch request will return one ``Items``
+        element per request).
+
+        :param node: parsed XML node (as returned by :meth:`parse`).
+        :return: list of lists of ``(ASIN, item node)`` tuples
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    @classmethod
+    def parse_batch(cls, node):
+        """
+        Splits the response to a batch request (or MultiOperation) into the
+        results of the individual requests. Each request is answered by one
+        element (e.g. ``Items`` or ``BrowseNodes``) within the response of its
+        operation.
+
+        :param node: parsed XML node (as returned by :meth:`parse`).
+        :return: list of ``(operation, result node)`` tuples in the order of
+          the response
+        """
+        raise NotImplementedError  # pragma: no cover
+
 
 class BaseResultPaginator (object):
 
@@ -65,6 +97,19 @@ class BaseResultPaginator (object):
 
     ``current``
         Number of result page retrieved last.
+
+    Pages are fetched one after another as they are needed. Once the first
+    page is known, you can let the paginator fetch the following pages in
+    parallel by passing ``prefetch`` (the number of pages fetched
+    concurrently). ``readahead`` (default: same as ``prefetch``) limits how
+    many pages may be fetched in advance of the one currently iterated over.
+    Pages are still returned in order::
+
+        for item in api.item_search('Books', Publisher='Galileo Press',
+                                    prefetch=3):
+            ...
+
+    .. note:: Requests are still subject to the API's throttling.
     """
 
     #: Default pagination limit imposed by Amazon.
@@ -81,6 +126,8 @@ class BaseResultPaginator (object):
         self.fun = fun
         self.args, self.kwargs = args, kwargs
         self.limit = kwargs.pop('limit', self.LIMIT)
+        self.prefetch = kwargs.pop('prefetch', 0)
+        self.readahead = kwargs.pop('readahead', None) or self.prefetch
 
         self._pagecache = {}
 
@@ -118,11 +165,21 @@ class BaseResultPaginator (object):
         if index in self._pagecache:
             root = self._pagecache[index]
         else:
-            root = self.fun(*self.args, **self.kwargs)
-            self._pagecache[index] = root
+            root = self._fetch_page(index)
         self.current, self.pages, self.results = self.paginator_data(root)
         return root
 
+    def _fetch_page(self, index):
+        """
+        Fetches and caches page ``index``. Unlike :meth:`page`, this does not
+        modify the paginator's state and may be called from other threads.
+        """
+        kwargs = dict(self.kwargs)
+        kwargs[self.counter] = index
+        root = self.fun(*self.args, **kwargs)
+        self._pagecache[index] = root
+        return root
+
     def iterpages(self):
         """
         Iterates over all pages. Keep in mind that Amazon limits the number of
@@ -130,9 +187,49 @@ class BaseResultPaginator (object):
         otherwise!
         """
         yield self.page(1)
+        if self.prefetch > 1:
+            for root in self._prefetch_pages(self.current + 1):
+                yield root
+            return
         while self.pages > self.current < self.limit:
             yield self.page(self.current + 1)
 
+    def _prefetch_pages(self, start):
+        """
+        Iterates over pages ``start`` to the last available one while up to
+        :attr:`prefetch` of them are fetched concurrently.
+        """
+        from concurrent.futures import Future, ThreadPoolExecutor
+
+        indices = iter(range(start, min(self.pages, self.limit) + 1))
+        executor = ThreadPoolExecutor(self.prefetch)
+        pending = deque()
+
+        def submit_next():
+            for index in indices:
+                if index in self._pagecache:
+                    future = Future()
+                    future.set_result(self._pagecache[index])
+                else:
+                    future = executor.submit(self._fetch_page, index)
+                pending.append(future)
+                return
+
+        try:
+            for _ in range(max(self.readahead, 1)):
+                submit_next()
+            while pending:
+                root = pending.popleft().result()
+                submit_next()
+                self.current, self.pages, self.results = (
+                    self.paginator_data(root))
+                yield root
+        finally:
+            # stop fetching pages nobody is going to look at
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
     def paginator_data(self, node):
         """
         Extracts pagination data from XML node, i.e.
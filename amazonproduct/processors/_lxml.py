@@ -3,23 +3,113 @@
 XPath based paginators for lxml.etree and lxml.objectify based processors.
 """
 
+import threading
+
+from lxml import etree
+
 from amazonproduct.processors import BaseResultPaginator
 
 
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def xpath(expr, nspace):
+    """
+    Returns a compiled :class:`lxml.etree.XPath` for ``expr`` in which prefix
+    ``aws`` stands for namespace ``nspace``. Expressions are compiled once per
+    namespace and re-used.
+
+    Responses without a namespace are matched without prefix (XPath cannot
+    bind a prefix to the empty namespace).
+    """
+    try:
+        return _compiled[expr, nspace]
+    except KeyError:
+        pass
+    if nspace:
+        compiled = etree.XPath(expr, namespaces={'aws': nspace})
+    else:
+        compiled = etree.XPath(expr.replace('aws:', ''))
+    with _compiled_lock:
+        return _compiled.setdefault((expr, nspace), compiled)
+
+
+def namespace(node):
+    """
+    Returns the default namespace of ``node`` (or ``''`` if there is none).
+    """
+    return node.nsmap.get(None, '')
+
+
+#: Locations of ``Error`` elements relative to the root of a response (also
+#: within a MultiOperation response).
+ERRORS = ' | '.join([
+    'aws:Error',
+    'aws:OperationRequest/aws:Errors/aws:Error',
+    'aws:*/aws:Request/aws:Errors/aws:Error',
+    'aws:*/aws:OperationRequest/aws:Errors/aws:Error',
+    'aws:*/aws:*/aws:Request/aws:Errors/aws:Error',
+])
+
+
+def find_errors(root):
+    """
+    Returns all ``Error`` elements in response ``root``. Only the places where
+    Amazon reports errors are searched rather than the whole document.
+    """
+    return xpath(ERRORS, namespace(root))(root)
+
+
+def parse_items(node):
+    """
+    Returns list of ``(ASIN, item node)`` tuples for each ``Items`` element in
+    ``node`` (see :meth:`~amazonproduct.processors.BaseProcessor.parse_items`).
+    """
+    nspace = {'aws': node.nsmap.get(None, '')}
+    return [
+        [(item.findtext('aws:ASIN', namespaces=nspace), item)
+         for item in items.iterfind('aws:Item', namespaces=nspace)]
+        for items in node.iterfind('aws:Items', namespaces=nspace)
+    ]
+
+
+def parse_batch(node):
+    """
+    Returns list of ``(operation, result node)`` tuples for each request
+    answered in ``node`` (see
+    :meth:`~amazonproduct.processors.BaseProcessor.parse_batch`).
+    """
+    localname = lambda element: etree.QName(element).localname
+    if localname(node) == 'MultiOperationResponse':
+        responses = [child for child in node.iterchildren(tag=etree.Element)
+                     if localname(child).endswith('Response')]
+    else:
+        responses = [node]
+    return [
+        (localname(response)[:-len('Response')], result)
+        for response in responses
+        for result in response.iterchildren(tag=etree.Element)
+        if localname(result) != 'OperationRequest'
+    ]
+
+
 class XPathPaginator (BaseResultPaginator):
 
     """
     Result paginator using XPath expressions to extract page and result
-    information from XML.
+    information from XML. Expressions are evaluated relative to the root
+    element (prefix ``aws`` denotes the response's namespace) and compiled
+    only once.
     """
 
     counter = current_page_xpath = total_pages_xpath = total_results_xpath = None
 
     def paginator_data(self, root):
-        nspace = root.nsmap.get(None, '')
-        def fetch_value(xpath, default):
+        nspace = namespace(root)
+        def fetch_value(expr, default):
             try:
-                node = root.xpath(xpath, namespaces={'aws': nspace})[0]
+                node = xpath(expr, nspace)(root)[0]
                 return int(node.text)
             except (IndexError, ValueError):
                 return default
@@ -30,17 +120,16 @@ class XPathPaginator (BaseResultPaginator):
         ])
 
     def iterate(self, root):
-        nspace = root.nsmap.get(None, '')
-        return root.xpath(self.items, namespaces={'aws': nspace})
+        return xpath(self.items, namespace(root))(root)
 
 
 class SearchPaginator (XPathPaginator):
 
     counter = 'ItemPage'
-    current_page_xpath = '//aws:Items/aws:Request/aws:ItemSearchRequest/aws:ItemPage'
-    total_pages_xpath = '//aws:Items/aws:TotalPages'
-    total_results_xpath = '//aws:Items/aws:TotalResults'
-    items = '//aws:Items/aws:Item'
+    current_page_xpath = 'aws:Items/aws:Request/aws:ItemSearchRequest/aws:ItemPage'
+    total_pages_xpath = 'aws:Items/aws:TotalPages'
+    total_results_xpath = 'aws:Items/aws:TotalResults'
+    items = 'aws:Items/aws:Item'
 
 
 class RelatedItemsPaginator (XPathPaginator):
@@ -67,9 +156,11 @@ class RelatedItemsPaginator (XPathPaginator):
 
     """
     counter = 'RelatedItemPage'
-    current_page_xpath = '//aws:RelatedItemPage'
-    total_pages_xpath = '//aws:RelatedItems/aws:RelatedItemPageCount'
-    total_results_xpath = '//aws:RelatedItems/aws:RelatedItemCount'
-    items = '//aws:RelatedItems/aws:RelatedItem/aws:Item'
+    current_page_xpath = (
+        'aws:Items/aws:Request/aws:*/aws:RelatedItemPage'
+        ' | aws:Items/aws:Item/aws:RelatedItems/aws:RelatedItemPage')
+    total_pages_xpath = 'aws:Items/aws:Item/aws:RelatedItems/aws:RelatedItemPageCount'
+    total_results_xpath = 'aws:Items/aws:Item/aws:RelatedItems/aws:RelatedItemCount'
+    items = 'aws:Items/aws:Item/aws:RelatedItems/aws:RelatedItem/aws:Item'
 
 
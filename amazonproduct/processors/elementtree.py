@@ -3,7 +3,6 @@
 # This program is release under the BSD License. You can find the full text of
 # the license in the LICENSE file.
 
-import re
 from amazonproduct.contrib.cart import Cart, Item
 
 from amazonproduct.errors import AWSError
@@ -38,68 +37,110 @@ def _load_elementtree_module(*modules):
 
 
 
-_nsreg = re.compile('^({.+?})')
 def extract_nspace(element):
     """
     Extracts namespace from XML element. If no namespace is found, ``''``
     (empty string) is returned.
     """
-    m = _nsreg.search(element.tag)
-    if m: return m.group(1)
+    tag = element.tag
+    if tag[:1] == '{':
+        return tag[:tag.index('}') + 1]
     return ''
 
 
+_expanded = {}
+
+
+def expand(path, nspace):
+    """
+    Returns a tuple of ElementTree paths for ``path`` in which ``{}`` has been
+    replaced with namespace ``nspace``. Alternatives in ``path`` are separated
+    with ``|`` (ElementTree does not support them). The result is cached as
+    the namespace rarely ever changes.
+    """
+    try:
+        return _expanded[path, nspace]
+    except KeyError:
+        paths = tuple(alt.replace('{}', nspace) for alt in path.split('|'))
+        return _expanded.setdefault((path, nspace), paths)
+
+
+#: Locations of ``Error`` elements relative to the root of a response (also
+#: within a MultiOperation response).
+ERRORS = '|'.join([
+    './{}Error',
+    './{}OperationRequest/{}Errors/{}Error',
+    './*/{}Request/{}Errors/{}Error',
+    './*/{}OperationRequest/{}Errors/{}Error',
+    './*/*/{}Request/{}Errors/{}Error',
+])
+
+
+def _int(root, paths, default):
+    for path in paths:
+        text = root.findtext(path)
+        if text is not None:
+            try:
+                return int(text)
+            except ValueError:
+                return default
+    return default
+
+
 class XPathPaginator (BaseResultPaginator):
 
     """
     Result paginator using XPath expressions to extract page and result
-    information from XML.
+    information from XML. Expressions are relative to the root element and
+    ``{}`` stands for its namespace.
     """
 
     counter = current_page_xpath = total_pages_xpath = total_results_xpath = None
 
+    _extractors = {}
+
+    @classmethod
+    def extractors(cls, nspace):
+        """
+        Returns a list of ``(paths, default)`` tuples for current page, total
+        pages and total results. It is built once per class and namespace.
+        """
+        try:
+            return cls._extractors[cls, nspace]
+        except KeyError:
+            table = [
+                (expand(cls.current_page_xpath, nspace), 1),
+                (expand(cls.total_pages_xpath, nspace), 0),
+                (expand(cls.total_results_xpath, nspace), 0),
+            ]
+            return cls._extractors.setdefault((cls, nspace), table)
+
     def paginator_data(self, root):
-        nspace = extract_nspace(root)
-        def fetch_value(xpath, default):
-            try:
-                path = xpath.replace('{}', nspace)
-                # ElementTree does not seem to support XPath expressions to
-                # be combined with | separator!
-                for expr in path.split('|'):
-                    node = root.findtext(expr)
-                    if node is not None:
-                        return int(node)
-                return default
-            except (ValueError, TypeError):
-                return default
-        return map(lambda a: fetch_value(*a), [
-            (self.current_page_xpath, 1),
-            (self.total_pages_xpath, 0),
-            (self.total_results_xpath, 0)
-        ])
+        return [_int(root, paths, default) for paths, default
+                in self.extractors(extract_nspace(root))]
 
     def iterate(self, root):
-        nspace = extract_nspace(root)
-        xpath = self.items.replace('{}', nspace)
-        return root.findall(xpath)
+        return root.findall(expand(self.items, extract_nspace(root))[0])
 
 
 class ItemPaginator (XPathPaginator):
 
     counter = 'ItemPage'
-    current_page_xpath = './/{}Items/{}Request/{}ItemSearchRequest/{}ItemPage'
-    total_pages_xpath = './/{}Items/{}TotalPages'
-    total_results_xpath = './/{}Items/{}TotalResults'
-    items = './/{}Items/{}Item'
+    current_page_xpath = './{}Items/{}Request/{}ItemSearchRequest/{}ItemPage'
+    total_pages_xpath = './{}Items/{}TotalPages'
+    total_results_xpath = './{}Items/{}TotalResults'
+    items = './{}Items/{}Item'
 
 
 class RelatedItemsPaginator (XPathPaginator):
 
     counter = 'RelatedItemPage'
-    current_page_xpath = './/{}RelatedItemPage'
-    total_pages_xpath = './/{}RelatedItems/{}RelatedItemPageCount'
-    total_results_xpath = './/{}RelatedItems/{}RelatedItemCount'
-    items = './/{}RelatedItems/{}RelatedItem/{}Item'
+    current_page_xpath = (
+        './{}Items/{}Request/*/{}RelatedItemPage'
+        '|./{}Items/{}Item/{}RelatedItems/{}RelatedItemPage')
+    total_pages_xpath = './{}Items/{}Item/{}RelatedItems/{}RelatedItemPageCount'
+    total_results_xpath = './{}Items/{}Item/{}RelatedItems/{}RelatedItemCount'
+    items = './{}Items/{}Item/{}RelatedItems/{}RelatedItem/{}Item'
 
 
 class Processor (BaseProcessor):
@@ -137,12 +178,12 @@ class Processor (BaseProcessor):
     def parse(self, fp):
         root = self.etree.parse(fp).getroot()
         ns = extract_nspace(root)
-        errors = root.findall('.//%sError' % ns)
-        for error in errors:
-            raise AWSError(
-                code=error.findtext('./%sCode' % ns),
-                msg=error.findtext('./%sMessage' % ns),
-                xml=root)
+        for path in expand(ERRORS, ns):
+            for error in root.findall(path):
+                raise AWSError(
+                    code=error.findtext('./%sCode' % ns),
+                    msg=error.findtext('./%sMessage' % ns),
+                    xml=root)
         return root
 
     def __repr__(self): # pragma: no cover
@@ -156,9 +197,8 @@ class Processor (BaseProcessor):
         information extracted from ``node``.
         """
         _nspace = extract_nspace(node)
-        _xpath = lambda path: path.replace('{}', _nspace)
-        root = node.find(_xpath('.//{}Cart'))
-
+        _xpath = lambda path: expand(path, _nspace)[0]
+        root = node.find(_xpath('./{}Cart'))
 
         cart = Cart()
         cart.cart_id = root.findtext(_xpath('./{}CartId'))
@@ -189,4 +229,35 @@ class Processor (BaseProcessor):
             cart.subtotal = (None, None)
         return cart
 
+    @classmethod
+    def parse_items(cls, node):
+        """
+        Returns list of ``(ASIN, item node)`` tuples for each ``Items`` element
+        in ``node``.
+        """
+        ns = extract_nspace(node)
+        return [
+            [(item.findtext('./%sASIN' % ns), item)
+             for item in items.findall('./%sItem' % ns)]
+            for items in node.findall('./%sItems' % ns)
+        ]
 
+    @classmethod
+    def parse_batch(cls, node):
+        """
+        Returns list of ``(operation, result node)`` tuples for each request
+        answered in ``node``.
+        """
+        ns = extract_nspace(node)
+        localname = lambda element: element.tag[len(ns):]
+        if localname(node) == 'MultiOperationResponse':
+            responses = [child for child in list(node)
+                         if localname(child).endswith('Response')]
+        else:
+            responses = [node]
+        return [
+            (localname(response)[:-len('Response')], result)
+            for response in responses
+            for result in list(response)
+            if localname(result) != 'OperationRequest'
+        ]
@@ -12,6 +12,8 @@ from amazonproduct.processors import ITEMS_PAGINATOR, RELATEDITEMS_PAGINATOR
 
 from amazonproduct.processors._lxml import SearchPaginator
 from amazonproduct.processors._lxml import RelatedItemsPaginator
+from amazonproduct.processors._lxml import parse_items, parse_batch
+from amazonproduct.processors._lxml import find_errors, namespace
 
 
 class Processor (BaseProcessor):
@@ -27,9 +29,8 @@ class Processor (BaseProcessor):
 
     def parse(self, fp):
         root = etree.parse(fp).getroot()
-        nspace = {'aws': root.nsmap.get(None, '')}
-        errors = root.xpath('//aws:Error', namespaces=nspace)
-        for error in errors:
+        nspace = {'aws': namespace(root)}
+        for error in find_errors(root):
             raise AWSError(
                 code=error.findtext('./aws:Code', namespaces=nspace),
                 msg=error.findtext('./aws:Message', namespaces=nspace),
@@ -79,3 +80,18 @@ class Processor (BaseProcessor):
             cart.subtotal = (None, None)
         return cart
 
+    @classmethod
+    def parse_items(cls, node):
+        """
+        Returns list of ``(ASIN, item node)`` tuples for each ``Items`` element
+        in ``node``.
+        """
+        return parse_items(node)
+
+    @classmethod
+    def parse_batch(cls, node):
+        """
+        Returns list of ``(operation, result node)`` tuples for each request
+        answered in ``node``.
+        """
+        return parse_batch(node)
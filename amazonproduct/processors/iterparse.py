@@ -0,0 +1,204 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Streaming processor based on ``lxml``'s incremental parser. Unlike the other
+processors it returns as soon as the first item has been parsed. Items are then
+parsed one by one while iterating over the response::
+
+    api = API(locale='de', processor='amazonproduct.processors.iterparse')
+    for item in api.item_search('Books', Publisher='Galileo Press'):
+        print(item.findtext('{*}ItemAttributes/{*}Title'))
+
+Each item is removed from the tree once it has been parsed, so memory usage
+stays flat no matter how large the response is.
+"""
+
+from itertools import chain
+
+from lxml import etree
+
+from amazonproduct.errors import AWSError
+from amazonproduct.processors import BaseProcessor, ITEMS_PAGINATOR
+from amazonproduct.processors import etree as _etree
+from amazonproduct.processors._lxml import SearchPaginator
+from amazonproduct.processors._lxml import parse_items, parse_batch
+
+
+class StreamedResponse (object):
+
+    """
+    Partially parsed response. Attribute ``root`` holds everything up to the
+    first item (e.g. ``Request``, ``TotalResults`` and ``TotalPages``). Its
+    methods (e.g. ``xpath()`` or ``find()``) can be used on the response
+    directly. Iterating over the response
+    yields the items (``Items/Item``) while they are parsed.
+
+    .. note:: A response can only be iterated over once.
+
+    Errors contained in the response after the first item (e.g. for the second
+    request of a batch) are raised as :exc:`~amazonproduct.errors.AWSError`
+    while iterating.
+    """
+
+    def __init__(self, root, events):
+        self.root = root
+        self._events = events
+        self._tag = _tagger(root)
+
+    def __getattr__(self, name):
+        return getattr(self.root, name)
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s) at %s>' % (
+            self.__class__.__name__, self.root.tag, hex(id(self)))
+
+    def __iter__(self):
+        for _, item in self._iteritems(detach=True):
+            yield item
+
+    def _iteritems(self, detach):
+        """
+        Yields ``(Items element, item)`` tuples. With ``detach`` each item is
+        removed from the tree before it is returned.
+        """
+        item_tag, items_tag = self._tag('Item'), self._tag('Items')
+        error_tag = self._tag('Error')
+        for _, element in self._events:
+            if element.tag == error_tag:
+                raise _error(element, self._tag, self.root)
+            if element.tag != item_tag:
+                continue
+            parent = element.getparent()
+            if parent is None or parent.tag != items_tag:
+                continue  # e.g. Variations/Item
+            if detach:
+                parent.remove(element)
+            yield parent, element
+
+    def read(self):
+        """
+        Parses the rest of the response and returns the complete tree. Items
+        which have already been iterated over are no longer part of it!
+        """
+        for _ in self._iteritems(detach=False):
+            pass
+        return self.root
+
+
+def _tagger(root):
+    """
+    Returns a function which qualifies tag names with the namespace of
+    ``root``.
+    """
+    nspace = etree.QName(root).namespace
+    if nspace is None:
+        return lambda name: name
+    return lambda name: '{%s}%s' % (nspace, name)
+
+
+def _read(node):
+    if isinstance(node, StreamedResponse):
+        return node.read()
+    return node
+
+
+def _error(element, tag, root):
+    return AWSError(
+        code=element.findtext(tag('Code')),
+        msg=element.findtext(tag('Message')),
+        xml=root)
+
+
+class StreamPaginator (SearchPaginator):
+
+    """
+    Paginator over :class:`StreamedResponse` pages. Items are parsed while
+    iterating, so there is never more than one item of each page in memory.
+    """
+
+    def paginator_data(self, node):
+        return super(StreamPaginator, self).paginator_data(node.root)
+
+    def iterate(self, node):
+        return iter(node)
+
+
+class Processor (BaseProcessor):
+
+    """
+    Response processor using ``lxml.etree.XMLPullParser``. Elements are the
+    same as those of :class:`amazonproduct.processors.etree.Processor` but
+    :meth:`parse` returns a :class:`StreamedResponse`.
+
+    .. note:: ``lxml.objectify`` cannot be used here: element classes looked
+       up while parsing would not take an element's text into account.
+    """
+
+    #: bytes read from the response at a time
+    CHUNK_SIZE = 16 * 1024
+
+    streaming = True
+
+    paginators = {
+        ITEMS_PAGINATOR: StreamPaginator,
+    }
+
+    def _events(self, fp):
+        parser = etree.XMLPullParser(events=('end', ))
+        while True:
+            chunk = fp.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            for event in parser.read_events():
+                yield event
+        parser.close()
+        for event in parser.read_events():
+            yield event
+
+    def parse(self, fp):
+        """
+        Parses ``fp`` up to the end of the first item and returns a
+        :class:`StreamedResponse`. Errors found so far are raised right away.
+        """
+        events = self._events(fp)
+        root = None
+        for event, element in events:
+            if root is None:
+                root = element.getroottree().getroot()
+                tag = _tagger(root)
+                items_tag, item_tag = tag('Items'), tag('Item')
+            if element.tag == item_tag:
+                if element.getparent().tag == items_tag:
+                    events = chain([(event, element)], events)
+                    break
+            elif element.tag == tag('Error'):
+                raise _error(element, tag, root)
+        return StreamedResponse(root, events)
+
+    @classmethod
+    def parse_cart(cls, node):
+        """
+        Returns an instance of :class:`amazonproduct.contrib.Cart` based on
+        information extracted from ``node``.
+        """
+        return _etree.Processor.parse_cart(_read(node))
+
+    @classmethod
+    def parse_items(cls, node):
+        """
+        Returns list of ``(ASIN, item node)`` tuples for each ``Items`` element
+        in ``node``. This reads the rest of the response.
+        """
+        return parse_items(_read(node))
+
+    @classmethod
+    def parse_batch(cls, node):
+        """
+        Returns list of ``(operation, result node)`` tuples for each request
+        answered in ``node``. This reads the rest of the response.
+        """
+        return parse_batch(_read(node))
@@ -12,6 +12,8 @@ from amazonproduct.processors import ITEMS_PAGINATOR, RELATEDITEMS_PAGINATOR
 
 from amazonproduct.processors._lxml import SearchPaginator
 from amazonproduct.processors._lxml import RelatedItemsPaginator
+from amazonproduct.processors._lxml import parse_items, parse_batch
+from amazonproduct.processors._lxml import find_errors
 
 
 class SelectiveClassLookup(etree.CustomElementClassLookup):
@@ -61,13 +63,7 @@ class Processor (BaseProcessor):
         #~ from lxml import etree
         #~ print etree.tostring(tree, pretty_print=True)
 
-        try:
-            nspace = root.nsmap[None]
-            errors = root.xpath('//aws:Error', namespaces={'aws': nspace})
-        except KeyError:
-            errors = root.xpath('//Error')
-
-        for error in errors:
+        for error in find_errors(root):
             raise AWSError(
                 code=error.Code.text,
                 msg=error.Message.text,
@@ -113,3 +109,18 @@ class Processor (BaseProcessor):
             cart.subtotal = None
         return cart
 
+    @classmethod
+    def parse_items(cls, node):
+        """
+        Returns list of ``(ASIN, item node)`` tuples for each ``Items`` element
+        in ``node``.
+        """
+        return parse_items(node)
+
+    @classmethod
+    def parse_batch(cls, node):
+        """
+        Returns list of ``(operation, result node)`` tuples for each request
+        answered in ``node``.
+        """
+        return parse_batch(node)
@@ -0,0 +1,526 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Processor mapping responses directly onto compact record objects. Items are
+extracted in one pass over their elements into instances of :class:`Item`
+(a class with ``__slots__``) with typed attributes::
+
+    api = API(locale='de', processor='amazonproduct.processors.records')
+    for item in api.item_search('Books', Publisher='Galileo Press',
+                                ResponseGroup='Medium,Offers'):
+        print(item.asin, item.attributes.title,
+              item.offer_summary.lowest_new_price.amount)
+
+Only the elements of the response groups ``Small``, ``Medium``,
+``ItemAttributes``, ``Offers``, ``OfferSummary``, ``Images``, ``BrowseNodes``
+and ``SalesRank`` are mapped. Records are declared with :class:`Field`
+descriptors and can be extended by subclassing::
+
+    class ReviewedItem (records.Item):
+        reviews_url = records.Field('CustomerReviews/IFrameURL')
+        has_reviews = records.Field('CustomerReviews/HasReviews',
+                                    records.boolean)
+
+    processor = records.Processor(records={'Item': ReviewedItem})
+    api = API(locale='de', processor=processor)
+
+"""
+
+from decimal import Decimal
+import itertools
+
+import six
+
+from amazonproduct.contrib.cart import Cart
+from amazonproduct.errors import AWSError
+from amazonproduct.processors import BaseProcessor, BaseResultPaginator
+from amazonproduct.processors import ITEMS_PAGINATOR
+from amazonproduct.processors import elementtree
+from amazonproduct.processors.elementtree import ERRORS
+from amazonproduct.processors.elementtree import expand, extract_nspace
+
+
+def text(value):
+    return value
+
+
+def boolean(value):
+    return value in ('True', '1')
+
+
+_counter = itertools.count()
+
+
+class Field (object):
+
+    """
+    Maps the element(s) at ``path`` (relative to the record's element, steps
+    separated by ``/``) to a record attribute.
+    """
+
+    def __init__(self, path, type=text, many=False):
+        """
+        :param path: element path, e.g. ``'ItemAttributes/Title'``.
+        :param type: function converting the element's text (e.g. ``int`` or
+          ``Decimal``) or a :class:`Record` class (or its name) for elements
+          with children. Names are looked up in the processor's ``records``,
+          the module of the record class and this module.
+        :param many: if ``True``, the attribute is a list of all matching
+          elements.
+        """
+        self.path = path.split('/')
+        self.type = type
+        self.many = many
+        self._order = next(_counter)
+
+
+class RecordType (type):
+
+    """
+    Turns the :class:`Field` attributes of a record class into ``__slots__``.
+    All record classes are registered by qualified name (``module.Class``).
+    """
+
+    registry = {}
+
+    def __new__(mcs, name, bases, attrs):
+        fields = sorted(
+            ((key, val) for key, val in attrs.items()
+             if isinstance(val, Field)), key=lambda field: field[1]._order)
+        inherited = []
+        for base in bases:
+            for field in getattr(base, '_fields', []):
+                if field[0] not in attrs:
+                    inherited.append(field)
+        slots = set(key for key, _ in inherited)
+        for key, field in fields:
+            field.module = attrs.get('__module__')
+            del attrs[key]
+        attrs['__slots__'] = tuple(
+            key for key, _ in fields if key not in slots)
+        attrs['_fields'] = inherited + fields
+        cls = type.__new__(mcs, name, bases, attrs)
+        mcs.registry['%s.%s' % (cls.__module__, name)] = cls
+        return cls
+
+
+class Record (six.with_metaclass(RecordType, object)):
+
+    """
+    Base class for records. Attributes of fields without a matching element
+    are ``None`` (or an empty list).
+    """
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, ' '.join(
+            '%s=%r' % (key, getattr(self, key))
+            for key, _ in self._fields
+            if getattr(self, key) not in (None, [])))
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__
+                and self.as_dict() == other.as_dict())
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def as_dict(self):
+        """
+        Returns the record's attributes as (nested) ``dict``.
+        """
+        def convert(value):
+            if isinstance(value, Record):
+                return value.as_dict()
+            if isinstance(value, list):
+                return [convert(val) for val in value]
+            return value
+        return dict((key, convert(getattr(self, key)))
+                    for key, _ in self._fields)
+
+
+class Price (Record):
+
+    amount = Field('Amount', int)  #: in the smallest unit (e.g. cents)
+    currency_code = Field('CurrencyCode')
+    formatted_price = Field('FormattedPrice')
+
+    #: currencies without subunit
+    WHOLE_CURRENCIES = ('JPY', )
+
+    @property
+    def value(self):
+        """
+        Amount as :class:`decimal.Decimal` in the currency's main unit.
+        """
+        if self.amount is None:
+            return None
+        if self.currency_code in self.WHOLE_CURRENCIES:
+            return Decimal(self.amount)
+        return Decimal(self.amount).scaleb(-2)
+
+
+class Image (Record):
+
+    url = Field('URL')
+    height = Field('Height', int)
+    width = Field('Width', int)
+
+
+class ImageSet (Record):
+
+    swatch = Field('SwatchImage', Image)
+    small = Field('SmallImage', Image)
+    thumbnail = Field('ThumbnailImage', Image)
+    tiny = Field('TinyImage', Image)
+    medium = Field('MediumImage', Image)
+    large = Field('LargeImage', Image)
+
+
+class BrowseNode (Record):
+
+    id = Field('BrowseNodeId')
+    name = Field('Name')
+    is_category_root = Field('IsCategoryRoot', boolean)
+    ancestors = Field('Ancestors/BrowseNode', 'BrowseNode', many=True)
+    children = Field('Children/BrowseNode', 'BrowseNode', many=True)
+
+
+class ItemAttributes (Record):
+
+    title = Field('Title')
+    authors = Field('Author', many=True)
+    artists = Field('Artist', many=True)
+    actors = Field('Actor', many=True)
+    creators = Field('Creator', many=True)
+    binding = Field('Binding')
+    brand = Field('Brand')
+    color = Field('Color')
+    size = Field('Size')
+    ean = Field('EAN')
+    isbn = Field('ISBN')
+    label = Field('Label')
+    manufacturer = Field('Manufacturer')
+    model = Field('Model')
+    mpn = Field('MPN')
+    part_number = Field('PartNumber')
+    publisher = Field('Publisher')
+    studio = Field('Studio')
+    product_group = Field('ProductGroup')
+    product_type_name = Field('ProductTypeName')
+    list_price = Field('ListPrice', Price)
+    edition = Field('Edition')
+    number_of_pages = Field('NumberOfPages', int)
+    number_of_items = Field('NumberOfItems', int)
+    package_quantity = Field('PackageQuantity', int)
+    publication_date = Field('PublicationDate')
+    release_date = Field('ReleaseDate')
+    languages = Field('Languages/Language/Name', many=True)
+    features = Field('Feature', many=True)
+
+
+class OfferSummary (Record):
+
+    lowest_new_price = Field('LowestNewPrice', Price)
+    lowest_used_price = Field('LowestUsedPrice', Price)
+    lowest_collectible_price = Field('LowestCollectiblePrice', Price)
+    lowest_refurbished_price = Field('LowestRefurbishedPrice', Price)
+    total_new = Field('TotalNew', int)
+    total_used = Field('TotalUsed', int)
+    total_collectible = Field('TotalCollectible', int)
+    total_refurbished = Field('TotalRefurbished', int)
+
+
+class Offer (Record):
+
+    merchant = Field('Merchant/Name')
+    condition = Field('OfferAttributes/Condition')
+    listing_id = Field('OfferListing/OfferListingId')
+    price = Field('OfferListing/Price', Price)
+    sale_price = Field('OfferListing/SalePrice', Price)
+    amount_saved = Field('OfferListing/AmountSaved', Price)
+    percentage_saved = Field('OfferListing/PercentageSaved', int)
+    availability = Field('OfferListing/Availability')
+    super_saver_shipping = Field(
+        'OfferListing/IsEligibleForSuperSaverShipping', boolean)
+
+
+class Offers (Record):
+
+    total_offers = Field('TotalOffers', int)
+    total_offer_pages = Field('TotalOfferPages', int)
+    more_offers_url = Field('MoreOffersUrl')
+    offers = Field('Offer', Offer, many=True)
+
+
+class Item (Record):
+
+    asin = Field('ASIN')
+    parent_asin = Field('ParentASIN')
+    detail_page_url = Field('DetailPageURL')
+    sales_rank = Field('SalesRank', int)
+    attributes = Field('ItemAttributes', ItemAttributes)
+    offer_summary = Field('OfferSummary', OfferSummary)
+    offers = Field('Offers', Offers)
+    small_image = Field('SmallImage', Image)
+    medium_image = Field('MediumImage', Image)
+    large_image = Field('LargeImage', Image)
+    image_sets = Field('ImageSets/ImageSet', ImageSet, many=True)
+    browse_nodes = Field('BrowseNodes/BrowseNode', BrowseNode, many=True)
+
+
+class Items (Record):
+
+    """
+    Result of an ``ItemLookup``, ``ItemSearch`` or ``SimilarityLookup``
+    request.
+    """
+
+    is_valid = Field('Request/IsValid', boolean)
+    item_page = Field('Request/ItemSearchRequest/ItemPage', int)
+    total_results = Field('TotalResults', int)
+    total_pages = Field('TotalPages', int)
+    more_search_results_url = Field('MoreSearchResultsUrl')
+    items = Field('Item', 'Item', many=True)
+
+
+class BrowseNodes (Record):
+
+    """
+    Result of a ``BrowseNodeLookup`` request.
+    """
+
+    is_valid = Field('Request/IsValid', boolean)
+    browse_nodes = Field('BrowseNode', BrowseNode, many=True)
+
+
+class Response (object):
+
+    """
+    Parsed response. ``results`` is a list of ``(operation, result)`` tuples
+    (one per request). Results of operations without record class (e.g.
+    carts) are the original elements; in this case the element tree is kept
+    as ``root``.
+    """
+
+    __slots__ = ('operation', 'results', 'root')
+
+    def __init__(self, operation, results, root=None):
+        self.operation = operation
+        self.results = results
+        self.root = root
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s) at %s>' % (
+            self.__class__.__name__, self.operation, hex(id(self)))
+
+    def __iter__(self):
+        for items in self.items:
+            for item in items.items:
+                yield item
+
+    @property
+    def items(self):
+        """
+        All :class:`Items` results.
+        """
+        return [result for _, result in self.results
+                if isinstance(result, Items)]
+
+
+class Extractor (object):
+
+    """
+    Converts elements of one namespace into records. The dispatch table of
+    each record class (full tag name of child element to fields) is built on
+    first use.
+    """
+
+    def __init__(self, nspace, records):
+        self.nspace = nspace
+        self.records = records
+        self._tables = {}
+
+    def _resolve(self, record, module=__name__):
+        """
+        Returns the record class for ``record`` (a class or the name of a
+        class in ``module`` or this module) unless the processor replaces it.
+        """
+        if isinstance(record, six.string_types):
+            if record in self.records:
+                return self.records[record]
+            for module in (module, __name__):
+                name = '%s.%s' % (module, record)
+                if name in RecordType.registry:
+                    return RecordType.registry[name]
+            raise KeyError(record)
+        return self.records.get(record.__name__, record)
+
+    def _table(self, cls):
+        try:
+            return self._tables[cls]
+        except KeyError:
+            pass
+        table = {}
+        for key, field in cls._fields:
+            convert = field.type
+            if (isinstance(convert, six.string_types)
+                    or isinstance(convert, RecordType)):
+                record = self._resolve(convert, field.module)
+                convert = lambda node, record=record: self.record(record, node)
+            else:
+                convert = lambda node, fun=convert: (
+                    fun(node.text) if node.text is not None else None)
+            head, rest = field.path[0], field.path[1:]
+            table.setdefault(self.nspace + head, []).append(
+                (key, [self.nspace + tag for tag in rest], field.many, convert))
+        self._tables[cls] = table
+        return table
+
+    def record(self, cls, element):
+        """
+        Returns an instance of record class ``cls`` for ``element``.
+        """
+        record = cls.__new__(cls)
+        for key, field in cls._fields:
+            setattr(record, key, [] if field.many else None)
+        table = self._table(cls)
+        for child in element:
+            for key, rest, many, convert in table.get(child.tag, ()):
+                nodes = [child]
+                for tag in rest:
+                    nodes = [node for parent in nodes
+                             for node in parent if node.tag == tag]
+                if many:
+                    getattr(record, key).extend(convert(node) for node in nodes)
+                elif nodes and getattr(record, key) is None:
+                    setattr(record, key, convert(nodes[0]))
+        return record
+
+
+class RecordPaginator (BaseResultPaginator):
+
+    """
+    Paginator over :class:`Response` pages (of the first request).
+    """
+
+    counter = 'ItemPage'
+
+    def paginator_data(self, response):
+        items = response.items
+        if not items:
+            return 1, 0, 0
+        return (items[0].item_page or 1, items[0].total_pages or 0,
+                items[0].total_results or 0)
+
+    def iterate(self, response):
+        return iter(response)
+
+
+class Processor (BaseProcessor):
+
+    """
+    Response processor mapping responses onto records (see
+    :class:`Response`) using ElementTree. The element tree itself is not kept.
+    """
+
+    paginators = {
+        ITEMS_PAGINATOR: RecordPaginator,
+    }
+
+    #: record classes for the results of each operation by tag name
+    results = {
+        'Items': 'Items',
+        'BrowseNodes': 'BrowseNodes',
+    }
+
+    def __init__(self, records=None, module=None):
+        """
+        :param records: ``dict`` of record classes replacing the ones of the
+          same name (e.g. ``{'Item': MyItem}``).
+        :param module: ElementTree implementation to use (see
+          :class:`amazonproduct.processors.elementtree.Processor`).
+        """
+        self.records = records or {}
+        self.etree = elementtree._load_elementtree_module(
+            *[module] if module else [])
+        self._extractors = {}
+
+    def _extractor(self, nspace):
+        try:
+            return self._extractors[nspace]
+        except KeyError:
+            extractor = Extractor(nspace, self.records)
+            return self._extractors.setdefault(nspace, extractor)
+
+    def parse(self, fp):
+        root = self.etree.parse(fp).getroot()
+        ns = extract_nspace(root)
+        response = self.to_response(root, ns)
+        for path in expand(ERRORS, ns):
+            for error in root.findall(path):
+                raise AWSError(
+                    code=error.findtext('./%sCode' % ns),
+                    msg=error.findtext('./%sMessage' % ns),
+                    xml=response)
+        return response
+
+    def to_response(self, root, ns):
+        """
+        Converts the response element ``root`` into a :class:`Response`.
+        """
+        extractor = self._extractor(ns)
+        localname = lambda element: element.tag[len(ns):]
+        if localname(root) == 'MultiOperationResponse':
+            responses = [child for child in root
+                         if localname(child).endswith('Response')]
+        else:
+            responses = [root]
+        results = []
+        keep = None
+        for response in responses:
+            operation = localname(response)[:-len('Response')]
+            for result in response:
+                name = localname(result)
+                if name in ('OperationRequest', 'Error', 'RequestID'):
+                    continue
+                if name in self.results:
+                    record = extractor._resolve(self.results[name])
+                    result = extractor.record(record, result)
+                else:
+                    keep = root
+                results.append((operation, result))
+        return Response(localname(root)[:-len('Response')], results, keep)
+
+    @classmethod
+    def parse_cart(cls, node):
+        """
+        Returns an instance of :class:`amazonproduct.contrib.Cart` based on
+        information extracted from ``node``.
+        """
+        if node.root is None:
+            return Cart()
+        return elementtree.Processor.parse_cart(node.root)
+
+    @classmethod
+    def parse_items(cls, node):
+        """
+        Returns list of ``(ASIN, item)`` tuples for each :class:`Items` result
+        in ``node``.
+        """
+        return [[(item.asin, item) for item in items.items]
+                for items in node.items]
+
+    @classmethod
+    def parse_batch(cls, node):
+        """
+        Returns list of ``(operation, result)`` tuples for each request
+        answered in ``node``.
+        """
+        return list(node.results)
@@ -0,0 +1,299 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Sampling profiler for API calls. A :class:`SamplingProfiler` is an observer
+(see :mod:`amazonproduct.metrics`) which, for a fraction of all calls, samples
+the call stack of the calling thread in regular intervals. Stacks are counted
+per operation and written as collapsed stacks (one file per operation) which
+can be turned into flame graphs, e.g. with FlameGraph_ or speedscope_::
+
+    profiler = SamplingProfiler(sample_rate=0.1)
+    api = API(locale='de', observers=[profiler])
+    ...
+    profiler.write('/tmp/profiles')
+
+    $ flamegraph.pl /tmp/profiles/ItemLookup.folded > ItemLookup.svg
+
+Profiling can also be switched on without changing any code, either in the
+config file ::
+
+    [Profiling]
+    sample_rate = 0.1
+    interval = 0.001
+    output = /tmp/profiles
+
+or with environment variables ``AMAZON_PRODUCT_PROFILE`` (sample rate),
+``AMAZON_PRODUCT_PROFILE_INTERVAL`` and ``AMAZON_PRODUCT_PROFILE_DIR``. All API
+instances of a process then share one profiler which writes its files when
+the process exits. Config files are only read once per process and are
+ignored for API instances configured with a ``dict``. Invalid settings switch
+profiling off with a :exc:`RuntimeWarning`.
+
+.. note:: Calls of :class:`~amazonproduct.contrib.aio.AsyncAPI` are not
+   sampled: their thread runs the event loop for other coroutines as well.
+
+.. _FlameGraph: https://github.com/brendangregg/FlameGraph
+.. _speedscope: https://www.speedscope.app/
+"""
+
+import atexit
+from collections import defaultdict
+import os
+import random
+import sys
+import threading
+import time
+import warnings
+
+# Python 2/3 compatible imports
+try:
+    from configparser import SafeConfigParser
+except ImportError:  # pragma: no cover
+    from ConfigParser import SafeConfigParser
+
+from amazonproduct.metrics import BaseObserver
+from amazonproduct import utils
+
+#: interval between two samples in seconds
+DEFAULT_INTERVAL = 0.001
+
+
+def _api_call_frame(frame):
+    """
+    Returns the frame of :meth:`API.call <amazonproduct.api.API.call>` which
+    ``frame`` was called from or ``None`` (e.g. for coroutines of
+    :class:`~amazonproduct.contrib.aio.AsyncAPI`).
+    """
+    from amazonproduct.api import API  # imports this module
+    code = getattr(API.call, '__func__', API.call).__code__
+    while frame is not None and frame.f_code is not code:
+        frame = frame.f_back
+    return frame
+
+
+class SamplingProfiler (BaseObserver):
+
+    """
+    Samples the call stacks of API calls. Stacks start at
+    :meth:`~amazonproduct.api.API.call`; frames are named
+    ``<module>:<function>``.
+    """
+
+    def __init__(self, sample_rate=1.0, interval=DEFAULT_INTERVAL, seed=None):
+        """
+        :param sample_rate: fraction of calls which are sampled.
+        :param interval: seconds between two samples.
+        :param seed: seed for choosing the calls to sample.
+        """
+        if not 0 < sample_rate <= 1:
+            raise ValueError('Sample rate must be in (0, 1]!')
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.stacks = {}  #: counters of collapsed stacks by operation
+        self.calls = defaultdict(int)  #: number of sampled calls by operation
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._active = {}  # thread ident -> (operation, first frame)
+        self._busy = threading.Event()
+        self._closed = False
+        self._thread = None
+        self._labels = {}
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s, every %ss) at %s>' % (self.__class__.__name__,
+            self.sample_rate, self.interval, hex(id(self)))
+
+    def call_started(self, call):
+        root = _api_call_frame(sys._getframe(1))
+        if root is None:
+            return
+        with self._lock:
+            if self._closed or self._random.random() >= self.sample_rate:
+                return
+            self._active[threading.current_thread().ident] = (
+                call.operation, root)
+            self.calls[call.operation] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._busy.set()
+
+    def call_finished(self, call):
+        with self._lock:
+            self._active.pop(threading.current_thread().ident, None)
+            if not self._active:
+                self._busy.clear()
+
+    def _run(self):
+        while True:
+            self._busy.wait()
+            if self._closed:
+                return
+            time.sleep(self.interval)
+            self.sample()
+
+    def _label(self, code, module):
+        try:
+            return self._labels[code]
+        except KeyError:
+            label = '%s:%s' % (module, code.co_name)
+            return self._labels.setdefault(code, label.replace(';', ':'))
+
+    def sample(self):
+        """
+        Takes one sample of all calls being profiled.
+        """
+        with self._lock:
+            active = list(self._active.items())
+        if not active:
+            return
+        frames = sys._current_frames()
+        for ident, (operation, root) in active:
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None:
+                stack.append(self._label(
+                    frame.f_code, frame.f_globals.get('__name__', '?')))
+                if frame is root:
+                    break
+                frame = frame.f_back
+            if not stack:
+                continue
+            stack.reverse()
+            with self._lock:
+                if ident not in self._active:
+                    continue  # finished in the meantime
+                self.stacks.setdefault(operation, defaultdict(int))[
+                    ';'.join(stack)] += 1
+
+    def collapsed(self, operation):
+        """
+        Returns the collapsed stacks of ``operation`` as list of lines
+        (``frame;frame;frame count``).
+        """
+        with self._lock:
+            stacks = dict(self.stacks.get(operation, {}))
+        return ['%s %i' % item for item in sorted(stacks.items())]
+
+    def write(self, directory):
+        """
+        Writes the collapsed stacks of each operation to
+        ``<directory>/<operation>.folded`` and returns the paths.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        paths = []
+        for operation in sorted(self.stacks):
+            path = os.path.join(directory, '%s.folded' % operation)
+            with open(path, 'w') as fp:
+                for line in self.collapsed(operation):
+                    fp.write(line + '\n')
+            paths.append(path)
+        return paths
+
+    def close(self):
+        """
+        Stops sampling.
+        """
+        with self._lock:
+            self._closed = True
+            self._busy.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+# settings of section Profiling by config file(s) read
+_file_configs = {}
+
+
+def _read_config_files(paths):
+    """
+    Returns the settings of section ``Profiling`` in ``paths`` which are only
+    read once per process.
+    """
+    paths = tuple(paths)
+    try:
+        return _file_configs[paths]
+    except KeyError:
+        pass
+    config = SafeConfigParser()
+    config.read(paths)
+    result = {}
+    if config.has_section('Profiling'):
+        result.update(config.items('Profiling'))
+    return _file_configs.setdefault(paths, result)
+
+
+def load_profiling_config(path=None, files=True):
+    """
+    Returns the settings of section ``Profiling`` in the config file(s)
+    overridden by environment variables ``AMAZON_PRODUCT_PROFILE``,
+    ``AMAZON_PRODUCT_PROFILE_INTERVAL`` and ``AMAZON_PRODUCT_PROFILE_DIR``
+    (keys ``sample_rate``, ``interval`` and ``output``). Config files are
+    only read once per process.
+
+    :param path: path to config file (default: see
+      :data:`~amazonproduct.utils.CONFIG_FILES`).
+    :param files: ``False`` to use the environment variables only.
+    """
+    result = {}
+    if files:
+        if path is None:
+            paths = [os.path.expanduser(path) for path in utils.CONFIG_FILES]
+        else:
+            paths = [path]
+        result.update(_read_config_files(paths))
+    mapper = {
+        'sample_rate': 'AMAZON_PRODUCT_PROFILE',
+        'interval': 'AMAZON_PRODUCT_PROFILE_INTERVAL',
+        'output': 'AMAZON_PRODUCT_PROFILE_DIR',
+    }
+    for key, variable in mapper.items():
+        if variable in os.environ:
+            result[key] = os.environ[variable]
+    return result
+
+
+_profilers = {}
+_profilers_lock = threading.Lock()
+
+
+def from_config(path=None, files=True):
+    """
+    Returns the profiler configured for this process (see
+    :func:`load_profiling_config`) or ``None`` if profiling is off. The same
+    settings always return the same profiler. If an ``output`` directory is
+    configured, the collapsed stacks are written there at exit. Invalid
+    settings are reported with a :exc:`RuntimeWarning` and switch profiling
+    off.
+    """
+    config = load_profiling_config(path, files)
+    if not config.get('sample_rate'):
+        return None
+    try:
+        sample_rate = float(config['sample_rate'])
+        interval = float(config.get('interval') or DEFAULT_INTERVAL)
+    except ValueError:
+        warnings.warn('Invalid profiling settings %r: profiling is off!' % (
+            config, ), RuntimeWarning)
+        return None
+    if not sample_rate:
+        return None
+    output = config.get('output')
+    key = (sample_rate, interval, output)
+    with _profilers_lock:
+        if key not in _profilers:
+            try:
+                profiler = SamplingProfiler(sample_rate, interval)
+            except ValueError:
+                warnings.warn('Invalid profiling settings %r: %s' % (
+                    config, sys.exc_info()[1]), RuntimeWarning)
+                return None
+            _profilers[key] = profiler
+            if output:
+                atexit.register(profiler.write, output)
+        return _profilers[key]
@@ -0,0 +1,394 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Sending failed requests again. A :class:`RetryPolicy` passed to
+:class:`~amazonproduct.api.API` decides which errors are worth another try
+and how long to wait before it::
+
+    api = API(locale='de', retry=RetryPolicy(tries=5))
+
+* Requests are retried after throttling (:exc:`TooManyRequests`), internal
+  errors of Amazon (:exc:`InternalError`, or HTTP status 500, 502, 503 and 504
+  without an error message: :exc:`ServerError`) and network errors (timeouts,
+  lost connections). Other errors (e.g. invalid parameters) are raised right
+  away.
+* Waiting times grow exponentially and are chosen at random between zero and
+  that limit ("full jitter"), so that clients throttled at the same time do
+  not all come back at the same time. If Amazon sends a ``Retry-After``
+  header, it is honoured.
+* A :class:`CircuitBreaker` per host stops sending requests for a while after
+  several consecutive failures and raises :exc:`CircuitOpen` instead.
+* A :class:`RetryBudget` limits retries to a fraction of all requests, so that
+  retries cannot multiply the load while Amazon is struggling.
+
+A policy (including its circuit breakers and budget) can be shared by any
+number of threads and API instances.
+"""
+
+from collections import deque
+from email.utils import mktime_tz, parsedate_tz
+import random
+import socket
+import sys
+import threading
+import time
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    # Python 2 has no monotonic clock in its standard library
+    from time import time as monotonic
+
+# support Python 2 and Python 3 without conversion
+try:
+    from urllib.request import URLError
+except ImportError:  # pragma: no cover
+    from urllib2 import URLError
+
+import requests
+from requests.packages.urllib3 import exceptions as urllib3_exceptions
+
+from amazonproduct.errors import CircuitOpen, InternalError, ServerError
+from amazonproduct.errors import TooManyRequests
+
+#: mapped exceptions after which a request is sent again
+RETRYABLE_ERRORS = (TooManyRequests, InternalError)
+
+#: network errors after which a request is sent again
+try:
+    TRANSIENT_ERRORS = (ConnectionError, socket.timeout)
+except NameError:  # pragma: no cover
+    TRANSIENT_ERRORS = (socket.error, )  # Python 2
+TRANSIENT_ERRORS += (
+    requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    urllib3_exceptions.ProtocolError, urllib3_exceptions.TimeoutError)
+
+#: HTTP status codes of server errors after which a request is sent again
+TRANSIENT_STATUS = (500, 502, 503, 504)
+
+#: operations which change a cart: only retried if they were throttled
+NON_IDEMPOTENT_OPERATIONS = ('CartAdd', 'CartClear', 'CartCreate',
+                             'CartModify')
+
+
+def is_transient(error):
+    """
+    Returns ``True`` if ``error`` is a network or server error (see
+    :exc:`~amazonproduct.errors.ServerError`) which may go away if the request
+    is sent again.
+    """
+    if isinstance(error, ServerError):
+        return error.status in TRANSIENT_STATUS
+    if isinstance(error, URLError):
+        error = error.reason
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def retry_after(fp):
+    """
+    Returns the seconds to wait according to the ``Retry-After`` header of the
+    response ``fp`` (or ``None``).
+    """
+    headers = getattr(fp, 'headers', None)
+    if headers is None:
+        return None
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(mktime_tz(date) - time.time(), 0.0)
+
+
+class CircuitBreaker (object):
+
+    """
+    Counts consecutive failures of requests to one host. After ``threshold``
+    of them, the circuit is *open*: no requests are let through for
+    ``reset_timeout`` seconds. After that, a single request is let through
+    (*half-open*). If it succeeds, the circuit is closed again; otherwise it
+    stays open for another ``reset_timeout`` seconds.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, threshold=5, reset_timeout=30, clock=monotonic):
+        """
+        :param threshold: number of consecutive failures opening the circuit.
+        :param reset_timeout: seconds after which a request is let through
+          again.
+        :param clock: function returning a monotonic time in seconds.
+        """
+        if threshold < 1:
+            raise ValueError('Threshold must be at least 1!')
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s) at %s>' % (
+            self.__class__.__name__, self.state, hex(id(self)))
+
+    def allow(self):
+        """
+        Returns ``True`` if a request may be sent.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN
+                    and self.clock() - self._opened >= self.reset_timeout):
+                self.state = self.HALF_OPEN
+                return True  # the probe
+            return False
+
+    def succeeded(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if (self.state == self.HALF_OPEN
+                    or self.failures >= self.threshold):
+                self.state = self.OPEN
+                self._opened = self.clock()
+
+
+class RetryBudget (object):
+
+    """
+    Allows retries of up to ``ratio`` times the number of requests sent
+    within the last ``window`` seconds, plus ``minimum`` retries per window
+    for clients sending only few requests.
+    """
+
+    def __init__(self, ratio=0.2, minimum=10, window=10, clock=monotonic):
+        """
+        :param ratio: retries allowed per request.
+        :param minimum: retries allowed per window in any case.
+        :param window: length of the window in seconds.
+        :param clock: function returning a monotonic time in seconds.
+        """
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self.clock = clock
+        self._slots = deque()  # [second, requests, retries]
+        self._lock = threading.Lock()
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s, %s/%ss) at %s>' % (self.__class__.__name__,
+            self.ratio, self.minimum, self.window, hex(id(self)))
+
+    def _slot(self):
+        now = int(self.clock())
+        while self._slots and self._slots[0][0] <= now - self.window:
+            self._slots.popleft()
+        if not self._slots or self._slots[-1][0] != now:
+            self._slots.append([now, 0, 0])
+        return self._slots[-1]
+
+    def request(self):
+        """
+        Records a request (which is not a retry).
+        """
+        with self._lock:
+            self._slot()[1] += 1
+
+    def withdraw(self):
+        """
+        Returns ``True`` (and records the retry) if a retry is within budget.
+        """
+        with self._lock:
+            slot = self._slot()
+            sent = sum(s[1] for s in self._slots)
+            retries = sum(s[2] for s in self._slots)
+            if retries >= self.minimum + self.ratio * sent:
+                return False
+            slot[2] += 1
+            return True
+
+
+class RetryPolicy (object):
+
+    """
+    Decides whether and when a failed request is sent again (see
+    :mod:`amazonproduct.retry`).
+    """
+
+    def __init__(self, tries=5, base_delay=0.5, max_delay=30, backoff=2,
+                 retry_on=RETRYABLE_ERRORS, budget=None, threshold=5,
+                 reset_timeout=30, clock=monotonic, sleep=time.sleep,
+                 seed=None):
+        """
+        :param tries: maximum number of times a request is sent.
+        :param base_delay: upper limit of the first waiting time in seconds.
+        :param max_delay: upper limit of all waiting times. Requests are not
+          retried if Amazon asks to wait longer.
+        :param backoff: factor by which the limit grows with every try.
+        :param retry_on: mapped exceptions after which requests are retried
+          (network errors always are, see :func:`is_transient`).
+        :param budget: :class:`RetryBudget` (default: a new one). Pass
+          ``False`` to retry without limit.
+        :param threshold: consecutive failures after which a host's
+          :class:`CircuitBreaker` opens (``None`` for no circuit breakers).
+        :param reset_timeout: seconds for which an open circuit stays open.
+        :param clock: function returning a monotonic time in seconds.
+        :param sleep: function used to wait.
+        :param seed: seed for the random waiting times.
+        """
+        if tries < 1:
+            raise ValueError('Need at least one try!')
+        self.tries = tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.retry_on = tuple(retry_on)
+        if budget is None:
+            budget = RetryBudget(clock=clock)
+        self.budget = budget or None
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.breakers = {}  #: circuit breakers by host
+        self._breakers_lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s tries) at %s>' % (
+            self.__class__.__name__, self.tries, hex(id(self)))
+
+    def breaker(self, host):
+        """
+        Returns the :class:`CircuitBreaker` for ``host`` (or ``None``).
+        """
+        if self.threshold is None:
+            return None
+        try:
+            return self.breakers[host]
+        except KeyError:
+            with self._breakers_lock:
+                return self.breakers.setdefault(host, CircuitBreaker(
+                    self.threshold, self.reset_timeout, self.clock))
+
+    def is_retryable(self, error, operation=None):
+        """
+        Returns ``True`` if a request of ``operation`` which failed with
+        ``error`` may succeed if sent again.
+        """
+        if operation in NON_IDEMPOTENT_OPERATIONS:
+            # the cart may have been changed already
+            return isinstance(error, TooManyRequests)
+        return isinstance(error, self.retry_on) or is_transient(error)
+
+    def is_failure(self, error):
+        """
+        Returns ``True`` if ``error`` counts against the circuit breaker,
+        i.e. Amazon (or the network) failed to answer. Throttling does not.
+        """
+        if isinstance(error, TooManyRequests):
+            return False
+        return isinstance(error, self.retry_on) or is_transient(error)
+
+    def delay(self, tries, error=None):
+        """
+        Returns the seconds to wait after ``tries`` failed tries: a random
+        value up to ``base_delay * backoff ** (tries - 1)`` (but no more than
+        ``max_delay``), or more if ``error`` has a ``retry_after`` hint.
+        Returns ``None`` if the hint exceeds ``max_delay``.
+        """
+        limit = min(self.max_delay,
+                    self.base_delay * self.backoff ** (tries - 1))
+        delay = self._random.uniform(0, limit)
+        hint = getattr(error, 'retry_after', None)
+        if hint is not None:
+            if hint > self.max_delay:
+                return None
+            delay = max(delay, hint)
+        return delay
+
+    def call(self, attempt, host, operation=None, call=None):
+        """
+        Calls ``attempt`` (a function sending one request to ``host``) until
+        it succeeds, fails with an error which cannot be retried or runs out
+        of tries or budget. The last error is raised.
+
+        :param operation: Amazon operation of the request.
+        :param call: :class:`~amazonproduct.metrics.Call` in which retries and
+          waiting times (stage ``backoff``) are recorded.
+        """
+        breaker = self._started(host)
+        tries = 0
+        while True:
+            tries += 1
+            self._trying(breaker, host)
+            try:
+                result = attempt()
+            except Exception:
+                error = sys.exc_info()[1]  # Python 2/3 compatible
+                delay = self._failed(breaker, error, tries, operation)
+                if delay is None:
+                    raise
+            else:
+                self._succeeded(breaker)
+                return result
+
+            if call is None:
+                self.sleep(delay)
+            else:
+                call.retries += 1
+                with call.measure('backoff'):
+                    self.sleep(delay)
+
+    # The steps of call() are separate so that a coroutine (which cannot call
+    # attempt() itself) can use them, see amazonproduct.contrib.aio.
+
+    def _started(self, host):
+        """
+        Records a new request to ``host`` and returns its circuit breaker.
+        """
+        if self.budget is not None:
+            self.budget.request()
+        return self.breaker(host)
+
+    def _trying(self, breaker, host):
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpen(host)
+
+    def _succeeded(self, breaker):
+        if breaker is not None:
+            breaker.succeeded()
+
+    def _failed(self, breaker, error, tries, operation=None):
+        """
+        Records the failed try and returns the seconds to wait before the
+        next one or ``None`` if ``error`` is to be raised.
+        """
+        if breaker is not None:
+            if self.is_failure(error):
+                breaker.failed()
+            else:
+                breaker.succeeded()  # Amazon did answer
+        delay = None
+        if tries < self.tries and self.is_retryable(error, operation):
+            delay = self.delay(tries, error)
+        if delay is None or (self.budget is not None
+                             and not self.budget.withdraw()):
+            return None
+        return delay
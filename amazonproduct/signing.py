@@ -0,0 +1,243 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Signing of request URLs (see `Amazon's documentation`_).
+
+.. _Amazon's documentation: http://docs.aws.amazon.com/AWSECommerceService/latest/DG/rest-signature.html
+"""
+
+from base64 import b64encode
+from bisect import bisect, insort
+from hashlib import sha1, sha256
+import hmac
+import re
+import threading
+import time
+
+import six
+
+# support Python 2 and Python 3 without conversion
+try:
+    from urllib.parse import quote
+except ImportError:  # pragma: no cover
+    from urllib2 import quote
+
+#: parameters which are (usually) the same for all requests of an API
+STATIC_PARAMETERS = ('AWSAccessKeyId', 'AssociateTag', 'Service', 'Version')
+
+#: parameters which are added when signing a request
+SIGNING_PARAMETERS = ('Timestamp', 'Signature')
+
+# values consisting only of these characters are left alone by quote()
+_is_safe = re.compile(r'^[A-Za-z0-9_.\-/]*$').match
+
+
+def encode_value(value):
+    """
+    Returns ``value`` URL-encoded as needed for signing requests.
+    """
+    if not isinstance(value, six.string_types):
+        value = str(value)
+    if _is_safe(value):
+        return value
+    if isinstance(value, six.text_type):
+        value = value.encode('utf-8')
+    return quote(value)
+
+
+def encode_query(qargs):
+    """
+    Returns the query string for parameters ``qargs`` as needed for signing
+    requests: sorted by parameter name and with all values URL-encoded.
+    """
+    return '&'.join('%s=%s' % (key, encode_value(qargs[key]))
+                    for key in sorted(qargs))
+
+
+def canonical_query(qargs):
+    """
+    Returns the canonical query string for parameters ``qargs`` (see
+    :func:`encode_query`) without ``Timestamp`` and ``Signature``.
+    """
+    return encode_query(dict((key, val) for key, val in qargs.items()
+                             if key not in SIGNING_PARAMETERS))
+
+
+def request_key(qargs):
+    """
+    Returns a key identifying the request for parameters ``qargs`` no matter
+    in which order and encoding they were passed or when they were signed:
+    the SHA-1 hash of their canonical query string.
+    """
+    return _digest(canonical_query(qargs))
+
+
+def _digest(canonical):
+    return sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class PlannedRequest (object):
+
+    """
+    A complete request which is yet to be signed (see
+    :meth:`~amazonproduct.api.API.plan`). Planned requests can be pickled and
+    sent to other processes.
+
+    ``key``
+        Key identifying the request (see :func:`request_key`).
+    ``locale``
+        Locale of the API which planned the request.
+    ``query``
+        All query parameters (except ``Timestamp`` and ``Signature``).
+    ``canonical``
+        The canonical query string (see :func:`canonical_query`).
+    """
+
+    __slots__ = ('key', 'locale', 'query', 'canonical')
+
+    def __init__(self, key, locale, query, canonical):
+        self.key = key
+        self.locale = locale
+        self.query = query
+        self.canonical = canonical
+
+    @classmethod
+    def from_query(cls, qargs, locale=None):
+        """
+        Returns the planned request for the (complete) query parameters
+        ``qargs``.
+        """
+        query = dict((key, val) for key, val in qargs.items()
+                     if key not in SIGNING_PARAMETERS)
+        canonical = encode_query(query)
+        return cls(_digest(canonical), locale, query, canonical)
+
+    def __reduce__(self):
+        return (self.__class__,
+                (self.key, self.locale, self.query, self.canonical))
+
+    def __eq__(self, other):
+        return (isinstance(other, PlannedRequest)
+                and self.__reduce__() == other.__reduce__())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.key, self.locale))
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s/%s %s)>' % (self.__class__.__name__,
+            self.query.get('Operation'), self.locale, self.key)
+
+
+class Signer (object):
+
+    """
+    Signs request URLs for one host with one secret key. The HMAC is keyed
+    only once and copied for each request; encoded static parameters (see
+    :data:`STATIC_PARAMETERS`) and the timestamp (which changes once a second)
+    are cached. A signer is thread-safe.
+    """
+
+    #: path of all requests
+    PATH = '/onca/xml'
+
+    def __init__(self, secret_key, host, clock=time.time):
+        """
+        :param secret_key: AWS secret key.
+        :param host: host (and optionally port) requests are sent to.
+        :param clock: function returning the current UNIX time.
+        """
+        self.secret_key = secret_key
+        self.host = host
+        self.clock = clock
+        key = secret_key or ''
+        if isinstance(key, six.text_type):
+            key = key.encode('utf-8')
+        message = 'GET\n%s\n%s\n' % (host, self.PATH)
+        self._hmac = hmac.new(key, message.encode('utf-8'), sha256)
+        self._url = 'http://%s%s?' % (host, self.PATH)
+        self._static = {}
+        self._timestamp = (None, None)
+        self._lock = threading.Lock()
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s) at %s>' % (
+            self.__class__.__name__, self.host, hex(id(self)))
+
+    def timestamp(self):
+        """
+        Returns the current time formatted as needed for parameter
+        ``Timestamp``.
+        """
+        now = int(self.clock())
+        second, formatted = self._timestamp
+        if second != now:
+            formatted = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now))
+            self._timestamp = (now, formatted)
+        return formatted
+
+    def _encode_static(self, key, value):
+        try:
+            return self._static[key, value]
+        except (KeyError, TypeError):
+            pair = '%s=%s' % (key, encode_value(value))
+            with self._lock:
+                if len(self._static) > 64:
+                    self._static.clear()  # values do not seem to be static
+                self._static[key, value] = pair
+            return pair
+
+    def _sign(self, qargs, timestamp):
+        keys = sorted(qargs)
+        if 'Timestamp' not in qargs:
+            insort(keys, 'Timestamp')
+        pairs = []
+        for key in keys:
+            if key in STATIC_PARAMETERS:
+                pairs.append(self._encode_static(key, qargs[key]))
+            elif key == 'Timestamp':
+                pairs.append('Timestamp=' + encode_value(timestamp))
+            else:
+                pairs.append('%s=%s' % (key, encode_value(qargs[key])))
+        return self._sign_args('&'.join(pairs))
+
+    def _sign_args(self, args):
+        digest = self._hmac.copy()
+        digest.update(args.encode('utf-8'))
+        signature = b64encode(digest.digest())
+        if not isinstance(signature, str):
+            signature = signature.decode('ascii')
+        signature = signature.replace('+', '%2B').replace('=', '%3D')
+        return '%s%s&Signature=%s' % (self._url, args, signature)
+
+    def sign(self, qargs, timestamp=None):
+        """
+        Returns the signed URL for query parameters ``qargs`` with the
+        current time (or ``timestamp``) as ``Timestamp``.
+        """
+        return self._sign(qargs, timestamp or self.timestamp())
+
+    def sign_many(self, queries):
+        """
+        Returns a list of signed URLs, one for each ``dict`` of query
+        parameters in ``queries``. All of them get the same timestamp.
+        """
+        timestamp = self.timestamp()
+        return [self._sign(qargs, timestamp) for qargs in queries]
+
+    def sign_canonical(self, canonical, timestamp=None):
+        """
+        Returns the signed URL for a canonical query string (see
+        :func:`canonical_query`) with the current time (or ``timestamp``) as
+        ``Timestamp``.
+        """
+        pairs = canonical.split('&') if canonical else []
+        names = [pair.partition('=')[0] for pair in pairs]
+        pairs.insert(bisect(names, 'Timestamp'),
+                     'Timestamp=' + encode_value(timestamp or self.timestamp()))
+        return self._sign_args('&'.join(pairs))
@@ -0,0 +1,365 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Rate limiting for requests sent to Amazon.
+
+The state of a :class:`TokenBucket` is kept by a backend. Depending on who has
+to share a limit, use one of the following:
+
+* :class:`LocalBackend` (default) for threads within the same process,
+* :class:`FileBackend` for processes running on the same host,
+* :class:`RemoteBackend` for processes running on several hosts which all
+  consult the same :class:`TokenServer`.
+"""
+
+import errno
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    # Python 2 has no monotonic clock in its standard library
+    from time import time as monotonic
+
+# support Python 2 and Python 3 without conversion
+try:
+    import socketserver
+except ImportError:  # pragma: no cover
+    import SocketServer as socketserver
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # not available on Windows
+
+
+def _take(state, now, tokens, rate, burst):
+    """
+    Refills a bucket ``state`` (``[tokens, last update]``) up to ``now`` and
+    takes ``tokens`` from it. Returns the seconds to wait before the tokens may
+    be used.
+    """
+    elapsed = max(now - state[1], 0)
+    state[0] = min(burst, state[0] + elapsed * rate) - tokens
+    state[1] = now
+    if state[0] < 0:
+        return -state[0] / rate
+    return 0.0
+
+
+class BaseBackend (object):
+
+    """
+    Skeleton class for backends storing the state of token buckets.
+
+    If you like to coordinate rate limits by other means (e.g. a database),
+    subclass :class:`BaseBackend` and override :meth:`reserve`.
+    """
+
+    def reserve(self, key, tokens, rate, burst):
+        """
+        Takes ``tokens`` from bucket ``key`` (which is refilled with ``rate``
+        tokens per second up to ``burst`` tokens) and returns the number of
+        seconds after which they may be used.
+        """
+        raise NotImplementedError  # pragma: no cover
+
+
+class LocalBackend (BaseBackend):
+
+    """
+    Keeps all buckets in memory. They can be shared by all threads of one
+    process.
+    """
+
+    def __init__(self, clock=monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def reserve(self, key, tokens, rate, burst):
+        with self._lock:
+            state = self._buckets.setdefault(key, [float(burst), self.clock()])
+            return _take(state, self.clock(), tokens, rate, burst)
+
+
+class FileBackend (BaseBackend):
+
+    """
+    Keeps all buckets in a small JSON file which is locked while being
+    updated. All processes on a host using the same file share their limits.
+
+    Because the file outlives processes (and reboots) wall-clock time is used.
+
+    .. note:: This backend needs :mod:`fcntl` and will not work on Windows.
+    """
+
+    def __init__(self, path, clock=time.time):
+        """
+        :param path: path to the state file. It will be created if necessary.
+        """
+        if fcntl is None:  # pragma: no cover
+            raise NotImplementedError('%s needs fcntl!' % (
+                self.__class__.__name__, ))
+        self.path = path
+        self.clock = clock
+
+    def reserve(self, key, tokens, rate, burst):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            content = b''
+            while True:
+                chunk = os.read(fd, 4096)
+                if not chunk:
+                    break
+                content += chunk
+            try:
+                buckets = json.loads(content.decode('utf-8'))
+            except ValueError:
+                buckets = {}  # new (or damaged) file
+
+            now = self.clock()
+            state = buckets.setdefault(key, [float(burst), now])
+            wait = _take(state, now, tokens, rate, burst)
+
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, json.dumps(buckets).encode('utf-8'))
+            return wait
+        finally:
+            os.close(fd)  # releases lock, too
+
+
+class RemoteBackend (BaseBackend):
+
+    """
+    Asks a :class:`TokenServer` for tokens. All processes talking to the same
+    server share their limits regardless of the host they are running on.
+
+    If the connection to the server is lost, one attempt to reconnect is made
+    before the error is raised.
+    """
+
+    def __init__(self, address, timeout=5):
+        """
+        :param address: ``(host, port)`` of the :class:`TokenServer`.
+        :param timeout: socket timeout in seconds.
+        """
+        self.address = address
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = self._file = None
+
+    def _connect(self):
+        self._sock = socket.create_connection(self.address, self.timeout)
+        self._file = self._sock.makefile('rb')
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+        self._sock = self._file = None
+
+    def close(self):
+        """
+        Closes the connection to the server.
+        """
+        with self._lock:
+            self._disconnect()
+
+    def _request(self, line):
+        if self._sock is None:
+            self._connect()
+        self._sock.sendall(line)
+        answer = self._file.readline()
+        if not answer:
+            raise socket.error(errno.ECONNRESET, 'Connection closed by server')
+        return answer
+
+    def reserve(self, key, tokens, rate, burst):
+        if any(c.isspace() for c in key):
+            raise ValueError('Key must not contain whitespace: %r' % key)
+        line = ('RESERVE %s %r %r %r\n' % (
+            key, tokens, float(rate), burst)).encode('utf-8')
+        with self._lock:
+            try:
+                answer = self._request(line)
+            except (socket.error, OSError):
+                # reconnect once, the server may have been restarted
+                self._disconnect()
+                answer = self._request(line)
+        status, value = answer.decode('utf-8').split(None, 1)
+        if status != 'OK':
+            raise ValueError(value.strip())
+        return float(value)
+
+
+class _TokenRequestHandler (socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                command, key, tokens, rate, burst = line.decode(
+                    'utf-8').split()
+                if command != 'RESERVE':
+                    raise ValueError('Unknown command %r' % command)
+                wait = self.server.backend.reserve(
+                    key, float(tokens), float(rate), float(burst))
+                answer = 'OK %r\n' % wait
+            except ValueError:
+                e = sys.exc_info()[1]  # Python 2/3 compatible
+                answer = 'ERROR %s\n' % e
+            self.wfile.write(answer.encode('utf-8'))
+            self.wfile.flush()
+
+
+class TokenServer (socketserver.ThreadingMixIn, socketserver.TCPServer):
+
+    """
+    Minimal TCP server handing out tokens to :class:`RemoteBackend` clients.
+    The state is kept in a :class:`LocalBackend`. It can be run as a central
+    service or as local stand-in for tests::
+
+        server = TokenServer(('localhost', 0))
+        threading.Thread(target=server.serve_forever).start()
+        backend = RemoteBackend(server.server_address)
+
+    Each line sent to the server has the form ``RESERVE <key> <tokens> <rate>
+    <burst>`` and is answered with ``OK <seconds to wait>``.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, backend=None):
+        self.backend = backend or LocalBackend()
+        socketserver.TCPServer.__init__(self, address, _TokenRequestHandler)
+
+
+class TokenBucket (object):
+
+    """
+    Thread-safe token bucket allowing ``rate`` requests per second on average
+    and bursts of up to ``burst`` requests at once. A single instance can be
+    shared by any number of threads and :class:`~amazonproduct.api.API`
+    instances which will then collectively stay within the limit. ::
+
+        throttle = TokenBucket(rate=1, burst=1)
+        de = API(locale='de', throttle=throttle)
+        uk = API(locale='uk', throttle=throttle)
+
+    Callers are served in the order in which they asked for tokens.
+
+    To share a limit between processes or hosts, pass a ``backend`` (see
+    :mod:`amazonproduct.throttling`). All buckets using the same backend and
+    ``key`` draw from the same tokens::
+
+        backend = FileBackend('/var/run/amazon-product-api.throttle')
+        throttle = TokenBucket(rate=1, backend=backend, key='redtoad-21')
+
+    A token bucket has the following attributes which can be used to monitor
+    how long callers are kept waiting:
+
+    ``acquired``
+        Number of tokens handed out so far.
+
+    ``delayed``
+        Number of times a caller had to wait for a token.
+
+    ``total_wait``
+        Sum of all waiting times in seconds.
+
+    ``max_wait``
+        Longest waiting time in seconds.
+    """
+
+    def __init__(self, rate, burst=1, clock=monotonic, backend=None,
+                 key='default'):
+        """
+        :param rate: number of tokens added to the bucket per second (may be a
+          float, e.g. ``2000/3600.0``).
+        :param burst: maximum number of tokens the bucket can hold.
+        :param clock: function returning a monotonic time in seconds (only
+          used if no ``backend`` is given).
+        :param backend: :class:`BaseBackend` keeping the bucket's state
+          (default: a new :class:`LocalBackend`).
+        :param key: name of the bucket within the backend.
+        """
+        if rate <= 0:
+            raise ValueError('Rate must be positive!')
+        if burst < 1:
+            raise ValueError('Burst must be at least 1!')
+        self.rate = float(rate)
+        self.burst = burst
+        self.backend = backend or LocalBackend(clock)
+        self.key = key
+
+        self._lock = threading.Lock()
+
+        self.acquired = self.delayed = 0
+        self.total_wait = self.max_wait = 0.0
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%s/s, burst=%s) at %s>' % (
+            self.__class__.__name__, self.rate, self.burst, hex(id(self)))
+
+    def reserve(self, tokens=1):
+        """
+        Takes ``tokens`` from the bucket without waiting for them and returns
+        the number of seconds after which they may be used. If the bucket does
+        not hold enough tokens, the difference is owed and subsequent callers
+        will have to wait correspondingly longer.
+        """
+        wait = self.backend.reserve(self.key, tokens, self.rate, self.burst)
+        with self._lock:
+            if wait > 0:
+                self.delayed += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            self.acquired += tokens
+        return wait
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until ``tokens`` are available and returns the number of seconds
+        waited.
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def acquire_async(self, tokens=1):
+        """
+        Same as :meth:`acquire` but returns an awaitable for use with
+        :mod:`asyncio`::
+
+            waited = await throttle.acquire_async()
+
+        .. note:: Tokens are reserved immediately. Cancelling the awaitable
+           will not return them to the bucket.
+        """
+        import asyncio
+        wait = self.reserve(tokens)
+        return asyncio.sleep(wait, result=wait)
+
+    def stats(self):
+        """
+        Returns the wait-time metrics as dict.
+        """
+        with self._lock:
+            return {
+                'acquired': self.acquired,
+                'delayed': self.delayed,
+                'total_wait': self.total_wait,
+                'max_wait': self.max_wait,
+            }
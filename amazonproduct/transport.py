@@ -0,0 +1,107 @@
+# Copyright (C) 2009-2015 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+HTTP transports used by :class:`~amazonproduct.api.API` to send requests to
+Amazon.
+"""
+
+import functools
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from amazonproduct.errors import ServerError
+
+
+class BaseTransport (object):
+
+    """
+    Skeleton class for transports.
+
+    A transport sends the signed request URL to Amazon and returns the
+    response body as file-like object. If you like to use a different HTTP
+    library, subclass :class:`BaseTransport` and override the methods.
+    """
+
+    def fetch(self, url, headers=None):
+        """
+        Sends a GET request to ``url`` and returns a file-like object from
+        which the (decoded) response body can be read.
+
+        :raises: :exc:`~amazonproduct.errors.ServerError` (with the response)
+          if Amazon answered with a status of 500 or above. Other error
+          responses are returned (their body holds Amazon's error message).
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def close(self):
+        """
+        Releases all resources (e.g. open connections) held by this transport.
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SessionTransport (BaseTransport):
+
+    """
+    Transport using a persistent :class:`requests.Session`. Connections are
+    kept alive and re-used for subsequent requests to the same host, saving a
+    TCP handshake per request.
+
+    .. note:: A connection is only returned to the pool once the response has
+       been read completely.
+    """
+
+    #: Number of hosts for which connection pools are kept.
+    POOL_CONNECTIONS = 10
+
+    #: Maximum number of connections kept alive per host.
+    POOL_MAXSIZE = 10
+
+    def __init__(self, pool_connections=None, pool_maxsize=None,
+                 pool_block=False):
+        """
+        :param pool_connections: number of hosts for which connection pools
+          are kept (default: :const:`POOL_CONNECTIONS`).
+        :param pool_maxsize: maximum number of connections kept alive per host
+          (default: :const:`POOL_MAXSIZE`).
+        :param pool_block: if ``True``, wait for a free connection rather than
+          opening (and later discarding) an additional one once
+          ``pool_maxsize`` connections are in use.
+        """
+        if pool_connections is None:
+            pool_connections = self.POOL_CONNECTIONS
+        if pool_maxsize is None:
+            pool_maxsize = self.POOL_MAXSIZE
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s(%i/%i) at %s>' % (self.__class__.__name__,
+            self.pool_connections, self.pool_maxsize, hex(id(self)))
+
+    def fetch(self, url, headers=None):
+        response = self.session.get(url, stream=True, headers=headers)
+        # https://github.com/kennethreitz/requests/issues/2155
+        response.raw.read = functools.partial(
+            response.raw.read, decode_content=True)
+        if response.status_code >= 500:
+            raise ServerError(response.status_code, response.raw)
+        return response.raw
+
+    def close(self):
+        self.session.close()
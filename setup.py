@@ -41,6 +41,14 @@ class PyTest(Command):
             sys.executable, os.path.join(_here, 'tests', 'runtests.py'), '-vl'])
         raise SystemExit(errno)
 
+install_requires = [
+    'requests',
+    'six',
+]
+if sys.version_info < (3, 2):
+    # concurrent.futures (used for prefetching pages) is a backport there
+    install_requires.append('futures')
+
 # make sure that no development version end up on PyPI
 if 'register' in sys.argv or 'upload' in sys.argv:
     version_ = version()
@@ -64,10 +72,7 @@ setup(
     packages=find_packages(_here, exclude=['tests']),
 
     cmdclass={'test': PyTest},
-    install_requires=[
-        'requests',
-        'six',
-    ],
+    install_requires=install_requires,
     tests_require=[
         'pytest-localserver>=0.3',
         'lxml',
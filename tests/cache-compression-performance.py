@@ -0,0 +1,78 @@
+# Copyright (C) 2015 Sebastian Rahlf <basti at redtoad dot de>
+
+"""
+Compare the disk footprint and speed of the codecs available for the response
+cache (see :class:`~amazonproduct.contrib.caching.CompressedCache`) using the
+recorded XML responses. Dictionaries are trained on every other file and
+measured on the rest::
+
+    $ python tests/cache-compression-performance.py
+    Compressing 437 XML files (1563 KB)...
+    uncompressed           1563 KB  100.0%
+    zlib                    343 KB  22.0%  compress   32ms  decompress    6ms
+    zlib + dictionary       190 KB  12.2%  compress   57ms  decompress    9ms
+    zstd                    366 KB  23.4%  compress    6ms  decompress    2ms
+    zstd + dictionary       142 KB   9.1%  compress    3ms  decompress    1ms
+
+"""
+
+from __future__ import print_function
+
+import os.path
+import sys
+import time
+
+# make sure that amazonproduct can be imported from parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from amazonproduct.contrib.caching import ZlibCodec, ZstdCodec
+
+
+def measure(codec, samples):
+    start = time.time()
+    compressed = []
+    for sample in samples:
+        compressor = codec.compressor()
+        compressed.append(compressor.compress(sample) + compressor.flush())
+    compress = time.time() - start
+
+    start = time.time()
+    for data in compressed:
+        decompressor = codec.decompressor()
+        decompressor.decompress(data)
+        decompressor.flush()
+    decompress = time.time() - start
+    return sum(len(data) for data in compressed), compress, decompress
+
+
+if __name__ == '__main__':
+
+    xml_dir = os.path.join(os.path.dirname(__file__), '2011-08-01')
+    files = []
+    for name in sorted(os.listdir(xml_dir)):
+        with open(os.path.join(xml_dir, name), 'rb') as fp:
+            files.append(fp.read())
+    training, samples = files[::2], files[1::2]
+    total = sum(len(sample) for sample in samples)
+
+    print('Compressing %i XML files (%i KB)...' % (len(samples), total / 1024))
+    print('%-20s %6i KB  100.0%%' % ('uncompressed', total / 1024))
+
+    codecs = [
+        ('zlib', lambda: ZlibCodec()),
+        ('zlib + dictionary', lambda: ZlibCodec(
+            dictionary=ZlibCodec.train(training))),
+        ('zstd', lambda: ZstdCodec()),
+        ('zstd + dictionary', lambda: ZstdCodec(
+            dictionary=ZstdCodec.train(training))),
+    ]
+    for label, factory in codecs:
+        try:
+            codec = factory()
+        except ImportError:
+            print('%-20s not installed!' % label)
+            continue
+        size, compress, decompress = measure(codec, samples)
+        print('%-20s %6i KB %5.1f%%  compress %4ims  decompress %4ims' % (
+            label, size / 1024, 100.0 * size / total,
+            compress * 1000, decompress * 1000))
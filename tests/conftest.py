@@ -1,6 +1,7 @@
 import os.path
 import pytest
 import re
+import sys
 import textwrap
 
 # Python 2/3 compatible imports
@@ -13,6 +14,11 @@ from amazonproduct import utils
 
 pytest_plugins = 'localserver'
 
+# modules using syntax of Python 3.5+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('test_contrib_aio.py')
+
 
 def pytest_addoption(parser):
     group = parser.getgroup('amazonproduct',
@@ -0,0 +1,345 @@
+# Copyright (C) 2015 Sebastian Rahlf <basti at redtoad dot de>
+
+"""
+Load test of the API classes against the local stand-in server (see
+``tests/standin.py``) which answers with the recorded responses. Each
+scenario sends the same (shuffled) requests from ``--clients`` threads (or, for
+``async``, with as many requests in flight) and reports throughput, latency
+percentiles, the outcome of all requests and how the server answered them::
+
+    $ python tests/load-performance.py --requests 2000 --clients 8 \\
+          --latency 0.02 --jitter 0.01 --failure-rate 0.005
+    Sending 2000 requests (8 clients) to 571 recorded responses...
+    scenario  requests    req/s    p50 ms   p90 ms   p99 ms   max ms
+    api           2000    266.5      29.7     35.6     43.7     55.7
+      outcomes: ok 1012, ParameterOutOfRange 263, CartInfoMismatch 254, ...
+      server:   served 1990, missing 0, throttled 0, failed 6, disconnected 4
+    caching       2000    407.3      26.7     35.1     44.4     55.6
+      outcomes: ok 1015, ParameterOutOfRange 263, CartInfoMismatch 254, ...
+      server:   served 1243, missing 0, throttled 0, failed 3, disconnected 3
+    ...
+
+Most errors are expected: many of the recorded responses are errors.
+
+Scenarios:
+
+``api``
+    :class:`~amazonproduct.api.API`
+``caching``
+    API with :class:`~amazonproduct.contrib.caching.CachingMixin` (a
+    :class:`~amazonproduct.contrib.caching.MemoryCache`); repeated requests
+    are answered from the cache.
+``retry``
+    :class:`~amazonproduct.contrib.retry.RetryAPI`
+``async``
+    :class:`~amazonproduct.contrib.aio.AsyncAPI` (needs aiohttp)
+
+Client-side throttling is disabled unless ``--client-rate`` is given; use
+``--rate`` to have the server throttle requests instead. To run against a
+stand-in server in another process (or on another host), pass its address
+with ``--host``.
+
+With ``--profile DIR`` the call stacks of ``--profile-rate`` of all calls are
+sampled (see :mod:`amazonproduct.profiling`) and written as collapsed stacks
+to ``DIR/<scenario>/<operation>.folded``.
+"""
+
+from __future__ import print_function, division
+
+import argparse
+from collections import Counter
+import json
+import os.path
+import random
+import sys
+import threading
+import warnings
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # pragma: no cover
+    from time import time as clock
+
+try:
+    from queue import Queue, Empty
+except ImportError:  # pragma: no cover
+    from Queue import Queue, Empty
+
+# make sure that amazonproduct can be imported
+# from parent directory
+_here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(_here))
+
+from amazonproduct.api import API
+from amazonproduct.contrib.caching import CachingMixin, MemoryCache
+from amazonproduct.contrib.retry import RetryAPI
+from amazonproduct.profiling import SamplingProfiler
+from amazonproduct.throttling import TokenBucket
+from tests.standin import Fixtures, StandInServer, FAILURES
+
+#: credentials used for all requests (the stand-in ignores them)
+CONFIG = {'access_key': 'XXX', 'secret_key': 'XXX', 'associate_tag': 'XXX'}
+
+SCENARIOS = ('api', 'caching', 'retry', 'async')
+
+
+class CachingAPI (CachingMixin, API):
+    pass
+
+
+def percentile(values, percent):
+    """
+    Returns the ``percent``-th percentile (nearest rank) of sorted ``values``.
+    """
+    if not values:
+        return None
+    rank = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class Scenario (object):
+
+    """
+    Creates one API per locale and sends requests with them.
+    """
+
+    def __init__(self, name, host, processor, throttle, observers=()):
+        self.name = name
+        self.host = host
+        self.processor = processor
+        self.throttle = throttle
+        self.observers = list(observers)
+        self.apis = {}
+
+    def api_class(self):
+        if self.name == 'caching':
+            return CachingAPI
+        if self.name == 'retry':
+            return RetryAPI
+        if self.name == 'async':
+            from amazonproduct.contrib.aio import AsyncAPI
+            return AsyncAPI
+        return API
+
+    def api(self, locale):
+        if locale not in self.apis:
+            kwargs = {}
+            if self.name == 'caching':
+                kwargs['cache'] = MemoryCache(max_entries=100000)
+            api = self.api_class()(
+                locale=locale, processor=self.processor, cfg=dict(CONFIG),
+                throttle=self.throttle, observers=self.observers, **kwargs)
+            api.host = '%s/%s' % (self.host, locale)
+            self.apis[locale] = api
+        return self.apis[locale]
+
+    def close(self):
+        for api in self.apis.values():
+            api.close()
+
+
+def send(api, query):
+    """
+    Sends one request and returns its latency in seconds and outcome (``ok``
+    or the name of the exception raised).
+    """
+    start = clock()
+    try:
+        api.call(**query)
+        outcome = 'ok'
+    except Exception:
+        outcome = sys.exc_info()[0].__name__
+    return clock() - start, outcome
+
+
+def run_threads(scenario, workload, clients):
+    # create all APIs up front so threads do not race for them
+    for locale, _ in workload:
+        scenario.api(locale)
+    queue = Queue()
+    for request in workload:
+        queue.put(request)
+    results = []
+
+    def client():
+        while True:
+            try:
+                locale, query = queue.get_nowait()
+            except Empty:
+                return
+            results.append(send(scenario.api(locale), query))
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scenario.close()
+    return results
+
+
+def run_async(scenario, workload, clients):
+    import asyncio
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    requests = iter(workload)
+    results = []
+    pending = {}
+
+    def submit():
+        for locale, query in requests:
+            task = loop.create_task(scenario.api(locale).call(**query))
+            pending[task] = clock()
+            return
+
+    for _ in range(clients):
+        submit()
+    while pending:
+        done, _ = loop.run_until_complete(asyncio.wait(
+            list(pending), return_when=asyncio.FIRST_COMPLETED))
+        stop = clock()
+        for task in done:
+            error = task.exception()
+            results.append((stop - pending.pop(task),
+                            type(error).__name__ if error else 'ok'))
+            submit()
+    for api in scenario.apis.values():
+        loop.run_until_complete(api.close())
+    loop.close()
+    return results
+
+
+def run(name, args, host, workload, server=None):
+    throttle = TokenBucket(args.client_rate or 1e9, burst=args.client_burst)
+    profiler = None
+    if args.profile:
+        profiler = SamplingProfiler(args.profile_rate, seed=args.seed)
+    scenario = Scenario(name, host, args.processor, throttle,
+                        [profiler] if profiler else [])
+    before = Counter(server.stats) if server is not None else None
+    start = clock()
+    if name == 'async':
+        results = run_async(scenario, workload, args.clients)
+    else:
+        results = run_threads(scenario, workload, args.clients)
+    elapsed = clock() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    report = {
+        'requests': len(results),
+        'seconds': elapsed,
+        'per_second': len(results) / elapsed,
+        'latency_ms': dict(
+            ('p%i' % p, 1000 * percentile(latencies, p))
+            for p in (50, 90, 99)),
+        'outcomes': dict(Counter(outcome for _, outcome in results)),
+    }
+    report['latency_ms']['max'] = 1000 * latencies[-1]
+    if server is not None:
+        report['server'] = dict(Counter(server.stats) - before)
+    if profiler is not None:
+        profiler.close()
+        report['profiles'] = profiler.write(os.path.join(args.profile, name))
+    return report
+
+
+def print_report(name, report):
+    latency = report['latency_ms']
+    print('%-8s %9i %8.1f %9.1f %8.1f %8.1f %8.1f' % (
+        name, report['requests'], report['per_second'], latency['p50'],
+        latency['p90'], latency['p99'], latency['max']))
+    print('  outcomes: %s' % ', '.join(
+        '%s %i' % item for item in Counter(report['outcomes']).most_common()))
+    if 'server' in report:
+        print('  server:   %s' % ', '.join('%s %i' % (key, report['server'].get(
+            key, 0)) for key in ('served', 'missing', 'throttled', 'failed',
+                                 'disconnected')))
+    if 'profiles' in report:
+        print('  profiles: %i files in %s' % (
+            len(report['profiles']),
+            os.path.dirname(report['profiles'][0]) if report['profiles']
+            else '-'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Load test the API against a local stand-in server.')
+    parser.add_argument('-s', '--scenario', action='append', choices=SCENARIOS,
+                        help='scenario to run (default: all available)')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='number of requests per scenario')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='number of concurrent clients')
+    parser.add_argument('--operation', action='append',
+                        help='only send requests of this operation')
+    parser.add_argument('--processor',
+                        default='amazonproduct.processors.objectify')
+    parser.add_argument('--client-rate', type=float,
+                        help='client-side limit of requests per second')
+    parser.add_argument('--client-burst', type=int, default=1)
+    parser.add_argument('--host', help='address of a running stand-in server')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='server latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='maximum additional server latency in seconds')
+    parser.add_argument('--rate', type=float,
+                        help='requests per second before the server throttles')
+    parser.add_argument('--burst', type=int, default=1)
+    parser.add_argument('--failure-rate', type=float, default=0,
+                        help='fraction of requests which fail')
+    parser.add_argument('--failure', action='append', choices=FAILURES,
+                        help='how requests fail (default: all ways)')
+    parser.add_argument('--stall-time', type=float, default=10,
+                        help='delay of stalled responses in seconds')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='write sampled call stacks to this directory')
+    parser.add_argument('--profile-rate', type=float, default=0.1,
+                        help='fraction of calls to profile')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to JSON file')
+    args = parser.parse_args(argv)
+
+    warnings.simplefilter('ignore', DeprecationWarning)
+
+    fixtures = Fixtures()
+    queries = fixtures.queries(args.operation)
+    rnd = random.Random(args.seed)
+    workload = [rnd.choice(queries) for _ in range(args.requests)]
+
+    server = None
+    host = args.host
+    if host is None:
+        server = StandInServer(
+            fixtures, latency=args.latency, jitter=args.jitter,
+            rate=args.rate, burst=args.burst, failure_rate=args.failure_rate,
+            failures=args.failure or FAILURES, stall_time=args.stall_time,
+            seed=args.seed)
+        server.start()
+        host = server.host()
+
+    scenarios = args.scenario or [name for name in SCENARIOS if name != 'async'
+                                  or sys.version_info >= (3, 5)]
+    print('Sending %i requests (%i clients) to %i recorded responses...' % (
+        args.requests, args.clients, len(queries)))
+    print('%-8s %9s %8s %9s %8s %8s %8s' % (
+        'scenario', 'requests', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms',
+        'max ms'))
+    reports = {}
+    for name in scenarios:
+        try:
+            reports[name] = run(name, args, host, workload, server)
+        except ImportError:
+            print('%-8s not available: %s' % (name, sys.exc_info()[1]))
+            continue
+        print_report(name, reports[name])
+
+    if server is not None:
+        server.stop()
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'arguments': vars(args), 'results': reports}, fp,
+                      indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,67 +1,355 @@
-# Copyright (C) 2010 Sebastian Rahlf <basti at redtoad dot de>
+# Copyright (C) 2010-2015 Sebastian Rahlf <basti at redtoad dot de>
 
 """
-Compare performance of different parsing methods. On my netbook the following
-output was generated::
+Benchmarks the result processors using the recorded XML responses in
+``tests/2011-08-01``. For each processor the throughput of
 
-    Collecting test files...
-    Parsing 2020 XML files...
-    minidom 25.83
-    lxml.etree 1.79
-    lxml.objectify 2.43
+* ``parse``: :meth:`API._parse` of all valid responses,
+* ``errors``: :meth:`API._parse` of all error responses (including the mapping
+  to exceptions),
+* ``paginate``: paginator data and items of all search results,
+* ``parse_cart``: :meth:`parse_cart` of all cart responses
 
+is measured, as well as the signing of URLs (:meth:`API._build_url`). Each
+processor is benchmarked in its own process so that the memory high-water mark
+(``max_rss_kb``) can be attributed to it; ``peak_python_kb`` is the peak of
+memory allocated by Python while parsing (see :mod:`tracemalloc`).
+
+Results can be written to a JSON file and compared with earlier results::
+
+    $ python tests/parser-performance.py --output before.json
+    Benchmarking 868 XML files (best of 3 runs)...
+    processor    benchmark         ops       ops/s   max RSS
+    api          sign             2000     31289.1   35.4 MB
+    elementtree  errors            409     10738.5   49.7 MB
+    elementtree  paginate           16     35891.4   49.7 MB
+    elementtree  parse             459      5118.4   49.7 MB
+    elementtree  parse_cart        362     14838.0   49.7 MB
+    ...
+    $ python tests/parser-performance.py --compare before.json
+    ...
+    Compared with baseline (threshold: 10%):
+    api          sign            +1.3%
+    elementtree  errors         -14.2%  REGRESSION
+    ...
+
+The script exits with status 1 if a benchmark got slower than ``--threshold``
+percent (default: 10).
 """
 
+from __future__ import print_function, division
+
+import argparse
+from datetime import datetime
+from io import BytesIO
+import json
 import os.path
-import time
+import platform
+import subprocess
+import sys
+import warnings
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # pragma: no cover
+    from time import time as clock
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
 
-import lxml.etree
-import lxml.objectify
-import xml.dom.minidom
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
 
 # make sure that amazonproduct can be imported
 # from parent directory
-import sys
-sys.path.insert(0, '..')
+_here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(_here))
 
-from amazonproduct import API, AWSError
-from amazonproduct.processors import objectify, etree, minidom
+from amazonproduct.api import API
+from amazonproduct.errors import AWSError
+from amazonproduct.processors import ITEMS_PAGINATOR
+# credentials are passed directly
+warnings.simplefilter('ignore', DeprecationWarning)
 
-if __name__ == '__main__':
+XML_DIR = os.path.join(_here, '2011-08-01')
+
+#: processor used to sort the recorded responses
+REFERENCE_PROCESSOR = 'amazonproduct.processors.elementtree'
+
+PROCESSORS = {
+    'objectify': 'amazonproduct.processors.objectify',
+    'etree': 'amazonproduct.processors.etree',
+    'elementtree': 'amazonproduct.processors.elementtree',
+    'minidom': 'amazonproduct.processors.minidom',
+    'iterparse': 'amazonproduct.processors.iterparse',
+    'records': 'amazonproduct.processors.records',
+}
+
+#: pseudo processor for benchmarks which do not depend on a processor
+API_BENCHMARKS = 'api'
+
+#: number of URLs signed per run
+SIGNED_URLS = 2000
 
-    #: how many times are all XML files parsed
-    RUNS = 10
-
-    custom_parsers = {
-        'lxml.objectify': objectify.Processor(), 
-        'lxml.etree': etree.Processor(module='lxml.etree'), 
-        'xml.etree.cElementTree': etree.Processor(module='xml.etree.cElementTree'),
-        'xml.etree.ElementTree': etree.Processor(module='xml.etree.ElementTree'),
-        'cElementTree': etree.Processor(module='cElementTree'),
-        'elementtree.ElementTree': etree.Processor(module='elementtree.ElementTree'),
-        'minidom': minidom.Processor(), 
-    }
 
-    print "Collecting test files..."
-    xml_files = [os.path.join(root, file)
-        for root, dirs, files in os.walk('.')
-        for file in files
-        if os.path.splitext(file)[1].lower() == '.xml']
-
-    print "Parsing %i XML files..." % (len(xml_files)*RUNS, )
-    for label, parser in custom_parsers.items():
-        print label, 
-        if getattr(parser, 'etree', '') is None:
-            print 'not installed!'
+def load_fixtures():
+    """
+    Returns the recorded responses sorted into ``valid``, ``errors``,
+    ``searches`` and ``carts`` (lists of bytes). Responses which cannot be
+    parsed or mapped to an exception are left out.
+    """
+    api = API('XXX', 'XXX', 'de', processor=REFERENCE_PROCESSOR)
+    fixtures = dict(valid=[], errors=[], searches=[], carts=[])
+    for name in sorted(os.listdir(XML_DIR)):
+        if not name.endswith('.xml'):
             continue
-        start = time.clock()
-        api = API(locale='de', processor=parser)
-        for i in range(RUNS):
-            for path in xml_files:
-                try:
-                    api._parse(open(path))
-                except Exception, e:
+        with open(os.path.join(XML_DIR, name), 'rb') as fp:
+            data = fp.read()
+        try:
+            api._parse(BytesIO(data))
+        except AWSError:
+            fixtures['errors'].append(data)
+            continue
+        except Exception:
+            continue
+        fixtures['valid'].append(data)
+        if name.startswith('ItemSearch'):
+            fixtures['searches'].append(data)
+        if name.startswith('Cart'):
+            fixtures['carts'].append(data)
+    return fixtures
+
+
+def _consume(processor, root):
+    # streaming processors only parse everything when iterated over
+    if getattr(processor, 'streaming', False):
+        for _ in root:
+            pass
+    return root
+
+
+def benchmarks(api, fixtures):
+    """
+    Returns ``{name: (ops, setup, run)}`` for processor ``api.processor``.
+    ``run(setup())`` is timed.
+    """
+    processor = api.processor
+
+    def parse_all(responses):
+        def run(_):
+            for data in responses:
+                _consume(processor, api._parse(BytesIO(data)))
+        return len(responses), lambda: None, run
+
+    def parse_errors(_):
+        for data in fixtures['errors']:
+            try:
+                api._parse(BytesIO(data))
+            except AWSError:
+                pass
+
+    result = {
+        'parse': parse_all(fixtures['valid']),
+        'errors': (len(fixtures['errors']), lambda: None, parse_errors),
+    }
+
+    paginator = processor.paginators.get(ITEMS_PAGINATOR)
+    if paginator is not None:
+        paginator = paginator.__new__(paginator)  # do not fetch anything
+        def setup_pages():
+            return [api._parse(BytesIO(data))
+                    for data in fixtures['searches']]
+        def paginate(roots):
+            for root in roots:
+                list(paginator.paginator_data(root))
+                for _ in paginator.iterate(root):
                     pass
+        result['paginate'] = (
+            len(fixtures['searches']), setup_pages, paginate)
+
+    def setup_carts():
+        return [api._parse(BytesIO(data)) for data in fixtures['carts']]
+    def parse_carts(roots):
+        for root in roots:
+            processor.parse_cart(root)
+    try:
+        parse_carts(setup_carts())
+    except NotImplementedError:
+        pass
+    else:
+        result['parse_cart'] = (len(fixtures['carts']), setup_carts,
+                                parse_carts)
+    return result
+
 
-        stop = time.clock()
-        print stop - start
+def api_benchmarks(api):
+    def sign(_):
+        for i in range(SIGNED_URLS):
+            api._build_url(Operation='ItemLookup', ItemId='%010i' % i,
+                           ResponseGroup='Large')
+    return {'sign': (SIGNED_URLS, lambda: None, sign)}
+
+
+def measure(ops, setup, run, repeat):
+    """
+    Returns the best of ``repeat`` runs.
+    """
+    best = None
+    for _ in range(repeat):
+        state = setup()
+        start = clock()
+        run(state)
+        elapsed = clock() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return {'ops': ops, 'seconds': best,
+            'per_second': ops / best if best else None}
+
+
+def max_rss_kb():
+    if resource is None:  # pragma: no cover
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024  # bytes on OS X
+    return rss
+
+
+def worker(name, repeat):
+    """
+    Runs all benchmarks of processor ``name`` and returns the results.
+    """
+    try:
+        if name == API_BENCHMARKS:
+            api = API('XXX', 'XXX', 'de')
+            tests = api_benchmarks(api)
+        else:
+            api = API('XXX', 'XXX', 'de', processor=PROCESSORS[name])
+            tests = benchmarks(api, load_fixtures())
+    except ImportError:
+        return {'error': str(sys.exc_info()[1])}
+
+    results = dict((test, measure(ops, setup, run, repeat))
+                   for test, (ops, setup, run) in tests.items())
+    results['max_rss_kb'] = max_rss_kb()
+
+    if tracemalloc is not None and 'parse' in tests:
+        _, setup, run = tests['parse']
+        tracemalloc.start()
+        run(setup())
+        results['peak_python_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    return results
+
+
+def run_all(names, repeat):
+    results = {}
+    for name in names:
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__),
+            '--worker', name, '--repeat', str(repeat)])
+        results[name] = json.loads(output.decode('utf-8'))
+    return results
+
+
+def environment():
+    info = {
+        'date': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+    }
+    try:
+        from lxml import etree
+        info['lxml'] = '.'.join(map(str, etree.LXML_VERSION))
+    except ImportError:  # pragma: no cover
+        info['lxml'] = None
+    return info
+
+
+def print_results(results):
+    print('%-12s %-12s %8s %11s %9s' % (
+        'processor', 'benchmark', 'ops', 'ops/s', 'max RSS'))
+    for name in sorted(results):
+        tests = results[name]
+        if 'error' in tests:
+            print('%-12s not available: %s' % (name, tests['error']))
+            continue
+        rss = tests.get('max_rss_kb')
+        for test in sorted(tests):
+            if not isinstance(tests[test], dict):
+                continue
+            print('%-12s %-12s %8i %11.1f %9s' % (
+                name, test, tests[test]['ops'], tests[test]['per_second'],
+                '%.1f MB' % (rss / 1024) if rss else '-'))
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change in throughput of every benchmark in both ``results``
+    and ``baseline``. Returns the number of regressions.
+    """
+    regressions = 0
+    print('\nCompared with baseline (threshold: %.0f%%):' % threshold)
+    for name in sorted(results):
+        for test in sorted(results[name]):
+            new = results[name][test]
+            old = baseline.get(name, {}).get(test)
+            if not isinstance(new, dict) or not isinstance(old, dict):
+                continue
+            if not new.get('per_second') or not old.get('per_second'):
+                continue
+            change = 100.0 * (new['per_second'] / old['per_second'] - 1)
+            flag = ''
+            if change < -threshold:
+                flag = 'REGRESSION'
+                regressions += 1
+            print('%-12s %-12s %+7.1f%%  %s' % (name, test, change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-p', '--processor', action='append',
+                        choices=sorted(PROCESSORS) + [API_BENCHMARKS],
+                        help='processor to benchmark (default: all)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs of which the best is taken')
+    parser.add_argument('--output', help='write results to JSON file')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='compare results with earlier ones')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='slow-down in percent regarded as regression')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, args.repeat)))
+        return 0
+
+    names = args.processor or sorted(PROCESSORS) + [API_BENCHMARKS]
+    fixtures = load_fixtures()
+    print('Benchmarking %i XML files (best of %i runs)...' % (
+        sum(len(fixtures[key]) for key in ('valid', 'errors')), args.repeat))
+    results = run_all(names, args.repeat)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'environment': environment(), 'results': results},
+                      fp, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,366 @@
+# Copyright (C) 2015 Sebastian Rahlf <basti at redtoad dot de>
+
+"""
+Local stand-in for Amazon's Product Advertising API which answers requests
+with the recorded XML responses in ``tests/2011-08-01``. Responses are looked
+up by locale and canonical request key (all request parameters except
+credentials, ``Timestamp`` and ``Signature``), so the same calls as in the
+tests can be sent without spending any quota::
+
+    server = StandInServer(Fixtures(), latency=0.05, rate=1)
+    server.start()
+    api = API(locale='de')
+    api.host = server.host('de')
+    api.item_lookup('9783836214063')
+
+Since there is only one server for all locales, the locale is passed as first
+path segment (``http://127.0.0.1:<port>/de/onca/xml``).
+
+The server can be made to behave less than perfect:
+
+``latency`` and ``jitter``
+    Each response is delayed by ``latency`` plus up to ``jitter`` seconds.
+
+``rate`` and ``burst``
+    Requests exceeding ``rate`` per second (bursts of up to ``burst``) are
+    answered with ``RequestThrottled`` errors (HTTP 503) just like Amazon does.
+
+``failure_rate`` and ``failures``
+    This fraction of requests fails in one of the ways in ``failures``
+    (chosen at random): ``'internal-error'`` (HTTP 500 with an
+    ``InternalError`` response), ``'disconnect'`` (the connection is closed
+    without a response) or ``'stall'`` (the response is delayed by
+    ``stall_time`` seconds, e.g. to provoke timeouts).
+
+Requests without recorded response are answered with an
+``AWS.StandIn.NoRecordedResponse`` error (HTTP 404).
+
+The server can also be run on its own::
+
+    $ python tests/standin.py --port 8080 --latency 0.1 --rate 1
+    Serving 571 recorded responses at http://127.0.0.1:8080/<locale>/onca/xml
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import defaultdict
+import os.path
+import random
+import socket
+import sys
+import threading
+import time
+
+# support Python 2 and Python 3 without conversion
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+
+# make sure that amazonproduct can be imported
+# from parent directory
+_here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(_here))
+
+from amazonproduct.api import HOSTS
+from amazonproduct.signing import encode_query
+from tests.utils import arguments_from_cached_xml, IGNORABLE_ARGUMENTS
+
+#: directory with recorded responses
+XML_DIR = os.path.join(_here, '2011-08-01')
+
+THROTTLED = b'''<?xml version="1.0"?>
+<ErrorResponse>
+  <Error>
+    <Code>RequestThrottled</Code>
+    <Message>Request from 127.0.0.1 is throttled.</Message>
+  </Error>
+  <RequestID>00000000-0000-0000-0000-000000000000</RequestID>
+</ErrorResponse>
+'''
+
+INTERNAL_ERROR = b'''<?xml version="1.0"?>
+<ErrorResponse>
+  <Error>
+    <Code>InternalError</Code>
+    <Message>We encountered an internal error. Please try again.</Message>
+  </Error>
+  <RequestID>00000000-0000-0000-0000-000000000000</RequestID>
+</ErrorResponse>
+'''
+
+NO_RECORDED_RESPONSE = b'''<?xml version="1.0"?>
+<ErrorResponse>
+  <Error>
+    <Code>AWS.StandIn.NoRecordedResponse</Code>
+    <Message>There is no recorded response for this request.</Message>
+  </Error>
+  <RequestID>00000000-0000-0000-0000-000000000000</RequestID>
+</ErrorResponse>
+'''
+
+#: ways in which requests can fail
+FAILURES = ('internal-error', 'disconnect', 'stall')
+
+
+def request_key(query):
+    """
+    Returns the canonical key for the request parameters ``query``: the
+    sorted and URL-encoded query string without credentials, ``Timestamp``
+    and ``Signature``.
+    """
+    return encode_query(dict((key, val) for key, val in query.items()
+                             if key not in IGNORABLE_ARGUMENTS))
+
+
+class Fixtures (object):
+
+    """
+    Recorded responses indexed by locale and request key.
+    """
+
+    def __init__(self, path=XML_DIR):
+        """
+        :param path: directory with recorded responses. File names have to
+          start with ``<operation>-<locale>-``.
+        """
+        self.responses = {}
+        for name in sorted(os.listdir(path)):
+            parts = name.split('-')
+            if not name.endswith('.xml') or parts[1] not in HOSTS:
+                continue
+            with open(os.path.join(path, name), 'rb') as fp:
+                self.add(parts[1], fp.read())
+
+    def __len__(self):
+        return len(self.responses)
+
+    def add(self, locale, data):
+        """
+        Adds the recorded response ``data`` under the arguments it contains.
+        Responses without arguments are ignored.
+        """
+        try:
+            query = arguments_from_cached_xml(data)
+        except AttributeError:
+            return  # no OperationRequest
+        self.responses.setdefault((locale, request_key(query)), (query, data))
+
+    def lookup(self, locale, query):
+        """
+        Returns the response recorded for ``query`` or ``None``.
+        """
+        try:
+            return self.responses[locale, request_key(query)][1]
+        except KeyError:
+            return None
+
+    def queries(self, operations=None):
+        """
+        Returns a list of ``(locale, query)`` tuples for all recorded
+        responses (optionally only for the given ``operations``).
+        """
+        return [(locale, query)
+                for (locale, _), (query, _) in sorted(self.responses.items())
+                if operations is None or query.get('Operation') in operations]
+
+
+class StandInHandler (BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body are written separately, don't let Nagle's algorithm
+    # delay the latter on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        locale = url.path.strip('/').split('/')[0]
+        query = dict(parse_qsl(url.query))
+
+        failure = server.failure()
+        if failure == 'disconnect':
+            server.count('disconnected')
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+
+        server.delay(failure == 'stall')
+        if failure == 'internal-error':
+            server.count('failed')
+            return self.respond(500, INTERNAL_ERROR)
+        if not server.admit():
+            server.count('throttled')
+            return self.respond(503, THROTTLED)
+
+        content = server.fixtures.lookup(locale, query)
+        if content is None:
+            server.count('missing')
+            return self.respond(404, NO_RECORDED_RESPONSE)
+        server.count('served')
+        self.respond(200, content)
+
+    def respond(self, status, content):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer (ThreadingMixIn, HTTPServer):
+
+    """
+    HTTP server answering requests with recorded responses. Statistics are
+    kept in :attr:`stats` (``served``, ``missing``, ``throttled``, ``failed``
+    and ``disconnected``).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fixtures, address=('127.0.0.1', 0), latency=0,
+                 jitter=0, rate=None, burst=1, failure_rate=0,
+                 failures=FAILURES, stall_time=60, seed=None):
+        """
+        :param fixtures: :class:`Fixtures` to serve.
+        :param address: ``(host, port)`` to listen on (default: a free port
+          on localhost).
+        :param latency: minimum delay of each response in seconds.
+        :param jitter: maximum additional (random) delay in seconds.
+        :param rate: number of requests per second after which requests are
+          throttled (default: no limit).
+        :param burst: number of requests which may exceed ``rate`` at once.
+        :param failure_rate: fraction of requests which fail.
+        :param failures: ways in which they fail (see :data:`FAILURES`).
+        :param stall_time: delay of ``'stall'`` failures in seconds.
+        :param seed: seed for the random number generator.
+        """
+        for failure in failures:
+            if failure not in FAILURES:
+                raise ValueError('Unknown failure %r!' % failure)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.burst = burst
+        self.failure_rate = failure_rate
+        self.failures = failures
+        self.stall_time = stall_time
+        self.stats = defaultdict(int)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._last = time.time()
+        self._thread = None
+        HTTPServer.__init__(self, address, StandInHandler)
+
+    def host(self, locale=None):
+        """
+        Returns the value to set as :attr:`API.host` for ``locale``.
+        """
+        host = '%s:%s' % self.server_address
+        if locale is not None:
+            host += '/' + locale
+        return host
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def failure(self):
+        """
+        Returns how the current request is to fail (or ``None``).
+        """
+        with self._lock:
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                return self._random.choice(self.failures)
+        return None
+
+    def delay(self, stall=False):
+        with self._lock:
+            delay = self.latency + self._random.random() * self.jitter
+        if stall:
+            delay += self.stall_time
+        if delay > 0:
+            time.sleep(delay)
+
+    def admit(self):
+        """
+        Returns ``True`` if a request can be answered without exceeding
+        :attr:`rate`.
+        """
+        if self.rate is None:
+            return True
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def handle_error(self, request, client_address):
+        # clients which gave up on a stalled response are no error
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def start(self):
+        """
+        Serves requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve recorded Product Advertising API responses.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='delay of each response in seconds')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='maximum random additional delay in seconds')
+    parser.add_argument('--rate', type=float,
+                        help='requests per second before throttling')
+    parser.add_argument('--burst', type=int, default=1)
+    parser.add_argument('--failure-rate', type=float, default=0,
+                        help='fraction of requests which fail')
+    parser.add_argument('--failure', action='append', choices=FAILURES,
+                        help='how requests fail (default: all ways)')
+    args = parser.parse_args(argv)
+
+    fixtures = Fixtures()
+    server = StandInServer(
+        fixtures, ('127.0.0.1', args.port), latency=args.latency,
+        jitter=args.jitter, rate=args.rate, burst=args.burst,
+        failure_rate=args.failure_rate, failures=args.failure or FAILURES)
+    print('Serving %i recorded responses at http://%s/<locale>/onca/xml' % (
+        len(fixtures), server.host()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(dict(server.stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+from io import BytesIO
+
+import pytest
+
+# Python 2/3 compatible imports
+try:
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from urlparse import urlparse, parse_qs
+
+from tests import TESTABLE_PROCESSORS
+
+from amazonproduct.api import API
+from amazonproduct.errors import InvalidParameterValue, InvalidResponseGroup
+from amazonproduct.errors import ExceededMaxBatchRequestsPerOperation
+
+NAMESPACE = 'http://webservices.amazon.com/AWSECommerceService/2011-08-01'
+
+
+class FakeLookupServer (object):
+
+    """
+    Stand-in for :meth:`API._fetch` answering (batch) ItemLookup requests.
+    Every ID starting with ``X`` is invalid, IDs of type EAN match two items.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def _items(self, ids, id_type):
+        items = []
+        errors = []
+        for item_id in ids:
+            if item_id.startswith('X'):
+                errors.append(
+                    '<Error><Code>AWS.InvalidParameterValue</Code><Message>%s '
+                    'is not a valid value for ItemId. Please change this '
+                    'value and retry your request.</Message></Error>'
+                    % item_id)
+            elif id_type == 'EAN':
+                items += ['<Item><ASIN>%s-%i</ASIN></Item>' % (item_id, i)
+                          for i in (1, 2)]
+            else:
+                items.append('<Item><ASIN>%s</ASIN></Item>' % item_id.upper())
+        request = '<Request><IsValid>True</IsValid>%s</Request>' % (
+            errors and '<Errors>%s</Errors>' % ''.join(errors) or '')
+        return '<Items>%s%s</Items>' % (request, ''.join(items))
+
+    def __call__(self, url):
+        qargs = dict((key, val[0]) for key, val in
+                     parse_qs(urlparse(url).query).items())
+        self.requests.append(qargs)
+        if qargs.get('ResponseGroup') == '???':
+            return BytesIO((
+                '<ItemLookupResponse xmlns="%s"><Items><Request><Errors>'
+                '<Error><Code>AWS.InvalidEnumeratedParameter</Code><Message>'
+                'The value you specified for ResponseGroup is invalid.'
+                '</Message></Error></Errors></Request></Items>'
+                '</ItemLookupResponse>' % NAMESPACE).encode('utf-8'))
+        if 'ItemId' in qargs:
+            groups = [self._items(qargs['ItemId'].split(','),
+                                  qargs.get('IdType'))]
+        else:
+            id_type = qargs.get('ItemLookup.Shared.IdType')
+            groups = []
+            for no in (1, 2):
+                ids = qargs.get('ItemLookup.%i.ItemId' % no)
+                if ids is not None:
+                    groups.append(self._items(ids.split(','), id_type))
+        return BytesIO(('<ItemLookupResponse xmlns="%s">%s</ItemLookupResponse>'
+                        % (NAMESPACE, ''.join(groups))).encode('utf-8'))
+
+
+def pytest_generate_tests(metafunc):
+    """
+    Tests are run once for each processor.
+    """
+    for name in ('api', 'processor'):
+        if name in metafunc.funcargnames:
+            metafunc.parametrize(name, list(TESTABLE_PROCESSORS.values()),
+                                 indirect=name == 'api',
+                                 ids=list(TESTABLE_PROCESSORS.keys()))
+
+
+def pytest_funcarg__fake(request):
+    return FakeLookupServer()
+
+
+def pytest_funcarg__api(request):
+    fake = request.getfuncargvalue('fake')
+    api = API('XXX', 'XXX', 'de', processor=request.param)
+    api._fetch = fake
+    return api
+
+
+def asin(item):
+    # works for all processors
+    return item.find('{%s}ASIN' % NAMESPACE).text
+
+
+def test_ids_are_packed_into_batch_requests(api, fake):
+    ids = ['B%09i' % i for i in range(45)]
+    results = list(api.bulk_item_lookup(iter(ids), ResponseGroup='Small'))
+
+    assert [item_id for item_id, _, _ in results] == ids
+    assert [asin(item) for _, item, _ in results] == ids
+    assert all(error is None for _, _, error in results)
+
+    # 20 + 20 + 5 IDs
+    assert len(fake.requests) == 3
+    first = fake.requests[0]
+    assert first['ItemLookup.1.ItemId'] == ','.join(ids[:10])
+    assert first['ItemLookup.2.ItemId'] == ','.join(ids[10:20])
+    assert first['ItemLookup.Shared.ResponseGroup'] == 'Small'
+    assert fake.requests[2]['ItemId'] == ','.join(ids[40:])
+    assert fake.requests[2]['ResponseGroup'] == 'Small'
+
+
+def test_results_are_streamed(api, fake):
+    ids = ['B%09i' % i for i in range(100)]
+    results = api.bulk_item_lookup(ids)
+    next(results)
+    assert len(fake.requests) == 1
+
+
+def test_invalid_ids_are_reported_individually(api, fake):
+    ids = ['B000000001', 'X000000001', 'b000000002', 'X000000002']
+    results = list(api.bulk_item_lookup(ids))
+    assert [item_id for item_id, _, _ in results] == ids
+
+    assert results[0][2] is None
+    assert results[2][2] is None
+    assert asin(results[2][1]) == 'B000000002'
+
+    for _, item, error in (results[1], results[3]):
+        assert item is None
+        assert isinstance(error, InvalidParameterValue)
+    assert results[1][2].args == ('ItemId', 'X000000001')
+    assert results[3][2].args == ('ItemId', 'X000000002')
+
+
+def test_other_id_types_are_looked_up_one_by_one(api, fake):
+    ids = ['4000000000001', 'X000000000000', '4000000000002']
+    results = list(api.bulk_item_lookup(ids, IdType='EAN', SearchIndex='All'))
+    assert len(fake.requests) == 2
+    assert [(item_id, item is not None) for item_id, item, _ in results] == [
+        ('4000000000001', True), ('4000000000001', True),
+        ('X000000000000', False),
+        ('4000000000002', True), ('4000000000002', True),
+    ]
+    assert fake.requests[0]['ItemLookup.Shared.IdType'] == 'EAN'
+
+
+def test_request_errors_are_raised(api, fake):
+    pytest.raises(InvalidResponseGroup, list,
+                  api.bulk_item_lookup(['B000000001'], ResponseGroup='???'))
+
+
+def test_parse_items_groups_by_request(processor):
+    api = API('XXX', 'XXX', 'de', processor=processor)
+    root = api._parse(FakeLookupServer()(
+        'http://localhost/?ItemLookup.1.ItemId=A,B&ItemLookup.2.ItemId=C'))
+    groups = api.processor.parse_items(root)
+    assert [[asin for asin, _ in group] for group in groups] == [
+        ['A', 'B'], ['C']]
+
+
+MULTI_OPERATION_RESPONSE = """<MultiOperationResponse xmlns="%s">
+  <OperationRequest><RequestId>XXX</RequestId></OperationRequest>
+  <ItemLookupResponse>
+    <Items><Request><IsValid>True</IsValid></Request>
+      <Item><ASIN>0201896834</ASIN></Item></Items>
+    <Items><Request><IsValid>True</IsValid></Request>
+      <Item><ASIN>0201896842</ASIN></Item></Items>
+  </ItemLookupResponse>
+  <BrowseNodeLookupResponse>
+    <BrowseNodes><Request><IsValid>True</IsValid></Request>
+      <BrowseNode><BrowseNodeId>3839</BrowseNodeId></BrowseNode></BrowseNodes>
+  </BrowseNodeLookupResponse>
+</MultiOperationResponse>""" % NAMESPACE
+
+
+def test_batch_request_encodes_operations():
+    batch = API('XXX', 'XXX', 'de').batch(ResponseGroup=['Small', 'Images'])
+    batch.item_lookup('0201896834', '0201896850')
+    batch.browse_node_lookup(3839)
+    batch.item_lookup('0201896842', Condition='New')
+    assert batch.build() == {
+        'Operation': 'ItemLookup,BrowseNodeLookup',
+        'ItemLookup.Shared.ResponseGroup': 'Small,Images',
+        'ItemLookup.1.ItemId': '0201896834,0201896850',
+        'ItemLookup.2.ItemId': '0201896842',
+        'ItemLookup.2.Condition': 'New',
+        'BrowseNodeLookup.Shared.ResponseGroup': 'Small,Images',
+        'BrowseNodeLookup.1.BrowseNodeId': 3839,
+        'BrowseNodeLookup.1.ResponseGroup': None,
+    }
+
+
+def test_shared_parameters_per_operation():
+    batch = API('XXX', 'XXX', 'de').batch(
+        ItemLookup={'ResponseGroup': 'Small'}, MerchantId='Amazon')
+    batch.item_lookup('0201896834').item_lookup('0201896842')
+    batch.browse_node_lookup(3839, 'TopSellers')
+    assert batch.build() == {
+        'Operation': 'ItemLookup,BrowseNodeLookup',
+        'ItemLookup.Shared.ResponseGroup': 'Small',
+        'ItemLookup.Shared.MerchantId': 'Amazon',
+        'ItemLookup.1.ItemId': '0201896834',
+        'ItemLookup.2.ItemId': '0201896842',
+        'BrowseNodeLookup.Shared.MerchantId': 'Amazon',
+        'BrowseNodeLookup.1.BrowseNodeId': 3839,
+        'BrowseNodeLookup.1.ResponseGroup': 'TopSellers',
+    }
+    batch = API('XXX', 'XXX', 'de').batch(ItemLookup={'ResponseGroup': 'Small'})
+    batch.browse_node_lookup(3839)
+    assert batch.build() == {
+        'Operation': 'BrowseNodeLookup',
+        'BrowseNodeId': 3839,
+        'ResponseGroup': None,
+    }
+
+
+def test_single_request_is_sent_in_normal_format():
+    batch = API('XXX', 'XXX', 'de').batch(ResponseGroup='Small')
+    batch.item_search('Books', Keywords='Python')
+    assert batch.build() == {
+        'Operation': 'ItemSearch',
+        'SearchIndex': 'Books',
+        'Keywords': 'Python',
+        'ResponseGroup': 'Small',
+    }
+
+
+def test_batch_request_is_limited_per_operation():
+    batch = API('XXX', 'XXX', 'de').batch()
+    batch.item_lookup('1').item_lookup('2')
+    pytest.raises(ExceededMaxBatchRequestsPerOperation, batch.item_lookup, '3')
+    pytest.raises(ValueError, API('XXX', 'XXX', 'de').batch().build)
+
+
+def test_exceeded_batch_requests_error_is_mapped():
+    api = API('XXX', 'XXX', 'de')
+    api._fetch = lambda url: BytesIO((
+        '<ItemLookupResponse xmlns="%s"><Items><Request><Errors><Error><Code>'
+        'AWS.ExceededMaxBatchRequestsPerOperation</Code><Message>...</Message>'
+        '</Error></Errors></Request></Items></ItemLookupResponse>'
+        % NAMESPACE).encode('utf-8'))
+    pytest.raises(ExceededMaxBatchRequestsPerOperation, api.call,
+                  Operation='ItemLookup')
+
+
+def test_multi_operation_response_is_split(processor):
+    api = API('XXX', 'XXX', 'de', processor=processor)
+    api._fetch = lambda url: BytesIO(MULTI_OPERATION_RESPONSE.encode('utf-8'))
+    batch = api.multi_operation()
+    batch.item_lookup('0201896834')
+    batch.browse_node_lookup(3839)
+    batch.item_lookup('0201896842')
+    batch.similarity_lookup('0201896834')
+    vol1, node, vol2, similar = batch.execute()
+
+    tag = lambda name: '{%s}%s' % (NAMESPACE, name)
+    assert vol1.tag == vol2.tag == tag('Items')
+    assert vol1.find('%s/%s' % (tag('Item'), tag('ASIN'))).text == '0201896834'
+    assert vol2.find('%s/%s' % (tag('Item'), tag('ASIN'))).text == '0201896842'
+    assert node.tag == tag('BrowseNodes')
+    assert similar is None
@@ -0,0 +1,146 @@
+from collections import defaultdict
+import threading
+
+import pytest
+
+from tests.standin import Fixtures, StandInServer
+
+from amazonproduct.api import API
+from amazonproduct.bulk import BulkExecutor
+from amazonproduct.errors import AWSError, UnknownLocale
+from amazonproduct.metrics import BaseObserver
+
+
+class StandInAPI (API):
+
+    """
+    API sending all requests to the stand-in server at ``standin``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        standin = kwargs.pop('standin')
+        kwargs.update(access_key_id='XXX', secret_access_key='XXX')
+        super(StandInAPI, self).__init__(*args, **kwargs)
+        self.host = '%s/%s' % (standin, self.locale)
+
+
+class Concurrency (BaseObserver):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = defaultdict(int)
+        self.max = defaultdict(int)
+        self.max_locales = 0  # locales with calls running at the same time
+
+    def call_started(self, call):
+        with self.lock:
+            self.running[call.locale] += 1
+            self.max[call.locale] = max(
+                self.max[call.locale], self.running[call.locale])
+            self.max_locales = max(self.max_locales, len(
+                [n for n in self.running.values() if n > 0]))
+
+    def call_finished(self, call):
+        with self.lock:
+            self.running[call.locale] -= 1
+
+
+def pytest_funcarg__fixtures(request):
+    return request.cached_setup(Fixtures, scope='module')
+
+
+def pytest_funcarg__standin(request):
+    fixtures = request.getfuncargvalue('fixtures')
+    server = StandInServer(fixtures, latency=0.02, seed=1)
+    server.start()
+    request.addfinalizer(server.stop)
+    return server
+
+
+def pytest_funcarg__jobs(request):
+    fixtures = request.getfuncargvalue('fixtures')
+    jobs = []
+    for locale, query in fixtures.queries(['ItemLookup']):
+        params = dict(query)
+        jobs.append((locale, params.pop('Operation'), params))
+    return jobs
+
+
+def make_executor(standin, **kwargs):
+    return BulkExecutor(api_class=StandInAPI, standin=standin.host(),
+                        rate=10000, **kwargs)
+
+
+def test_jobs_run_concurrently_per_locale(standin, jobs):
+    observer = Concurrency()
+    with make_executor(standin, observers=[observer]) as executor:
+        results = list(executor.run(jobs))
+    assert sorted(repr(job) for job, _, _ in results) == \
+        sorted(repr(job) for job in jobs)
+    assert standin.stats['served'] == len(jobs)
+    assert set(observer.max) == set(locale for locale, _, _ in jobs)
+    assert max(observer.max.values()) == 2
+    assert all(error is None or isinstance(error, AWSError)
+               for _, _, error in results)
+
+
+def test_locales_grouped_in_jobs_run_in_parallel(standin, jobs):
+    observer = Concurrency()
+    jobs = sorted(jobs, key=lambda job: job[0])
+    with make_executor(standin, backlog=2, observers=[observer]) as executor:
+        results = list(executor.run(jobs))
+    assert len(results) == len(jobs)
+    assert observer.max_locales > 2
+
+
+def test_every_locale_has_own_api(standin):
+    with make_executor(standin) as executor:
+        de, uk = executor.api('de'), executor.api('uk')
+        assert de is executor.api('de')
+        assert de.throttle is not uk.throttle
+        assert de.transport is not uk.transport
+        assert de.throttle.rate == 10000
+
+
+def test_errors_are_yielded_per_job(standin):
+    jobs = [('xx', 'ItemLookup', {'ItemId': '0747532745'}),
+            ('de', 'ItemLookup', {'ItemId': 'NOT-RECORDED'})]
+    with make_executor(standin) as executor:
+        results = dict((job[0], (result, error))
+                       for job, result, error in executor.run(jobs))
+    assert results['xx'][0] is None
+    assert isinstance(results['xx'][1], UnknownLocale)
+    assert results['de'][1].code == 'AWS.StandIn.NoRecordedResponse'
+
+
+def test_jobs_are_read_as_needed(standin, jobs):
+    read = []
+    def generate():
+        for job in jobs:
+            read.append(job)
+            yield job
+    with make_executor(standin, backlog=2, workers_per_locale=1) as executor:
+        results = executor.run(generate())
+        next(results)
+        assert len(read) < len(jobs)
+        results.close()
+    assert standin.stats['served'] < len(jobs)
+
+
+def test_cancel_stops_run(standin, jobs):
+    with make_executor(standin, workers_per_locale=1) as executor:
+        results = []
+        for result in executor.run(jobs * 10):
+            results.append(result)
+            executor.cancel()
+    assert len(results) < len(jobs)
+
+
+def test_process_pool(standin, jobs):
+    pytest.importorskip('fcntl')  # needed by FileBackend
+    jobs = [job for job in jobs if job[0] in ('de', 'uk')][:6]
+    with make_executor(standin, processes=True, max_workers=2) as executor:
+        results = list(executor.run(jobs))
+    assert sorted(repr(job) for job, _, _ in results) == \
+        sorted(repr(job) for job in jobs)
+    assert standin.stats['served'] == len(jobs)
@@ -0,0 +1,116 @@
+import os.path
+import threading
+import types
+
+import pytest
+
+pytest.importorskip('aiohttp')
+asyncio = pytest.importorskip('asyncio')
+
+from tests import XML_TEST_DIR
+
+from amazonproduct.contrib.aio import AsyncAPI
+from amazonproduct.errors import InvalidSearchIndex, InvalidResponseGroup
+from amazonproduct.errors import ServerError, TooManyRequests
+from amazonproduct.metrics import MetricsCollector
+from amazonproduct.retry import RetryPolicy
+
+
+def load_xml(name):
+    return open(os.path.join(XML_TEST_DIR, '2011-08-01', name)).read()
+
+
+def pytest_funcarg__loop(request):
+    return request.cached_setup(
+        asyncio.new_event_loop, lambda loop: loop.close(), 'function')
+
+
+def pytest_funcarg__api(request):
+    server = request.getfuncargvalue('server')
+    loop = request.getfuncargvalue('loop')
+    api = AsyncAPI('XXX', 'XXX', 'de')
+    api.host = '%s:%s' % server.server_address
+    api.REQUESTS_PER_SECOND = 10000
+    request.addfinalizer(lambda: loop.run_until_complete(api.close()))
+    return api
+
+
+def test_item_lookup(api, server, loop):
+    server.serve_content(load_xml('ItemLookup-de-valid-asin.xml'))
+    root = loop.run_until_complete(api.item_lookup('0747532745'))
+    assert root.Items.Item.ASIN == '0747532745'
+
+
+def test_errors_are_mapped(api, server, loop):
+    server.serve_content(load_xml('ItemSearch-de-invalid-search-index.xml'))
+    e = pytest.raises(InvalidSearchIndex, loop.run_until_complete,
+                      api.item_search('???', BrowseNode=132)).value
+    assert e.args == ('???', )
+
+    server.serve_content(load_xml('ItemLookup-de-invalid-response-group.xml'))
+    pytest.raises(InvalidResponseGroup, loop.run_until_complete,
+                  api.item_lookup('9780747532743', IdType='ISBN',
+                                  SearchIndex='All', ResponseGroup='???'))
+
+
+def test_no_transport_is_created(api):
+    assert api.transport is None
+
+
+def test_server_errors_are_retried(api, server, loop):
+    server.serve_content('<html>Service Unavailable</html>', 503,
+                         {'Retry-After': '0'})
+    api.retry = RetryPolicy(tries=3, base_delay=0.001)
+    metrics = MetricsCollector()
+    api.observers.append(metrics)
+    sent = len(server.requests)
+    e = pytest.raises(ServerError, loop.run_until_complete,
+                      api.item_lookup('0747532745')).value
+    assert e.status == 503 and e.retry_after == 0
+    assert len(server.requests) - sent == 3
+    assert metrics.summary()['retries'] == 2
+
+
+def test_error_messages_of_server_errors_are_parsed(api, server, loop):
+    server.serve_content(open(os.path.join(
+        XML_TEST_DIR, 'APICalls-fails-for-too-many-requests.xml')).read(), 503)
+    pytest.raises(TooManyRequests, loop.run_until_complete,
+                  api.item_lookup('0747532745'))
+
+
+def test_cart_operations(api, server, loop):
+    server.serve_content(load_xml('CartCreate-de-create-cart.xml'))
+    root = loop.run_until_complete(
+        api.cart_create({'0201896834': 1, '0201896842': 1}))
+    cart = api.processor.parse_cart(root)
+    assert len(cart.items) == 2
+
+
+def test_operations_run_concurrently(api, server, loop):
+    server.serve_content(load_xml('ItemLookup-de-valid-asin.xml'))
+    in_flight = [0, 0]  # current, max
+    fetch = api._fetch
+    @types.coroutine
+    def counting_fetch(url):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        try:
+            return (yield from fetch(url))
+        finally:
+            in_flight[0] -= 1
+    api._fetch = counting_fetch
+
+    parsed_in = set()
+    original = api.processor.parse
+    def parse(fp):
+        parsed_in.add(threading.current_thread().name)
+        return original(fp)
+    api.processor.parse = parse
+
+    tasks = [loop.create_task(api.item_lookup('0747532745'))
+             for _ in range(10)]
+    roots = loop.run_until_complete(asyncio.gather(*tasks))
+    assert len(roots) == 10
+    assert in_flight[1] > 1
+    # XML was not parsed by the thread running the event loop
+    assert threading.current_thread().name not in parsed_in
@@ -0,0 +1,482 @@
+from io import BytesIO
+import mmap
+import os.path
+import sys
+import threading
+import time
+
+import pytest
+
+from tests import XML_TEST_DIR, TESTABLE_PROCESSORS
+
+from amazonproduct.api import API
+from amazonproduct.errors import InvalidParameterValue
+from amazonproduct.contrib.caching import CachingMixin, ResponseCachingAPI
+from amazonproduct.contrib.caching import MemoryCache, FileCache, SQLiteCache
+from amazonproduct.contrib.caching import SharedCache, LocalClient, TieredCache
+from amazonproduct.contrib.caching import CompressedCache, ZlibCodec, ZstdCodec
+from amazonproduct.contrib.caching import _CachedResponse, _DecompressingReader
+
+
+class FakeClock (object):
+
+    def __init__(self):
+        self.now = 1000000000.0
+
+    def __call__(self):
+        return self.now
+
+
+def load_xml(name):
+    with open(os.path.join(XML_TEST_DIR, '2011-08-01', name), 'rb') as fp:
+        return fp.read()
+
+
+def pytest_generate_tests(metafunc):
+    if 'cache' in metafunc.funcargnames:
+        metafunc.parametrize('cache', ['memory', 'file', 'sqlite', 'shared',
+                                       'tiered'], indirect=True)
+    if 'codec' in metafunc.funcargnames:
+        metafunc.parametrize('codec', ['zlib', 'zstd'], indirect=True)
+    if 'processor' in metafunc.funcargnames:
+        metafunc.parametrize('processor', list(TESTABLE_PROCESSORS.values()),
+                             ids=list(TESTABLE_PROCESSORS.keys()))
+
+
+def pytest_funcarg__cache(request):
+    clock = FakeClock()
+    tmpdir = request.getfuncargvalue('tmpdir')
+    cache = {
+        'memory': lambda: MemoryCache(clock=clock),
+        'file': lambda: FileCache(tmpdir.strpath, clock=clock),
+        'sqlite': lambda: SQLiteCache(tmpdir.join('cache.db').strpath,
+                                      clock=clock),
+        'shared': lambda: SharedCache(LocalClient(clock), clock=clock),
+        'tiered': lambda: TieredCache(MemoryCache(clock=clock),
+                                      FileCache(tmpdir.strpath, clock=clock)),
+    }[request.param]()
+    cache.clock = clock
+    return cache
+
+
+def test_cache_stores_bytes(cache):
+    assert cache.get('abc') is None
+    cache.set('abc', b'<xml/>')
+    assert cache.get('abc') == (b'<xml/>', cache.clock.now)
+    cache.set('abc', b'<other/>', created=1234.0)
+    assert cache.get('abc') == (b'<other/>', 1234.0)
+    cache.delete('abc')
+    assert cache.get('abc') is None
+    cache.set('abc', b'<xml/>')
+    cache.clear()
+    assert cache.get('abc') is None
+
+
+def test_memory_cache_discards_least_recently_used():
+    cache = MemoryCache(max_entries=2)
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+    cache.get('a')
+    cache.set('c', b'3')
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert len(cache) == 2
+
+
+def test_memory_cache_expires_entries():
+    clock = FakeClock()
+    cache = MemoryCache(ttl=60, clock=clock)
+    cache.set('a', b'1')
+    clock.now += 61
+    assert cache.get('a') is None
+
+
+def test_file_cache_is_bounded_in_size(tmpdir):
+    clock = FakeClock()
+    cache = FileCache(tmpdir.strpath, max_size=1000, clock=clock)
+    for no in range(10):
+        clock.now += 1
+        cache.set('key%i' % no, b'x' * 200)
+    assert cache.size <= 1000
+    assert cache.get('key0') is None
+    assert cache.get('key9') is not None
+
+    # another instance will find the same files
+    assert FileCache(tmpdir.strpath).size == cache.size
+
+
+def test_file_cache_without_size_limit_does_not_scan(tmpdir, monkeypatch):
+    FileCache(tmpdir.strpath).set('old', b'1')
+    cache = FileCache(tmpdir.strpath)
+    monkeypatch.setattr(cache, '_load_index', None)
+    cache.set('new', b'2')
+    assert cache._index is None
+
+
+def test_file_cache_prune_counts_other_writers(tmpdir):
+    clock = FakeClock()
+    first = FileCache(tmpdir.strpath, max_size=1000, clock=clock)
+    second = FileCache(tmpdir.strpath, max_size=1000, clock=clock)
+    for no in range(8):
+        clock.now += 1
+        for cache in first, second:
+            cache.set('%s%i' % (id(cache), no), b'x' * 100)
+    assert first.size <= 1000 and second.size <= 1000
+    assert FileCache(tmpdir.strpath).size > 1000
+    first.prune()
+    assert FileCache(tmpdir.strpath).size <= 1000
+    assert first.get('%s7' % id(second)) is not None
+
+
+def test_file_cache_purges_old_entries(tmpdir):
+    clock = FakeClock()
+    cache = FileCache(tmpdir.strpath, ttl=60, clock=clock)
+    cache.set('old', b'1')
+    clock.now += 30
+    cache.set('new', b'2')
+    clock.now += 31
+    assert cache.get('old') is None
+    cache.purge()
+    assert cache.size == 1
+    assert cache.get('new') is not None
+
+
+def test_tiered_cache_populates_upper_tiers(tmpdir):
+    memory = MemoryCache()
+    files = FileCache(tmpdir.strpath)
+    files.set('a', b'1', created=1234.0)
+    cache = TieredCache(memory, files)
+    assert cache.get('a') == (b'1', 1234.0)
+    assert memory.get('a') == (b'1', 1234.0)
+
+
+class CachingAPI (CachingMixin, API):
+    pass
+
+
+def pytest_funcarg__api(request):
+    server = request.getfuncargvalue('server')
+    api = CachingAPI('XXX', 'XXX', 'de')
+    api.host = '%s:%s' % server.server_address
+    api.REQUESTS_PER_SECOND = 10000
+    request.addfinalizer(api.close)
+    return api
+
+
+def test_responses_are_cached(api, server):
+    server.serve_content(load_xml('ItemLookup-de-valid-asin.xml'))
+    api.item_lookup('0747532745')
+    server.serve_content('this is not XML!')
+    root = api.item_lookup('0747532745')
+    assert root.Items.Item.ASIN == '0747532745'
+
+
+def test_errors_are_not_cached(api, server):
+    server.serve_content(load_xml('ItemLookup-de-invalid-item-id.xml'))
+    pytest.raises(InvalidParameterValue, api.item_lookup, '1234567890123')
+    assert len(api.cache) == 0
+
+
+def test_stale_responses_are_fetched_again(api, server):
+    api.cachetime = 60
+    server.serve_content(load_xml('ItemLookup-de-valid-asin.xml'))
+    api.item_lookup('0747532745')
+    for key in list(api.cache._entries):
+        data, created = api.cache.get(key)
+        api.cache.set(key, data, created - 61)
+    server.serve_content(load_xml('ItemLookup-de-invalid-item-id.xml'))
+    pytest.raises(InvalidParameterValue, api.item_lookup, '0747532745')
+
+
+def test_cache_key_is_canonical():
+    key = CachingMixin.cache_key
+    assert key({'A': '1', 'B': 2}) == key({'B': '2', 'A': 1})
+    assert key({'A': '1', 'Timestamp': '2015'}) == key({'A': '1'})
+    assert key({'A': '1'}) != key({'A': '2'})
+
+
+def test_cache_key_does_not_depend_on_parameter_order(api, server):
+    server.serve_content(load_xml('ItemLookup-de-valid-asin.xml'))
+    api.call(Operation='ItemLookup', ItemId='0747532745',
+             ResponseGroup=['Small', 'Images'])
+    server.serve_content('this is not XML!')
+    api.call(ResponseGroup='Small,Images', ItemId='0747532745',
+             Operation='ItemLookup')
+    # key is also found if only the URL is known
+    url = api._build_url(Operation='ItemLookup', ItemId='0747532745',
+                         ResponseGroup='Small,Images')
+    api._build_url(Operation='ItemLookup', ItemId='0000000000')
+    assert api._parse(api._fetch(url)) is not None
+
+
+def test_queries_of_urls_are_not_kept():
+    api = CachingAPI('XXX', 'XXX', 'de')
+    for no in range(10):
+        api._build_url(Operation='ItemLookup', ItemId=str(no))
+    assert api._local.query[1]['ItemId'] == '9'
+    api.close()
+
+
+class SlowAPI (API):
+
+    """
+    Answers every request with the same (slowly delivered) content.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(SlowAPI, self).__init__(*args, **kwargs)
+        self.content = load_xml('ItemLookup-de-valid-asin.xml')
+        self.fetched = 0
+
+    def _fetch(self, url):
+        self.fetched += 1
+        time.sleep(0.1)
+        return BytesIO(self.content)
+
+
+class SlowCachingAPI (CachingMixin, SlowAPI):
+    pass
+
+
+def _lookup_concurrently(api, count=5):
+    results = []
+    def lookup():
+        try:
+            results.append(api.item_lookup('0747532745'))
+        except Exception:
+            results.append(sys.exc_info()[1])
+    threads = [threading.Thread(target=lookup) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_identical_requests_are_coalesced():
+    api = SlowCachingAPI('XXX', 'XXX', 'de')
+    results = _lookup_concurrently(api)
+    assert api.fetched == 1
+    assert [root.Items.Item.ASIN for root in results] == ['0747532745'] * 5
+    api.close()
+
+
+def test_coalesced_requests_wait_for_slow_responses():
+    api = SlowCachingAPI('XXX', 'XXX', 'de')
+    api.TIMEOUT = 0.01
+    results = _lookup_concurrently(api)
+    assert api.fetched == 1
+    assert len(results) == 5
+    api.close()
+
+
+def test_coalesced_requests_share_errors():
+    api = SlowCachingAPI('XXX', 'XXX', 'de')
+    api.content = load_xml('ItemLookup-de-invalid-item-id.xml')
+    results = _lookup_concurrently(api)
+    assert api.fetched == 1
+    assert all(isinstance(e, InvalidParameterValue) for e in results)
+    assert len(api.cache) == 0
+    api.close()
+
+
+def test_stale_responses_are_revalidated_in_background():
+    api = SlowCachingAPI('XXX', 'XXX', 'de', cachetime=60,
+                         stale_while_revalidate=600)
+    api.item_lookup('0747532745')
+    for key in list(api.cache._entries):
+        data, created = api.cache.get(key)
+        api.cache.set(key, data, created - 61)
+    api.content = load_xml('ItemLookup-de-invalid-item-id.xml')
+    # stale response is returned immediately...
+    root = api.item_lookup('0747532745')
+    assert root.Items.Item.ASIN == '0747532745'
+    api.close()
+    assert api.fetched == 2
+    # ...and is kept because the refreshed one is an error
+    data, created = api.cache.get(key)
+    assert created < time.time() - 60
+
+
+def test_stale_while_revalidate_needs_cachetime():
+    pytest.raises(ValueError, CachingAPI, 'XXX', 'XXX', 'de',
+                  stale_while_revalidate=60)
+
+
+def test_response_caching_api_uses_file_cache(tmpdir, server):
+    api = ResponseCachingAPI('XXX', 'XXX', 'de', cachedir=tmpdir.strpath)
+    api.host = '%s:%s' % server.server_address
+    api.REQUESTS_PER_SECOND = 10000
+    server.serve_content(load_xml('ItemLookup-de-valid-asin.xml'))
+    api.item_lookup('0747532745')
+    assert api.cache.size == len(load_xml('ItemLookup-de-valid-asin.xml'))
+    assert len(api.get_hash('http://x/?A=1&Signature=abc')) == 32
+    api.close()
+
+
+def test_file_cache_serves_memory_maps(tmpdir):
+    cache = FileCache(tmpdir.strpath)
+    cache.set('a', b'<xml/>')
+    fp, _ = cache.open('a')
+    assert isinstance(fp, mmap.mmap)
+    assert fp.read(3) == b'<xm'
+    assert _CachedResponse(fp).read() == b'l/>'
+    fp.close()
+    assert cache.get('a')[0] == b'<xml/>'
+    cache.set('empty', b'')
+    assert cache.get('empty')[0] == b''
+
+
+def test_file_writer_stores_chunks_on_commit(tmpdir):
+    cache = FileCache(tmpdir.strpath)
+    writer = cache.writer('ab1')
+    writer.write(b'<xml>')
+    assert cache.get('ab1') is None
+    writer.write(b'</xml>')
+    writer.commit()
+    assert cache.get('ab1')[0] == b'<xml></xml>'
+    assert cache.size == 11
+
+    writer = cache.writer('ab2')
+    writer.write(b'<xml>')
+    writer.abort()
+    assert cache.get('ab2') is None
+    assert len(tmpdir.listdir()) == 1  # no stray temporary files
+    assert len(tmpdir.listdir()[0].listdir()) == 1
+
+
+def test_responses_are_parsed_once(tmpdir, server, processor):
+    api = CachingAPI('XXX', 'XXX', 'de', processor=processor,
+                     cache=FileCache(tmpdir.strpath))
+    api.host = '%s:%s' % server.server_address
+    api.REQUESTS_PER_SECOND = 10000
+    parsed = []
+    original = api.processor.parse
+    def parse(fp):
+        parsed.append(fp)
+        return original(fp)
+    api.processor.parse = parse
+
+    content = load_xml('ItemLookup-de-valid-asin.xml')
+    server.serve_content(content)
+    api.item_lookup('0747532745')
+    server.serve_content('this is not XML!')
+    root = api.item_lookup('0747532745')
+    assert len(parsed) == 2
+    assert root is not None
+    # stored exactly as received
+    key = tmpdir.listdir()[0].listdir()[0].basename
+    assert api.cache.get(key)[0] == content
+    api.close()
+
+
+def pytest_funcarg__codec(request):
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+        return ZstdCodec()
+    return ZlibCodec()
+
+
+def pytest_funcarg__samples(request):
+    return [load_xml(name) for name in sorted(
+        os.listdir(os.path.join(XML_TEST_DIR, '2011-08-01')))[::10]]
+
+
+def test_compressed_cache_round_trip(tmpdir, codec):
+    cache = CompressedCache(FileCache(tmpdir.strpath), codec)
+    content = load_xml('ItemLookup-de-valid-asin.xml')
+    cache.set('abc', content, created=1234.0)
+    assert cache.get('abc') == (content, 1234.0)
+    assert cache.cache.size < len(content) / 2
+
+    # streaming decompression in small steps
+    fp, _ = cache.open('abc')
+    _DecompressingReader.CHUNK_SIZE = 100
+    try:
+        chunks = iter(lambda: fp.read(37), b'')
+        assert b''.join(chunks) == content
+    finally:
+        _DecompressingReader.CHUNK_SIZE = 65536
+        fp.close()
+
+
+def test_dictionary_improves_compression(codec, samples):
+    if isinstance(codec, ZlibCodec) and sys.version_info < (3, 3):
+        pytest.skip('zlib dictionaries need Python 3.3+')
+    content = load_xml('ItemLookup-de-valid-asin.xml')
+    trained = codec.__class__(dictionary=codec.train(samples))
+    assert _compressed_size(trained, content) < _compressed_size(
+        codec, content)
+
+
+def _compressed_size(codec, content):
+    compressor = codec.compressor()
+    return len(compressor.compress(content) + compressor.flush())
+
+
+@pytest.mark.skipif('sys.version_info < (3, 3)')  # zlib dictionaries
+def test_entries_with_other_dictionary_are_missing(samples):
+    cache = MemoryCache()
+    content = load_xml('ItemLookup-de-valid-asin.xml')
+    CompressedCache(cache, ZlibCodec()).set('abc', content)
+    trained = CompressedCache(cache, ZlibCodec(
+        dictionary=ZlibCodec.train(samples)))
+    assert trained.get('abc') is None
+    trained.set('abc', content)
+    assert trained.get('abc')[0] == content
+
+
+def test_compressed_responses_are_parsed(tmpdir, server, processor):
+    api = CachingAPI('XXX', 'XXX', 'de', processor=processor,
+                     cache=CompressedCache(FileCache(tmpdir.strpath)))
+    api.host = '%s:%s' % server.server_address
+    api.REQUESTS_PER_SECOND = 10000
+    server.serve_content(load_xml('ItemLookup-de-valid-asin.xml'))
+    api.item_lookup('0747532745')
+    server.serve_content('this is not XML!')
+    api.item_lookup('0747532745')
+    api.close()
+
+
+def test_sqlite_cache_can_be_invalidated_by_content(tmpdir):
+    clock = FakeClock()
+    cache = SQLiteCache(tmpdir.join('cache.db').strpath, clock=clock)
+    for key, operation, item_ids in [
+            ('a', 'ItemLookup', ['0747532745', '0201896834']),
+            ('b', 'ItemLookup', ['0201896834']),
+            ('c', 'SimilarityLookup', ['0747532745']),
+            ('d', 'ItemSearch', [])]:
+        clock.now += 1
+        writer = cache.writer(key, {'operation': operation, 'locale': 'de',
+                                    'item_ids': item_ids})
+        writer.write(b'<xml/>')
+        writer.commit()
+
+    assert [entry['key'] for entry in cache.entries(item_id='0747532745')] \
+        == ['a', 'c']
+    assert cache.entries(operation='ItemSearch')[0] == {
+        'key': 'd', 'operation': 'ItemSearch', 'locale': 'de',
+        'created': clock.now, 'size': 6}
+
+    assert cache.invalidate(item_id='0201896834') == 2
+    assert cache.get('a') is None and cache.get('b') is None
+    assert cache.invalidate(operation='ItemSearch', before=clock.now) == 0
+    assert cache.invalidate(operation='ItemSearch') == 1
+    assert len(cache) == 1
+    assert cache.entries(item_id='0747532745')[0]['key'] == 'c'
+    pytest.raises(ValueError, cache.invalidate)
+
+
+def test_sqlite_cache_records_requests(tmpdir, server):
+    cache = SQLiteCache(tmpdir.join('cache.db').strpath)
+    api = CachingAPI('XXX', 'XXX', 'de', cache=cache)
+    api.host = '%s:%s' % server.server_address
+    api.REQUESTS_PER_SECOND = 10000
+    server.serve_content(load_xml('ItemLookup-de-valid-asin.xml'))
+    api.item_lookup('0747532745')
+    entry, = cache.entries(item_id='0747532745')
+    assert entry['operation'] == 'ItemLookup'
+    assert entry['locale'] == 'de'
+    assert entry['size'] == len(load_xml('ItemLookup-de-valid-asin.xml'))
+    api.close()
+    cache.close()
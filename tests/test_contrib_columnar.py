@@ -0,0 +1,80 @@
+from io import BytesIO
+
+import pytest
+
+from tests import TESTABLE_PROCESSORS
+from tests.test_records import ITEM, response
+
+from amazonproduct.contrib.columnar import ColumnarExporter, export, MISSING
+from amazonproduct.contrib.columnar import _INT64
+from amazonproduct.utils import load_class
+
+PROCESSORS = dict(TESTABLE_PROCESSORS,
+                  iterparse='amazonproduct.processors.iterparse',
+                  records='amazonproduct.processors.records')
+
+SPARSE_ITEM = '<Item><ASIN>B000000001</ASIN></Item>'
+
+
+def pytest_generate_tests(metafunc):
+    if 'processor' in metafunc.funcargnames:
+        metafunc.parametrize('processor', sorted(PROCESSORS), indirect=True)
+
+
+def pytest_funcarg__processor(request):
+    return load_class('%s.Processor' % PROCESSORS[request.param])()
+
+
+def parse(processor, items=ITEM + SPARSE_ITEM):
+    return processor.parse(BytesIO(response(items=items)))
+
+
+def test_columns(processor):
+    exporter = ColumnarExporter()
+    exporter.add_response(parse(processor), processor)
+    data = exporter.data
+    assert len(exporter) == 2
+    assert data['asin'] == ['0201896834', 'B000000001']
+    assert data['title'] == ['The Art of Computer Programming', None]
+    assert getattr(data['sales_rank'], 'typecode', None) == _INT64
+    assert list(data['sales_rank']) == [4711, MISSING]
+    assert list(data['lowest_new_price']) == [5490, MISSING]
+    assert data['currency'] == ['EUR', None]
+    assert list(data['total_new']) == [12, MISSING]
+    assert list(data['total_offers']) == [1, MISSING]
+    values, offsets = data['browse_node_ids']
+    assert list(values) == [124]
+    assert list(offsets) == [0, 1, 1]
+
+
+def test_numpy_columns(processor):
+    numpy = pytest.importorskip('numpy')
+    columns = export([parse(processor)], processor)
+    assert list(columns['asin']) == ['0201896834', 'B000000001']
+    assert list(columns['title']) == ['The Art of Computer Programming', None]
+    assert columns['sales_rank'].dtype == numpy.int64
+    assert list(columns['sales_rank']) == [4711, MISSING]
+    assert list(columns['lowest_new_price']) == [5490, MISSING]
+    assert list(columns['currency']) == ['EUR', None]
+    assert list(columns['total_new']) == [12, MISSING]
+    assert list(columns['total_offers']) == [1, MISSING]
+    assert list(columns['browse_node_ids']) == [124]
+    assert list(columns['browse_node_ids_offsets']) == [0, 1, 1]
+
+
+def test_items_can_be_added_one_by_one(processor):
+    exporter = ColumnarExporter()
+    for _ in range(3):
+        for items in processor.parse_items(parse(processor)):
+            exporter.extend(item for _, item in items)
+    assert len(exporter) == 6
+    assert list(exporter.data['sales_rank']) == [4711, MISSING] * 3
+
+
+def test_arrow_table():
+    pytest.importorskip('pyarrow')
+    processor = load_class('amazonproduct.processors.records.Processor')()
+    table = export(parse(processor), format='arrow')
+    assert table.num_rows == 2
+    assert table.column('sales_rank').to_pylist() == [4711, None]
+    assert table.column('browse_node_ids').to_pylist() == [[124], []]
@@ -22,13 +22,14 @@ def test_timeout(monkeypatch):
     class mock_fetch (object):
         def __init__(self):
             self.calls = 0
-        def __call__(self, _, url):
+        def __call__(self, url):
             self.calls += 1
             print('call {0}: {1}'.format(self.calls, url))
             raise URLError(socket.timeout())
 
     fetcher = mock_fetch()
-    monkeypatch.setattr(API, '_fetch', fetcher)
+    monkeypatch.setattr(API, '_fetch', lambda self, url: fetcher(url))
+    monkeypatch.setattr(RetryAPI, 'DELAY', 0.01)
 
     api = RetryAPI(locale='de')
 
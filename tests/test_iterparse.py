@@ -0,0 +1,148 @@
+from io import BytesIO
+import os.path
+
+import pytest
+
+from tests import XML_TEST_DIR
+
+from amazonproduct.api import API
+from amazonproduct.errors import AWSError, InvalidParameterValue
+from amazonproduct.contrib.caching import CachingMixin
+from amazonproduct.processors import etree, iterparse
+
+NAMESPACE = 'http://webservices.amazon.com/AWSECommerceService/2011-08-01'
+
+
+def load_xml(name):
+    with open(os.path.join(XML_TEST_DIR, '2011-08-01', name), 'rb') as fp:
+        return fp.read()
+
+
+class ChunkedReader (object):
+
+    """
+    File-like object keeping track of how much of ``data`` has been read.
+    """
+
+    def __init__(self, data):
+        self.fp = BytesIO(data)
+
+    def read(self, size=-1):
+        return self.fp.read(size)
+
+    @property
+    def position(self):
+        return self.fp.tell()
+
+
+def search_page(page, pages=3, items=5):
+    return ('<ItemSearchResponse xmlns="%s"><Items><Request>'
+            '<IsValid>True</IsValid><ItemSearchRequest><ItemPage>%i</ItemPage>'
+            '</ItemSearchRequest></Request><TotalResults>%i</TotalResults>'
+            '<TotalPages>%i</TotalPages>%s</Items></ItemSearchResponse>' % (
+                NAMESPACE, page, pages * items, pages, ''.join(
+                    '<Item><ASIN>%i.%i</ASIN><Variations><Item><ASIN>V</ASIN>'
+                    '</Item></Variations></Item>' % (page, i)
+                    for i in range(items)))).encode('utf-8')
+
+
+def asin(item):
+    return item.findtext('{%s}ASIN' % NAMESPACE)
+
+
+def test_items_match_etree():
+    data = load_xml('ItemSearch-de-lookup-by-title.xml')
+    expected = etree.Processor().parse(BytesIO(data))
+    asins = [asin(item) for item in
+             expected.iterfind('{*}Items/{*}Item')]
+    assert asins
+    response = iterparse.Processor().parse(BytesIO(data))
+    assert (response.findtext('{*}Items/{*}TotalResults') ==
+            expected.findtext('{*}Items/{*}TotalResults'))
+    assert [asin(item) for item in response] == asins
+
+
+def test_parse_returns_at_first_item():
+    data = search_page(1, items=500)
+    fp = ChunkedReader(data)
+    processor = iterparse.Processor()
+    processor.CHUNK_SIZE = 1024
+    response = processor.parse(fp)
+    assert fp.position < 4096
+    assert response.findtext('{*}Items/{*}TotalPages') == '3'
+    items = iter(response)
+    assert asin(next(items)) == '1.0'
+    assert fp.position < 4096
+    assert len(list(items)) == 499
+    assert fp.position == len(data)
+
+
+def test_items_are_removed_from_tree():
+    response = iterparse.Processor().parse(BytesIO(search_page(1)))
+    items = list(response)
+    assert [asin(item) for item in items] == ['1.%i' % i for i in range(5)]
+    assert response.find('{*}Items/{*}Item') is None
+    # nested items are not yielded on their own
+    assert items[0].findtext('{*}Variations/{*}Item/{*}ASIN') == 'V'
+
+
+def test_errors_are_raised_early():
+    data = load_xml('ItemLookup-de-invalid-item-id.xml')
+    pytest.raises(AWSError, iterparse.Processor().parse, BytesIO(data))
+
+
+def test_read_returns_complete_tree():
+    response = iterparse.Processor().parse(BytesIO(search_page(1)))
+    assert len(response.read().findall('{*}Items/{*}Item')) == 5
+
+
+def test_cart_can_be_parsed():
+    processor = iterparse.Processor()
+    data = load_xml('CartCreate-de-create-cart.xml')
+    cart = processor.parse_cart(processor.parse(BytesIO(data)))
+    expected = etree.Processor.parse_cart(
+        etree.Processor().parse(BytesIO(data)))
+    assert cart.cart_id == expected.cart_id
+    assert len(cart.items) == len(expected.items)
+
+
+class FakeSearchAPI (API):
+
+    def __init__(self, *args, **kwargs):
+        super(FakeSearchAPI, self).__init__(*args, **kwargs)
+        self.requests = []
+
+    def _fetch(self, url):
+        self.requests.append(url)
+        return BytesIO(search_page(len(self.requests)))
+
+
+def test_paginator_streams_items():
+    api = FakeSearchAPI('XXX', 'XXX', 'de',
+                        processor='amazonproduct.processors.iterparse')
+    asins = [asin(item) for item in api.item_search('Books', Title='Python')]
+    assert asins == ['%i.%i' % (page, i)
+                     for page in (1, 2, 3) for i in range(5)]
+    assert len(api.requests) == 3
+
+
+class CachingSearchAPI (CachingMixin, FakeSearchAPI):
+    pass
+
+
+def test_streamed_responses_are_cached():
+    api = CachingSearchAPI('XXX', 'XXX', 'de',
+                           processor='amazonproduct.processors.iterparse')
+    for _ in range(2):
+        root = api.item_search('Books', Title='Python', paginate=None)
+        assert [asin(item) for item in root] == ['1.%i' % i for i in range(5)]
+    assert len(api.requests) == 1
+
+
+def test_api_maps_errors(server):
+    api = API('XXX', 'XXX', 'de',
+              processor='amazonproduct.processors.iterparse')
+    api.host = '%s:%s' % server.server_address
+    server.serve_content(load_xml('ItemLookup-de-invalid-item-id.xml'))
+    pytest.raises(InvalidParameterValue, api.item_lookup, '1234567890123')
+    api.close()
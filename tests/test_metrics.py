@@ -0,0 +1,127 @@
+import os.path
+
+import pytest
+
+from tests import XML_TEST_DIR
+
+from amazonproduct.api import API
+from amazonproduct.contrib.caching import CachingMixin
+from amazonproduct.errors import InvalidParameterValue
+from amazonproduct.metrics import BaseObserver, Histogram, MetricsCollector
+from amazonproduct.metrics import PrometheusObserver, TimedReader
+
+
+def load_xml(name):
+    with open(os.path.join(XML_TEST_DIR, '2011-08-01', name), 'rb') as fp:
+        return fp.read()
+
+
+class Recorder (BaseObserver):
+
+    def __init__(self):
+        self.started = []
+        self.finished = []
+
+    def call_started(self, call):
+        self.started.append(call)
+
+    def call_finished(self, call):
+        self.finished.append(call)
+
+
+class CachingAPI (CachingMixin, API):
+    pass
+
+
+def make_api(server, cls=API, **kwargs):
+    api = cls('XXX', 'XXX', 'de', **kwargs)
+    api.host = '%s:%s' % server.server_address
+    api.REQUESTS_PER_SECOND = 10000
+    return api
+
+
+def test_stages_are_measured(server):
+    content = load_xml('ItemLookup-de-valid-asin.xml')
+    server.serve_content(content)
+    recorder = Recorder()
+    with make_api(server, observers=[recorder]) as api:
+        api.item_lookup('0747532745')
+    assert recorder.started == recorder.finished
+    call = recorder.finished[0]
+    assert call.operation == 'ItemLookup'
+    assert call.locale == 'de'
+    assert set(call.timings) == set(['sign', 'throttle', 'fetch', 'read',
+                                     'parse'])
+    assert sum(call.timings.values()) <= call.duration
+    assert call.response_size == len(content)
+    assert call.error is None
+    assert api.current_call is None
+
+
+def test_mapped_errors_are_reported(server):
+    server.serve_content(load_xml('ItemLookup-de-invalid-item-id.xml'))
+    recorder = Recorder()
+    with make_api(server, observers=[recorder]) as api:
+        pytest.raises(InvalidParameterValue, api.item_lookup, '1234567890123')
+    call = recorder.finished[0]
+    assert call.error is InvalidParameterValue
+    assert 'map_error' in call.timings
+
+
+def test_cache_results_are_reported(server):
+    server.serve_content(load_xml('ItemLookup-de-valid-asin.xml'))
+    recorder = Recorder()
+    with make_api(server, CachingAPI, observers=[recorder]) as api:
+        api.item_lookup('0747532745')
+        api.item_lookup('0747532745')
+    miss, hit = recorder.finished
+    assert (miss.cache, hit.cache) == ('miss', 'hit')
+    assert 'fetch' not in hit.timings
+    assert hit.response_size is None
+
+
+def test_calls_without_observers_are_not_measured(server):
+    server.serve_content(load_xml('ItemLookup-de-valid-asin.xml'))
+    with make_api(server) as api:
+        fp = api._fetch(api._build_url(Operation='ItemLookup'))
+        assert not isinstance(fp, TimedReader)
+        fp.read()
+
+
+def test_collector_aggregates_calls(server):
+    server.serve_content(load_xml('ItemLookup-de-valid-asin.xml'))
+    metrics = MetricsCollector()
+    with make_api(server, observers=[metrics]) as api:
+        for _ in range(3):
+            api.item_lookup('0747532745')
+    summary = metrics.summary()
+    assert summary['calls'] == {'ItemLookup': 3}
+    assert summary['durations']['call']['count'] == 3
+    assert summary['durations']['parse']['p50'] is not None
+    assert summary['response_size']['count'] == 3
+    assert summary['errors'] == {}
+
+
+def test_histogram_quantiles():
+    histogram = Histogram([1, 2, 4])
+    for value in (0.5, 1.5, 1.5, 3, 10):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.mean == 3.3
+    assert histogram.quantile(.5) == 2
+    assert histogram.quantile(.8) == 4
+    assert histogram.quantile(1) is None
+    assert Histogram().quantile(.5) is None
+
+
+def test_prometheus_observer(server):
+    prometheus_client = pytest.importorskip('prometheus_client')
+    registry = prometheus_client.CollectorRegistry()
+    server.serve_content(load_xml('ItemLookup-de-invalid-item-id.xml'))
+    observer = PrometheusObserver(registry=registry)
+    with make_api(server, observers=[observer]) as api:
+        pytest.raises(InvalidParameterValue, api.item_lookup, '1234567890123')
+    assert registry.get_sample_value('amazonproduct_call_seconds_count', {
+        'operation': 'ItemLookup', 'stage': 'call'}) == 1
+    assert registry.get_sample_value('amazonproduct_errors_total', {
+        'operation': 'ItemLookup', 'exception': 'InvalidParameterValue'}) == 1
@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from amazonproduct.processors import BaseResultPaginator
+
+
+class DictPaginator (BaseResultPaginator):
+
+    """
+    Paginator over pages which are simple dicts.
+    """
+
+    counter = 'ItemPage'
+
+    def paginator_data(self, node):
+        return node['page'], node['pages'], node['pages'] * 10
+
+    def iterate(self, node):
+        return node['items']
+
+
+class PageServer (object):
+
+    """
+    Stand-in for :meth:`API.call` returning dict pages (with a little delay)
+    and keeping track of the number of simultaneous calls.
+    """
+
+    def __init__(self, pages=10, delay=0.05, fail_on=None):
+        self.pages = pages
+        self.delay = delay
+        self.fail_on = fail_on
+        self.calls = []
+        self.running = self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        page = kwargs['ItemPage']
+        with self._lock:
+            self.calls.append(page)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if page == self.fail_on:
+                raise ValueError(page)
+            return {
+                'page': page,
+                'pages': self.pages,
+                'items': ['%i.%i' % (page, i) for i in range(10)],
+            }
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def test_pages_are_fetched_one_after_another_by_default():
+    fun = PageServer()
+    paginator = DictPaginator(fun, Operation='ItemSearch')
+    items = list(paginator)
+    assert len(items) == 100
+    assert fun.max_running == 1
+    assert fun.calls == list(range(1, 11))
+
+
+@pytest.mark.parametrize('prefetch', [2, 4, 9])
+def test_prefetched_pages_are_yielded_in_order(prefetch):
+    fun = PageServer()
+    paginator = DictPaginator(fun, Operation='ItemSearch', prefetch=prefetch)
+    pages = [root['page'] for root in paginator.iterpages()]
+    assert pages == list(range(1, 11))
+    assert sorted(fun.calls) == list(range(1, 11))
+    assert 1 < fun.max_running <= prefetch
+    assert paginator.current == 10
+
+
+def test_prefetching_is_faster():
+    fun = PageServer(delay=0.1)
+    start = time.time()
+    list(DictPaginator(fun, Operation='ItemSearch', prefetch=9))
+    assert time.time() - start < 0.5
+
+
+def test_readahead_limits_pages_fetched_in_advance():
+    fun = PageServer()
+    paginator = DictPaginator(fun, Operation='ItemSearch', prefetch=4,
+                              readahead=2)
+    pages = paginator.iterpages()
+    assert next(pages)['page'] == 1
+    assert next(pages)['page'] == 2
+    time.sleep(0.2)
+    # page 1 fetched at start, pages 2-3 as read-ahead, 4 after 2 was read
+    assert sorted(fun.calls) == [1, 2, 3, 4]
+    assert fun.max_running <= 2
+
+
+def test_prefetching_respects_limit():
+    fun = PageServer(pages=69)
+    paginator = DictPaginator(fun, Operation='ItemSearch', prefetch=3,
+                              limit=5)
+    assert len(list(paginator.iterpages())) == 5
+    assert sorted(fun.calls) == [1, 2, 3, 4, 5]
+
+
+def test_prefetching_stops_when_iteration_stops():
+    fun = PageServer()
+    paginator = DictPaginator(fun, Operation='ItemSearch', prefetch=2)
+    for root in paginator.iterpages():
+        if root['page'] == 3:
+            break
+    time.sleep(0.2)
+    assert len(fun.calls) <= 5
+
+
+def test_prefetching_raises_errors_in_order():
+    fun = PageServer(fail_on=4)
+    paginator = DictPaginator(fun, Operation='ItemSearch', prefetch=3)
+    pages = []
+    with pytest.raises(ValueError):
+        for root in paginator.iterpages():
+            pages.append(root['page'])
+    assert pages == [1, 2, 3]
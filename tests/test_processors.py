@@ -0,0 +1,68 @@
+from xml.etree import ElementTree
+
+from lxml import etree
+
+from amazonproduct.processors._lxml import xpath, find_errors, namespace
+from amazonproduct.processors._lxml import SearchPaginator
+from amazonproduct.processors import elementtree
+
+NAMESPACE = 'http://webservices.amazon.com/AWSECommerceService/2011-08-01'
+
+
+def test_xpath_is_compiled_once_per_namespace():
+    assert xpath('aws:Items', NAMESPACE) is xpath('aws:Items', NAMESPACE)
+    assert xpath('aws:Items', NAMESPACE) is not xpath('aws:Items', 'other')
+
+
+def test_xpath_without_namespace():
+    root = etree.fromstring('<Response><Items/></Response>')
+    assert namespace(root) == ''
+    assert len(xpath('aws:Items', namespace(root))(root)) == 1
+
+
+def test_errors_are_found_in_multi_operation_responses():
+    root = etree.fromstring(
+        '<MultiOperationResponse xmlns="%s"><ItemLookupResponse><Items>'
+        '<Request><Errors><Error><Code>A</Code></Error></Errors></Request>'
+        '</Items></ItemLookupResponse></MultiOperationResponse>' % NAMESPACE)
+    assert [error.findtext('{*}Code') for error in find_errors(root)] == ['A']
+
+
+def test_errors_outside_known_locations_are_ignored():
+    root = etree.fromstring(
+        '<ItemLookupResponse xmlns="%s"><Items><Item><EditorialReviews>'
+        '<Error>not an error</Error></EditorialReviews></Item></Items>'
+        '</ItemLookupResponse>' % NAMESPACE)
+    assert find_errors(root) == []
+
+
+def test_search_paginator_uses_anchored_paths():
+    root = etree.fromstring(
+        '<ItemSearchResponse xmlns="%s"><Items><Request><ItemSearchRequest>'
+        '<ItemPage>2</ItemPage></ItemSearchRequest></Request>'
+        '<TotalResults>25</TotalResults><TotalPages>3</TotalPages>'
+        '<Item><ASIN>1</ASIN></Item><Item><ASIN>2</ASIN></Item></Items>'
+        '</ItemSearchResponse>' % NAMESPACE)
+    paginator = SearchPaginator(lambda **kwargs: root)
+    assert (paginator.current, paginator.pages, paginator.results) == (2, 3, 25)
+    assert len(paginator.iterate(root)) == 2
+
+
+def test_elementtree_paths_are_expanded_once():
+    paths = elementtree.expand('./{}A|./{}B', '{ns}')
+    assert paths == ('./{ns}A', './{ns}B')
+    assert elementtree.expand('./{}A|./{}B', '{ns}') is paths
+
+
+def test_elementtree_paginator_data():
+    root = ElementTree.fromstring(
+        '<ItemLookupResponse xmlns="%s"><Items><Item><RelatedItems>'
+        '<RelatedItemCount>12</RelatedItemCount>'
+        '<RelatedItemPageCount>2</RelatedItemPageCount>'
+        '<RelatedItemPage>1</RelatedItemPage>'
+        '<RelatedItem><Item><ASIN>1</ASIN></Item></RelatedItem>'
+        '</RelatedItems></Item></Items></ItemLookupResponse>' % NAMESPACE)
+    assert elementtree.extract_nspace(root) == '{%s}' % NAMESPACE
+    paginator = elementtree.RelatedItemsPaginator(lambda **kwargs: root)
+    assert (paginator.current, paginator.pages, paginator.results) == (1, 2, 12)
+    assert len(paginator.iterate(root)) == 1
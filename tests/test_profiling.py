@@ -0,0 +1,147 @@
+from io import BytesIO
+import os.path
+import time
+import warnings
+
+import pytest
+
+from tests import XML_TEST_DIR
+
+from amazonproduct import profiling
+from amazonproduct.api import API
+from amazonproduct.profiling import SamplingProfiler, from_config
+from amazonproduct.transport import BaseTransport
+
+with open(os.path.join(XML_TEST_DIR, '2011-08-01',
+                       'ItemLookup-de-valid-asin.xml'), 'rb') as fp:
+    CONTENT = fp.read()
+
+
+class SlowTransport (BaseTransport):
+
+    def fetch(self, url, headers=None):
+        time.sleep(0.05)
+        return BytesIO(CONTENT)
+
+
+def pytest_funcarg__profiler(request):
+    profiler = SamplingProfiler(interval=0.001)
+    request.addfinalizer(profiler.close)
+    return profiler
+
+
+def make_api(*observers):
+    api = API('XXX', 'XXX', 'de', transport=SlowTransport(),
+              observers=observers)
+    api.REQUESTS_PER_SECOND = 10000
+    return api
+
+
+def test_stacks_are_sampled_per_operation(profiler):
+    api = make_api(profiler)
+    api.item_lookup('0747532745')
+    assert profiler.calls == {'ItemLookup': 1}
+    lines = profiler.collapsed('ItemLookup')
+    assert lines
+    assert all(line.startswith('amazonproduct.api:call;') for line in lines)
+    assert any('tests.test_profiling:fetch' in line for line in lines)
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) > 10
+
+
+class WrappingAPI (API):
+
+    def call(self, **qargs):
+        return super(WrappingAPI, self).call(**qargs)
+
+    def _call_started(self, qargs):
+        return super(WrappingAPI, self)._call_started(qargs)
+
+
+def test_stacks_are_rooted_at_api_call_in_subclasses(profiler):
+    api = WrappingAPI('XXX', 'XXX', 'de', transport=SlowTransport(),
+                      observers=[profiler])
+    api.REQUESTS_PER_SECOND = 10000
+    api.item_lookup('0747532745')
+    lines = profiler.collapsed('ItemLookup')
+    assert lines
+    assert all(line.startswith('amazonproduct.api:call;') for line in lines)
+
+
+def test_only_some_calls_are_sampled():
+    profiler = SamplingProfiler(sample_rate=0.5, seed=42)
+    api = make_api(profiler)
+    api.transport.fetch = lambda url, headers=None: BytesIO(CONTENT)
+    for _ in range(20):
+        api.item_lookup('0747532745')
+    profiler.close()
+    assert 0 < profiler.calls['ItemLookup'] < 20
+
+
+def test_invalid_sample_rate():
+    pytest.raises(ValueError, SamplingProfiler, sample_rate=0)
+
+
+def test_collapsed_stacks_are_written(profiler, tmpdir):
+    make_api(profiler).item_lookup('0747532745')
+    paths = profiler.write(tmpdir.join('profiles').strpath)
+    assert [os.path.basename(path) for path in paths] == ['ItemLookup.folded']
+    assert tmpdir.join('profiles', 'ItemLookup.folded').read().splitlines() \
+        == profiler.collapsed('ItemLookup')
+
+
+def test_profiling_is_off_by_default(monkeypatch, configfiles):
+    monkeypatch.delenv('AMAZON_PRODUCT_PROFILE', raising=False)
+    assert from_config() is None
+    assert make_api().observers == []
+
+
+def test_profiling_switched_on_by_environment(monkeypatch, configfiles):
+    monkeypatch.setenv('AMAZON_PRODUCT_PROFILE', '0.25')
+    profiler = from_config()
+    assert profiler.sample_rate == 0.25
+    assert make_api().observers == [profiler]
+    assert make_api().observers == [profiler]
+
+
+def test_profiling_switched_on_by_config_file(monkeypatch, configfiles):
+    monkeypatch.delenv('AMAZON_PRODUCT_PROFILE', raising=False)
+    configfiles.add_file('''
+        [Profiling]
+        sample_rate = 0.5
+        interval = 0.01''', path='~/.amazon-product-api')
+    profiler = from_config()
+    assert (profiler.sample_rate, profiler.interval) == (0.5, 0.01)
+
+
+def test_config_files_are_read_once(monkeypatch, configfiles):
+    monkeypatch.delenv('AMAZON_PRODUCT_PROFILE', raising=False)
+    configfiles.add_file('''
+        [Profiling]
+        sample_rate = 0.5''', path='~/.amazon-product-api')
+    profiler = from_config()
+    monkeypatch.setattr(profiling, 'SafeConfigParser', None)
+    assert from_config() is profiler
+    assert make_api().observers == [profiler]
+
+
+def test_config_dict_ignores_config_files(monkeypatch, configfiles):
+    monkeypatch.delenv('AMAZON_PRODUCT_PROFILE', raising=False)
+    configfiles.add_file('''
+        [Profiling]
+        sample_rate = 0.5''', path='~/.amazon-product-api')
+    api = API(locale='de', cfg={'access_key': 'XXX', 'secret_key': 'XXX',
+                                'associate_tag': 'XXX'})
+    assert api.observers == []
+    monkeypatch.setenv('AMAZON_PRODUCT_PROFILE', '0.25')
+    api = API(locale='de', cfg={'access_key': 'XXX', 'secret_key': 'XXX',
+                                'associate_tag': 'XXX'})
+    assert api.observers == [from_config()]
+
+
+def test_invalid_profiling_settings_are_reported(monkeypatch, configfiles):
+    for value in ('lots', '2'):
+        monkeypatch.setenv('AMAZON_PRODUCT_PROFILE', value)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            assert make_api().observers == []
+        assert len([w for w in caught if w.category is RuntimeWarning]) == 1
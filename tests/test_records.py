@@ -0,0 +1,196 @@
+from decimal import Decimal
+from io import BytesIO
+import os.path
+
+import pytest
+
+from tests import XML_TEST_DIR
+
+from amazonproduct.api import API
+from amazonproduct.errors import AWSError, InvalidParameterValue
+from amazonproduct.processors import records
+
+NAMESPACE = 'http://webservices.amazon.com/AWSECommerceService/2011-08-01'
+
+ITEM = '''
+<Item>
+  <ASIN>0201896834</ASIN>
+  <DetailPageURL>http://www.amazon.de/dp/0201896834</DetailPageURL>
+  <SalesRank>4711</SalesRank>
+  <SmallImage><URL>http://img/s.jpg</URL><Height Units="pixels">75</Height>
+    <Width Units="pixels">60</Width></SmallImage>
+  <ImageSets><ImageSet Category="primary">
+    <LargeImage><URL>http://img/l.jpg</URL></LargeImage>
+  </ImageSet></ImageSets>
+  <ItemAttributes>
+    <Author>Donald E. Knuth</Author>
+    <Binding>Gebundene Ausgabe</Binding>
+    <Languages><Language><Name>Englisch</Name><Type>Published</Type></Language>
+      <Language><Name>Deutsch</Name><Type>Original</Type></Language></Languages>
+    <ListPrice><Amount>6795</Amount><CurrencyCode>EUR</CurrencyCode>
+      <FormattedPrice>EUR 67,95</FormattedPrice></ListPrice>
+    <NumberOfPages>672</NumberOfPages>
+    <Title>The Art of Computer Programming</Title>
+  </ItemAttributes>
+  <OfferSummary>
+    <LowestNewPrice><Amount>5490</Amount><CurrencyCode>EUR</CurrencyCode>
+    </LowestNewPrice>
+    <TotalNew>12</TotalNew><TotalUsed>3</TotalUsed>
+  </OfferSummary>
+  <Offers>
+    <TotalOffers>1</TotalOffers>
+    <Offer>
+      <Merchant><Name>Amazon.de</Name></Merchant>
+      <OfferAttributes><Condition>New</Condition></OfferAttributes>
+      <OfferListing>
+        <Price><Amount>5490</Amount><CurrencyCode>EUR</CurrencyCode></Price>
+        <PercentageSaved>19</PercentageSaved>
+        <IsEligibleForSuperSaverShipping>1</IsEligibleForSuperSaverShipping>
+      </OfferListing>
+    </Offer>
+  </Offers>
+  <BrowseNodes><BrowseNode><BrowseNodeId>124</BrowseNodeId>
+    <Name>Computer</Name><Ancestors><BrowseNode><BrowseNodeId>541686</BrowseNodeId>
+    <Name>Kategorien</Name></BrowseNode></Ancestors></BrowseNode></BrowseNodes>
+  <CustomerReviews><IFrameURL>http://reviews</IFrameURL></CustomerReviews>
+</Item>'''
+
+
+def response(operation='ItemLookup', items=ITEM, page=1, pages=1):
+    return ('<%sResponse xmlns="%s"><Items><Request><IsValid>True</IsValid>'
+            '<ItemSearchRequest><ItemPage>%i</ItemPage></ItemSearchRequest>'
+            '</Request><TotalResults>%i</TotalResults>'
+            '<TotalPages>%i</TotalPages>%s</Items></%sResponse>' % (
+                operation, NAMESPACE, page, pages * 10, pages, items,
+                operation)).encode('utf-8')
+
+
+def pytest_funcarg__item(request):
+    return list(records.Processor().parse(BytesIO(response())))[0]
+
+
+def test_fields_are_typed(item):
+    assert item.asin == '0201896834'
+    assert item.sales_rank == 4711
+    assert item.attributes.number_of_pages == 672
+    assert item.attributes.list_price.amount == 6795
+    assert item.attributes.list_price.value == Decimal('67.95')
+    assert item.small_image.height == 75
+    assert item.offer_summary.total_new == 12
+    assert item.offer_summary.total_refurbished is None
+
+
+def test_nested_and_repeated_fields(item):
+    assert item.attributes.authors == ['Donald E. Knuth']
+    assert item.attributes.creators == []
+    assert item.attributes.languages == ['Englisch', 'Deutsch']
+    assert item.image_sets[0].large.url == 'http://img/l.jpg'
+    offer = item.offers.offers[0]
+    assert offer.merchant == 'Amazon.de'
+    assert offer.condition == 'New'
+    assert offer.price.amount == 5490
+    assert offer.percentage_saved == 19
+    assert offer.super_saver_shipping is True
+    assert item.browse_nodes[0].ancestors[0].name == 'Kategorien'
+
+
+def test_records_are_slotted(item):
+    assert not hasattr(item, '__dict__')
+    pytest.raises(AttributeError, setattr, item, 'foo', 1)
+    assert item.as_dict()['attributes']['authors'] == ['Donald E. Knuth']
+
+
+def test_yen_have_no_cents():
+    price = records.Price.__new__(records.Price)
+    price.amount, price.currency_code = 1200, 'JPY'
+    assert price.value == Decimal(1200)
+
+
+class ReviewedItem (records.Item):
+    reviews_url = records.Field('CustomerReviews/IFrameURL')
+
+
+def test_records_can_be_extended():
+    processor = records.Processor(records={'Item': ReviewedItem})
+    item = list(processor.parse(BytesIO(response())))[0]
+    assert isinstance(item, ReviewedItem)
+    assert item.reviews_url == 'http://reviews'
+    assert item.attributes.title == 'The Art of Computer Programming'
+    assert ReviewedItem.__slots__ == ('reviews_url', )
+
+
+def test_record_names_are_resolved_per_module():
+    class Item (records.Item):
+        pass
+    item = list(records.Processor().parse(BytesIO(response())))[0]
+    assert type(item) is records.Item
+    assert records.RecordType.registry['amazonproduct.processors.records.Item'] \
+        is records.Item
+
+
+def test_errors_carry_response():
+    path = os.path.join(XML_TEST_DIR, '2011-08-01',
+                        'ItemLookup-de-invalid-item-id.xml')
+    with open(path, 'rb') as fp:
+        e = pytest.raises(AWSError, records.Processor().parse, fp).value
+    assert e.code == 'AWS.InvalidParameterValue'
+    assert e.xml.operation == 'ItemLookup'
+    assert e.xml.items[0].items == []
+
+
+def test_batch_results():
+    data = ('<MultiOperationResponse xmlns="%s"><ItemLookupResponse><Items>'
+            '<Item><ASIN>A</ASIN></Item></Items><Items><Item><ASIN>B</ASIN>'
+            '</Item></Items></ItemLookupResponse><BrowseNodeLookupResponse>'
+            '<BrowseNodes><BrowseNode><BrowseNodeId>1</BrowseNodeId>'
+            '</BrowseNode></BrowseNodes></BrowseNodeLookupResponse>'
+            '</MultiOperationResponse>' % NAMESPACE).encode('utf-8')
+    processor = records.Processor()
+    node = processor.parse(BytesIO(data))
+    assert [[asin for asin, _ in items]
+            for items in processor.parse_items(node)] == [['A'], ['B']]
+    results = processor.parse_batch(node)
+    assert [operation for operation, _ in results] == [
+        'ItemLookup', 'ItemLookup', 'BrowseNodeLookup']
+    assert results[2][1].browse_nodes[0].id == '1'
+
+
+def test_carts_are_parsed():
+    path = os.path.join(XML_TEST_DIR, '2011-08-01',
+                        'CartCreate-de-create-cart.xml')
+    processor = records.Processor()
+    with open(path, 'rb') as fp:
+        cart = processor.parse_cart(processor.parse(fp))
+    assert cart.cart_id is not None
+
+
+class FakeSearchAPI (API):
+
+    def __init__(self, *args, **kwargs):
+        super(FakeSearchAPI, self).__init__(*args, **kwargs)
+        self.requests = 0
+
+    def _fetch(self, url):
+        self.requests += 1
+        return BytesIO(response(
+            'ItemSearch', ITEM * 2, page=self.requests, pages=3))
+
+
+def test_paginator_yields_records():
+    api = FakeSearchAPI('XXX', 'XXX', 'de',
+                        processor='amazonproduct.processors.records')
+    items = list(api.item_search('Books', Title='Knuth'))
+    assert len(items) == 6
+    assert all(isinstance(item, records.Item) for item in items)
+
+
+def test_api_maps_errors(server):
+    api = API('XXX', 'XXX', 'de',
+              processor='amazonproduct.processors.records')
+    api.host = '%s:%s' % server.server_address
+    path = os.path.join(XML_TEST_DIR, '2011-08-01',
+                        'ItemLookup-de-invalid-item-id.xml')
+    with open(path, 'rb') as fp:
+        server.serve_content(fp.read())
+    pytest.raises(InvalidParameterValue, api.item_lookup, '1234567890123')
+    api.close()
@@ -0,0 +1,255 @@
+from io import BytesIO
+import os.path
+import socket
+
+try:
+    from urllib.request import URLError
+except ImportError:  # pragma: no cover
+    from urllib2 import URLError
+
+import pytest
+import requests
+
+from tests import XML_TEST_DIR
+
+from amazonproduct.api import API
+from amazonproduct.errors import CircuitOpen, InternalError
+from amazonproduct.errors import InvalidParameterValue, ServerError
+from amazonproduct.errors import TooManyRequests
+from amazonproduct.metrics import MetricsCollector
+from amazonproduct.retry import CircuitBreaker, RetryBudget, RetryPolicy
+from amazonproduct.retry import is_transient, retry_after
+from amazonproduct.transport import BaseTransport
+
+
+def load_xml(*path):
+    with open(os.path.join(XML_TEST_DIR, *path), 'rb') as fp:
+        return fp.read()
+
+VALID = load_xml('2011-08-01', 'ItemLookup-de-valid-asin.xml')
+INVALID = load_xml('2011-08-01', 'ItemLookup-de-invalid-item-id.xml')
+THROTTLED = load_xml('APICalls-fails-for-too-many-requests.xml')
+INTERNAL = load_xml('internal-error.xml')
+UNAVAILABLE = b'<html><body>Service Unavailable</body></html>'
+
+
+class Response (BytesIO):
+
+    def __init__(self, content, headers=None):
+        BytesIO.__init__(self, content)
+        self.headers = headers or {}
+
+
+class ScriptedTransport (BaseTransport):
+
+    """
+    Answers requests with the given responses (or raises them) in turn.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    def fetch(self, url, headers=None):
+        self.requests += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class Clock (object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def make_api(transport, **kwargs):
+    clock = Clock()
+    kwargs.setdefault('clock', clock)
+    kwargs.setdefault('sleep', clock.sleep)
+    kwargs.setdefault('seed', 1)
+    policy = RetryPolicy(**kwargs)
+    api = API('XXX', 'XXX', 'de', transport=transport, retry=policy)
+    api.REQUESTS_PER_SECOND = 10000
+    return api, clock
+
+
+def test_throttled_requests_are_retried():
+    transport = ScriptedTransport(
+        Response(THROTTLED), Response(THROTTLED), Response(VALID))
+    api, clock = make_api(transport, base_delay=1, backoff=2)
+    api.item_lookup('0747532745')
+    assert transport.requests == 3
+    assert len(clock.slept) == 2
+    assert 0 <= clock.slept[0] <= 1 and 0 <= clock.slept[1] <= 2
+
+
+def test_internal_errors_and_timeouts_are_retried():
+    transport = ScriptedTransport(
+        Response(INTERNAL), requests.exceptions.ConnectionError(),
+        URLError(socket.timeout()), Response(VALID))
+    api, clock = make_api(transport)
+    api.item_lookup('0747532745')
+    assert transport.requests == 4
+
+
+def test_server_errors_are_retried():
+    transport = ScriptedTransport(
+        ServerError(503, Response(UNAVAILABLE, {'Retry-After': '4'})),
+        ServerError(502, Response(b'Bad Gateway')),
+        ServerError(500, Response(b'')), Response(VALID))
+    api, clock = make_api(transport, base_delay=1, max_delay=10)
+    api.item_lookup('0747532745')
+    assert transport.requests == 4
+    assert clock.slept[0] == 4
+
+
+def test_error_messages_of_server_errors_are_parsed():
+    transport = ScriptedTransport(ServerError(503, Response(THROTTLED)))
+    api, clock = make_api(transport, tries=1)
+    pytest.raises(TooManyRequests, api.item_lookup, '0747532745')
+
+
+def test_server_errors_of_default_transport_are_retried(server):
+    server.serve_content(UNAVAILABLE, 503, {'Retry-After': '1'})
+    clock = Clock()
+    policy = RetryPolicy(tries=3, clock=clock, sleep=clock.sleep)
+    api = API('XXX', 'XXX', 'de', retry=policy)
+    api.host = '%s:%s' % server.server_address
+    api.REQUESTS_PER_SECOND = 10000
+    error = pytest.raises(ServerError, api.item_lookup, '0747532745').value
+    api.close()
+    assert error.status == 503 and error.retry_after == 1
+    assert error.response is None
+    assert len(clock.slept) == 2
+
+
+def test_other_errors_are_raised_right_away():
+    transport = ScriptedTransport(Response(INVALID))
+    api, clock = make_api(transport)
+    pytest.raises(InvalidParameterValue, api.item_lookup, '1234567890123')
+    assert transport.requests == 1
+    assert clock.slept == []
+
+
+def test_gives_up_after_all_tries():
+    transport = ScriptedTransport(*[Response(INTERNAL)] * 3)
+    api, clock = make_api(transport, tries=3, threshold=None)
+    pytest.raises(InternalError, api.item_lookup, '0747532745')
+    assert transport.requests == 3
+
+
+def test_retry_after_is_honoured():
+    transport = ScriptedTransport(
+        Response(THROTTLED, {'Retry-After': '7'}), Response(VALID))
+    api, clock = make_api(transport, base_delay=1, max_delay=10)
+    api.item_lookup('0747532745')
+    assert clock.slept == [7]
+
+
+def test_retry_after_beyond_max_delay_is_raised():
+    transport = ScriptedTransport(
+        Response(THROTTLED, {'Retry-After': '120'}), Response(VALID))
+    api, clock = make_api(transport, max_delay=10)
+    error = pytest.raises(TooManyRequests, api.item_lookup, '0747532745').value
+    assert error.retry_after == 120
+    assert transport.requests == 1
+
+
+def test_delays_are_jittered():
+    policy = RetryPolicy(base_delay=1, backoff=2, max_delay=5, seed=3)
+    delays = [policy.delay(tries) for tries in (1, 2, 3, 4, 5) * 20]
+    assert all(0 <= delay <= 5 for delay in delays)
+    assert len(set(delays)) == len(delays)
+    assert max(policy.delay(1) for _ in range(100)) <= 1
+
+
+def test_circuit_breaker_sheds_load():
+    transport = ScriptedTransport(
+        Response(INTERNAL), Response(INTERNAL), Response(VALID))
+    api, clock = make_api(transport, tries=1, threshold=2, reset_timeout=30)
+    for _ in range(2):
+        pytest.raises(InternalError, api.item_lookup, '0747532745')
+    pytest.raises(CircuitOpen, api.item_lookup, '0747532745')
+    assert transport.requests == 2
+    assert api.retry.breaker(api.host).state == CircuitBreaker.OPEN
+    clock.now += 30
+    api.item_lookup('0747532745')
+    assert api.retry.breaker(api.host).state == CircuitBreaker.CLOSED
+
+
+def test_half_open_circuit_lets_one_request_through():
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=1, reset_timeout=5, clock=clock)
+    breaker.failed()
+    assert not breaker.allow()
+    clock.now += 5
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.failed()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_budget_limits_retries():
+    clock = Clock()
+    budget = RetryBudget(ratio=0.5, minimum=1, window=10, clock=clock)
+    for _ in range(4):
+        budget.request()
+    assert [budget.withdraw() for _ in range(4)] == [True, True, True, False]
+    clock.now += 10
+    assert budget.withdraw()
+
+
+def test_exhausted_budget_stops_retries():
+    transport = ScriptedTransport(Response(THROTTLED), Response(VALID))
+    budget = RetryBudget(minimum=0, ratio=0)
+    api, clock = make_api(transport, budget=budget)
+    pytest.raises(TooManyRequests, api.item_lookup, '0747532745')
+    assert transport.requests == 1
+
+
+def test_cart_changes_are_only_retried_when_throttled():
+    policy = RetryPolicy()
+    assert not policy.is_retryable(InternalError(), 'CartAdd')
+    assert policy.is_retryable(TooManyRequests(), 'CartAdd')
+    assert policy.is_retryable(InternalError(), 'ItemLookup')
+
+
+def test_retries_are_measured():
+    metrics = MetricsCollector()
+    transport = ScriptedTransport(Response(THROTTLED), Response(VALID))
+    api, clock = make_api(transport)
+    api.observers.append(metrics)
+    api.item_lookup('0747532745')
+    summary = metrics.summary()
+    assert summary['retries'] == 1
+    assert summary['durations']['backoff']['count'] == 1
+
+
+def test_is_transient():
+    assert is_transient(socket.timeout())
+    assert is_transient(URLError(socket.timeout()))
+    assert is_transient(requests.exceptions.ReadTimeout())
+    assert is_transient(ServerError(502))
+    assert not is_transient(ServerError(501))
+    assert not is_transient(URLError('unknown url type'))
+    assert not is_transient(ValueError())
+
+
+def test_retry_after():
+    assert retry_after(Response(b'', {'Retry-After': '3'})) == 3
+    assert retry_after(Response(b'', {'Retry-After': 'soon'})) is None
+    assert retry_after(Response(b'', {'Retry-After':
+                                      'Wed, 21 Oct 2015 07:28:00 GMT'})) == 0
+    assert retry_after(Response(b'')) is None
+    assert retry_after(BytesIO()) is None
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+from base64 import b64encode
+from hashlib import sha256
+import hmac
+import pickle
+
+import pytest
+import six
+
+try:
+    from urllib.parse import quote
+except ImportError:  # pragma: no cover
+    from urllib2 import quote
+
+from amazonproduct.api import API
+from amazonproduct.contrib.caching import CachingMixin
+from amazonproduct.signing import Signer, encode_query, encode_value
+from amazonproduct.signing import request_key
+
+HOST = 'webservices.amazon.de'
+NOW = 1300000000.25  # 2011-03-13T07:06:40Z
+
+QUERIES = [
+    {'Operation': 'ItemLookup', 'ItemId': '0747532745'},
+    {'Operation': 'ItemSearch', 'Keywords': u'Jürgen & Søn ~ 50%+',
+     'SearchIndex': 'Books', 'ItemPage': 3},
+    {'Operation': 'BrowseNodeLookup', 'BrowseNodeId': 541686,
+     'ResponseGroup': 'BrowseNodeInfo,TopSellers'},
+    {'Operation': 'ItemSearch', 'Keywords': 'a/b c\td', 'Sort': '-price'},
+]
+
+STATIC = {
+    'Service': 'AWSECommerceService',
+    'Version': '2011-08-01',
+    'AWSAccessKeyId': 'XXX',
+    'AssociateTag': u'tag-21',
+}
+
+
+def reference_url(qargs, secret_key, host, timestamp):
+    # straight-forward implementation of Amazon's documentation
+    qargs = dict(qargs, Timestamp=timestamp)
+    args = '&'.join('%s=%s' % (
+        key, quote(six.text_type(qargs[key]).encode('utf-8')))
+        for key in sorted(qargs))
+    msg = 'GET\n%s\n/onca/xml\n%s' % (host, args)
+    digest = hmac.new(secret_key.encode('utf-8'), msg.encode('utf-8'), sha256)
+    signature = quote(b64encode(digest.digest()))
+    return 'http://%s/onca/xml?%s&Signature=%s' % (host, args, signature)
+
+
+def pytest_generate_tests(metafunc):
+    if 'qargs' in metafunc.funcargnames:
+        metafunc.parametrize('qargs', [dict(STATIC, **q) for q in QUERIES])
+
+
+def test_urls_match_reference(qargs):
+    signer = Signer('s3cr3t', HOST, clock=lambda: NOW)
+    assert signer.sign(qargs) == reference_url(
+        qargs, 's3cr3t', HOST, '2011-03-13T07:06:40Z')
+
+
+def test_given_timestamp_is_replaced(qargs):
+    signer = Signer('s3cr3t', HOST, clock=lambda: NOW)
+    qargs = dict(qargs, Timestamp='2000-01-01T00:00:00Z')
+    assert '2000-01-01' not in signer.sign(qargs)
+    assert signer.sign(qargs) == reference_url(
+        qargs, 's3cr3t', HOST, '2011-03-13T07:06:40Z')
+
+
+def test_encode_query():
+    qargs = dict(STATIC, **QUERIES[1])
+    assert encode_query(qargs) == '&'.join(
+        '%s=%s' % (key, quote(six.text_type(qargs[key]).encode('utf-8')))
+        for key in sorted(qargs))
+    assert encode_value(u'~ü') == quote(u'~ü'.encode('utf-8'))
+    assert encode_value(42) == '42'
+
+
+def test_timestamp_changes_every_second():
+    now = [NOW]
+    signer = Signer('s3cr3t', HOST, clock=lambda: now[0])
+    assert signer.timestamp() == '2011-03-13T07:06:40Z'
+    now[0] += 0.5
+    assert signer.timestamp() == '2011-03-13T07:06:40Z'
+    now[0] += 0.5
+    assert signer.timestamp() == '2011-03-13T07:06:41Z'
+
+
+def test_sign_many_uses_one_timestamp():
+    ticks = iter(range(int(NOW), int(NOW) + 100))
+    signer = Signer('s3cr3t', HOST, clock=lambda: next(ticks))
+    queries = [dict(STATIC, **q) for q in QUERIES]
+    urls = signer.sign_many(queries)
+    assert urls == [reference_url(q, 's3cr3t', HOST, '2011-03-13T07:06:40Z')
+                    for q in queries]
+
+
+def test_static_parameters_are_cached():
+    signer = Signer('s3cr3t', HOST)
+    signer.sign(dict(STATIC, **QUERIES[0]))
+    signer.sign(dict(STATIC, **QUERIES[1]))
+    assert sorted(signer._static) == sorted(STATIC.items())
+
+
+def test_api_uses_signer():
+    api = API('XXX', 's3cr3t', 'de')
+    signer = api.signer
+    signer.clock = lambda: NOW
+    assert api.signer is signer
+    url = api._build_url(Operation='ItemLookup', ItemId='0747532745')
+    assert url.startswith('http://%s/onca/xml?' % api.host)
+    assert url == reference_url(
+        api._prepare_query(Operation='ItemLookup', ItemId='0747532745'),
+        's3cr3t', api.host, '2011-03-13T07:06:40Z')
+
+
+def test_api_signer_follows_host_and_key():
+    api = API('XXX', 's3cr3t', 'de')
+    signer = api.signer
+    api.host = 'localhost:8080'
+    assert api.signer is not signer
+    assert api.signer.host == 'localhost:8080'
+    signer = api.signer
+    api.secret_key = 'other'
+    assert api.signer is not signer
+    assert api._build_url(Operation='ItemLookup').startswith(
+        'http://localhost:8080/onca/xml?')
+
+
+def test_planned_requests_are_signed_like_queries(qargs):
+    api = API('XXX', 's3cr3t', 'de')
+    api.signer.clock = lambda: NOW
+    queries = [dict(qargs), dict(qargs, Timestamp='2000-01-01T00:00:00Z')]
+    first, second = api.plan(queries)
+    assert first == second
+    assert first.locale == 'de'
+    assert 'Timestamp' not in first.query
+    assert api.sign(first) == api.sign(qargs) == reference_url(
+        api._prepare_query(**qargs), 's3cr3t', api.host,
+        '2011-03-13T07:06:40Z')
+
+
+def test_plan_is_lazy():
+    api = API('XXX', 's3cr3t', 'de')
+    def queries():
+        yield {'Operation': 'ItemLookup', 'ItemId': '0747532745'}
+        raise AssertionError('planned too far ahead')
+    request = next(api.plan(queries()))
+    assert request.query['Operation'] == 'ItemLookup'
+
+
+def test_request_keys_match_cache_keys():
+    api = API('XXX', 's3cr3t', 'de')
+    query = {'Operation': 'ItemLookup', 'ItemId': '0747532745',
+             'ResponseGroup': ['Small', 'Images']}
+    request, = api.plan([query])
+    assert request.key == CachingMixin.cache_key(api._prepare_query(**query))
+    assert request.key == request_key(dict(request.query, Timestamp='now'))
+
+
+def test_planned_requests_can_be_pickled():
+    api = API('XXX', 's3cr3t', 'de')
+    request, = api.plan([{'Operation': 'ItemLookup', 'ItemId': u'Ü'}])
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        assert pickle.loads(pickle.dumps(request, protocol)) == request
+
+
+def test_sign_many_uses_one_timestamp_for_planned_requests():
+    api = API('XXX', 's3cr3t', 'de')
+    ticks = iter(range(int(NOW), int(NOW) + 100))
+    api.signer.clock = lambda: next(ticks)
+    queries = [dict(q) for q in QUERIES]
+    urls = api.sign_many(api.plan(queries))
+    assert urls == [
+        reference_url(api._prepare_query(**q), 's3cr3t', api.host,
+                      '2011-03-13T07:06:40Z') for q in QUERIES]
+
+
+def test_planned_requests_need_matching_api():
+    request, = API('XXX', 's3cr3t', 'de').plan([{'Operation': 'ItemLookup'}])
+    pytest.raises(ValueError, API('XXX', 's3cr3t', 'fr').sign, request)
+    pytest.raises(ValueError, API('YYY', 's3cr3t', 'de').sign, request)
+    assert API('XXX', 's3cr3t', 'de').sign(request)
@@ -0,0 +1,70 @@
+import pytest
+import requests
+
+from tests.standin import Fixtures, StandInServer
+
+from amazonproduct.api import API
+from amazonproduct.errors import AWSError, InternalError, TooManyRequests
+
+
+def pytest_funcarg__fixtures(request):
+    return request.cached_setup(Fixtures, scope='module')
+
+
+def pytest_funcarg__standin(request):
+    fixtures = request.getfuncargvalue('fixtures')
+    server = StandInServer(fixtures, seed=1)
+    server.start()
+    request.addfinalizer(server.stop)
+    return server
+
+
+def pytest_funcarg__api(request):
+    server = request.getfuncargvalue('standin')
+    api = API('XXX', 'XXX', 'de',
+              processor='amazonproduct.processors.elementtree')
+    api.host = server.host('de')
+    api.REQUESTS_PER_SECOND = 10000
+    request.addfinalizer(api.close)
+    return api
+
+
+def test_serves_recorded_response(api, standin):
+    root = api.item_lookup('0747532745')
+    nspace = root.tag[:root.tag.index('}') + 1]
+    assert root.findtext('./%sItems/%sItem/%sASIN' % ((nspace, ) * 3)) == \
+        '0747532745'
+    assert standin.stats['served'] == 1
+
+
+def test_recorded_errors_are_served(api):
+    pytest.raises(AWSError, api.item_lookup, '1234567890123')
+
+
+def test_unknown_requests(api, standin):
+    e = pytest.raises(AWSError, api.item_lookup, 'NOT-RECORDED').value
+    assert e.code == 'AWS.StandIn.NoRecordedResponse'
+    assert standin.stats['missing'] == 1
+
+
+def test_throttling(api, standin):
+    standin.rate = 0.01
+    api.item_lookup('0747532745')
+    pytest.raises(TooManyRequests, api.item_lookup, '0747532745')
+    assert standin.stats['throttled'] == 1
+
+
+def test_internal_errors(api, standin):
+    standin.failure_rate, standin.failures = 1, ('internal-error', )
+    pytest.raises(InternalError, api.item_lookup, '0747532745')
+    assert standin.stats['failed'] == 1
+
+
+def test_disconnects(api, standin):
+    standin.failure_rate, standin.failures = 1, ('disconnect', )
+    pytest.raises(requests.ConnectionError, api.item_lookup, '0747532745')
+    assert standin.stats['disconnected'] == 1
+
+
+def test_unknown_failures_are_rejected(fixtures):
+    pytest.raises(ValueError, StandInServer, fixtures, failures=['flood'])
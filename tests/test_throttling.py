@@ -0,0 +1,206 @@
+import multiprocessing
+import threading
+
+import pytest
+
+from amazonproduct.api import API
+from amazonproduct.throttling import TokenBucket
+from amazonproduct.throttling import LocalBackend, FileBackend
+from amazonproduct.throttling import RemoteBackend, TokenServer
+
+
+class FakeClock (object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_first_request_is_not_delayed():
+    bucket = TokenBucket(1, clock=FakeClock())
+    assert bucket.reserve() == 0
+
+
+def test_requests_are_spaced_according_to_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(2, clock=clock)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits == [0, 0.5, 1.0, 1.5]
+
+
+def test_tokens_refill_over_time():
+    clock = FakeClock()
+    bucket = TokenBucket(1, clock=clock)
+    bucket.reserve()
+    clock.now += 1
+    assert bucket.reserve() == 0
+
+
+def test_burst_allows_several_requests_at_once():
+    clock = FakeClock()
+    bucket = TokenBucket(1, burst=3, clock=clock)
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0, 1.0]
+
+    # unused tokens do not accumulate beyond burst
+    clock.now += 60
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0, 1.0]
+
+
+@pytest.mark.parametrize('args', [(0, ), (-1, ), (1, 0)])
+def test_fails_for_invalid_parameters(args):
+    pytest.raises(ValueError, TokenBucket, *args)
+
+
+def test_wait_times_are_reported():
+    bucket = TokenBucket(4, clock=FakeClock())
+    for _ in range(3):
+        bucket.reserve()
+    assert bucket.stats() == {
+        'acquired': 3,
+        'delayed': 2,
+        'total_wait': 0.75,
+        'max_wait': 0.5,
+    }
+
+
+def test_bucket_is_thread_safe():
+    clock = FakeClock()
+    bucket = TokenBucket(10, clock=clock)
+    waits = []
+
+    def worker():
+        for _ in range(100):
+            waits.append(bucket.reserve())
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # every caller got its own slot
+    assert sorted(round(w, 6) for w in waits) == [
+        round(i / 10.0, 6) for i in range(800)]
+
+
+def test_acquire_async():
+    asyncio = pytest.importorskip('asyncio')
+    bucket = TokenBucket(1000)
+    loop = asyncio.new_event_loop()
+    try:
+        waits = [loop.run_until_complete(bucket.acquire_async())
+                 for _ in range(3)]
+    finally:
+        loop.close()
+    assert waits[0] == 0
+    assert bucket.acquired == 3
+
+
+def test_api_creates_throttle_from_requests_per_second():
+    api = API(locale='de')
+    api.REQUESTS_PER_SECOND = 5
+    assert api.throttle.rate == 5
+    assert api.throttle is api.throttle
+
+
+def test_throttle_can_be_shared():
+    throttle = TokenBucket(1)
+    de = API(locale='de', throttle=throttle)
+    uk = API(locale='uk', throttle=throttle)
+    assert de.throttle is uk.throttle is throttle
+
+
+def test_buckets_with_same_key_share_tokens():
+    backend = LocalBackend(clock=FakeClock())
+    first = TokenBucket(1, backend=backend, key='redtoad-21')
+    second = TokenBucket(1, backend=backend, key='redtoad-21')
+    other = TokenBucket(1, backend=backend, key='other')
+    assert first.reserve() == 0
+    assert second.reserve() == 1.0
+    assert other.reserve() == 0
+
+
+def test_file_backend_keeps_state_in_file(tmpdir):
+    clock = FakeClock()
+    path = tmpdir.join('throttle').strpath
+    first = TokenBucket(2, backend=FileBackend(path, clock=clock))
+    second = TokenBucket(2, backend=FileBackend(path, clock=clock))
+    assert [first.reserve(), second.reserve(), first.reserve()] == [
+        0, 0.5, 1.0]
+    clock.now += 10
+    assert second.reserve() == 0
+
+
+def _reserve_from_file(path, n, queue):
+    bucket = TokenBucket(10, backend=FileBackend(path))
+    queue.put([bucket.reserve() for _ in range(n)])
+
+
+def test_file_backend_is_shared_between_processes(tmpdir):
+    path = tmpdir.join('throttle').strpath
+    queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_reserve_from_file,
+                                args=(path, 10, queue))
+        for _ in range(3)]
+    for process in processes:
+        process.start()
+    waits = sorted(sum([queue.get(timeout=10) for _ in processes], []))
+    for process in processes:
+        process.join()
+
+    # 30 tokens were handed out one after another
+    assert len(waits) == 30
+    assert waits[-1] > 2.5
+    for previous, current in zip(waits, waits[1:]):
+        assert current - previous < 0.1 + 0.05
+
+
+def pytest_funcarg__tokenserver(request):
+    def setup():
+        server = TokenServer(('127.0.0.1', 0),
+                             backend=LocalBackend(clock=FakeClock()))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+    def teardown(server):
+        server.shutdown()
+        server.server_close()
+    return request.cached_setup(setup, teardown, 'function')
+
+
+def test_remote_backend(tokenserver):
+    backend = RemoteBackend(tokenserver.server_address)
+    first = TokenBucket(4, backend=backend, key='fleet')
+    second = TokenBucket(4, backend=RemoteBackend(
+        tokenserver.server_address), key='fleet')
+    assert [first.reserve(), second.reserve(), first.reserve()] == [
+        0, 0.25, 0.5]
+    backend.close()
+
+
+def test_remote_backend_reconnects(tokenserver):
+    backend = RemoteBackend(tokenserver.server_address)
+    bucket = TokenBucket(4, backend=backend)
+    bucket.reserve()
+    # simulate a dropped connection
+    backend._file.close()
+    backend._sock.close()
+    assert bucket.reserve() == 0.25
+
+
+def test_remote_backend_rejects_invalid_keys(tokenserver):
+    backend = RemoteBackend(tokenserver.server_address)
+    pytest.raises(ValueError, backend.reserve, 'two words', 1, 1, 1)
+
+
+def test_api_draws_tokens_from_shared_backend(tokenserver):
+    throttle = TokenBucket(1, backend=RemoteBackend(
+        tokenserver.server_address))
+    api = API(locale='de', throttle=throttle)
+    assert api.throttle.reserve() == 0
+    assert API(locale='uk', throttle=TokenBucket(1, backend=RemoteBackend(
+        tokenserver.server_address))).throttle.reserve() == 1.0
@@ -0,0 +1,54 @@
+from amazonproduct.api import API
+from amazonproduct.transport import BaseTransport, SessionTransport
+
+
+class DummyTransport (BaseTransport):
+
+    def __init__(self):
+        self.closed = False
+        self.urls = []
+
+    def fetch(self, url, headers=None):
+        self.urls.append(url)
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+def test_session_transport_uses_pool_settings():
+    transport = SessionTransport(pool_connections=3, pool_maxsize=42)
+    adapter = transport.session.get_adapter('http://webservices.amazon.de')
+    assert adapter._pool_connections == 3
+    assert adapter._pool_maxsize == 42
+
+
+def test_session_transport_fetches_content(server):
+    server.serve_content('<xml>Hello</xml>')
+    with SessionTransport() as transport:
+        for _ in range(3):
+            assert transport.fetch(server.url).read() == b'<xml>Hello</xml>'
+
+
+def test_api_uses_custom_transport():
+    transport = DummyTransport()
+    api = API(locale='de', transport=transport)
+    api.REQUESTS_PER_SECOND = 10000
+    api._fetch('http://example.com/onca/xml')
+    assert transport.urls == ['http://example.com/onca/xml']
+
+
+def test_api_does_not_close_shared_transport():
+    transport = DummyTransport()
+    with API(locale='de', transport=transport):
+        pass
+    assert not transport.closed
+
+
+def test_api_closes_own_transport(monkeypatch):
+    closed = []
+    monkeypatch.setattr(SessionTransport, 'close',
+                        lambda self: closed.append(self))
+    with API(locale='de') as api:
+        pass
+    assert closed == [api.transport]
@@ -0,0 +1,131 @@
+# Copyright (C) 2015 Sebastian Rahlf <basti at redtoad dot de>
+
+"""
+Compare a new connection per request (plain ``requests.get()``) with the
+pooled :class:`~amazonproduct.transport.SessionTransport` used by the API.
+Both fetch a recorded XML response from a local HTTP server which supports
+keep-alive::
+
+    $ python tests/transport-performance.py
+    Serving 2011-08-01/ItemLookup-de-valid-asin.xml at http://127.0.0.1:43735/onca/xml
+    Fetching 1000 responses...
+    requests.get()       1.94s  (1.94ms/request, 1000 connections)
+    SessionTransport     1.29s  (1.29ms/request, 1 connections)
+
+Against a remote host the difference is considerably larger because each new
+connection costs at least one additional round-trip.
+
+"""
+
+import functools
+import os.path
+import sys
+import threading
+import time
+
+# support Python 2 and Python 3 without conversion
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import requests
+
+# make sure that amazonproduct can be imported
+# from parent directory
+_here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(_here))
+
+from amazonproduct.transport import SessionTransport
+
+#: how many requests are sent per transport
+REQUESTS = 1000
+
+#: recorded response served by the local server
+XML_FILE = os.path.join('2011-08-01', 'ItemLookup-de-valid-asin.xml')
+
+
+class StandInServer (ThreadingMixIn, HTTPServer):
+
+    """
+    Local stand-in for Amazon's web service which serves the same content for
+    every request and counts the connections opened by clients.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, content):
+        self.content = content
+        self.connections = 0
+        HTTPServer.__init__(self, ('127.0.0.1', 0), KeepAliveHandler)
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        return ThreadingMixIn.process_request(self, request, client_address)
+
+    @property
+    def url(self):
+        return 'http://%s:%s/onca/xml' % self.server_address
+
+
+class KeepAliveHandler (BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body are written separately, don't let Nagle's algorithm
+    # delay the latter on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(self.server.content)))
+        self.end_headers()
+        self.wfile.write(self.server.content)
+
+    def log_message(self, *args):
+        pass
+
+
+def per_call_fetch(url):
+    """
+    Fetches ``url`` the way :meth:`API._fetch` used to: a new connection for
+    every single request.
+    """
+    response = requests.get(url, stream=True)
+    response.raw.read = functools.partial(
+        response.raw.read, decode_content=True)
+    return response.raw
+
+
+def run(label, fetch, server):
+    server.connections = 0
+    start = time.time()
+    for i in range(REQUESTS):
+        fp = fetch(server.url)
+        while fp.read(8192):
+            pass
+    stop = time.time()
+    print('%-18s %6.2fs  (%.2fms/request, %i connections)' % (
+        label, stop - start, (stop - start) * 1000.0 / REQUESTS,
+        server.connections))
+
+
+if __name__ == '__main__':
+
+    content = open(os.path.join(_here, XML_FILE), 'rb').read()
+    server = StandInServer(content)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    print('Serving %s at %s' % (XML_FILE, server.url))
+    print('Fetching %i responses...' % REQUESTS)
+
+    run('requests.get()', per_call_fetch, server)
+    with SessionTransport() as transport:
+        run('SessionTransport', transport.fetch, server)
+
+    server.shutdown()
@@ -0,0 +1,118 @@
+# Copyright (C) 2015 Sebastian Rahlf <basti at redtoad dot de>
+
+"""
+Compare the XPath lookups done for every response by the lxml based processors
+and paginators: expressions compiled per call with ``//`` scans (as before)
+against pre-compiled, anchored expressions (see
+:func:`amazonproduct.processors._lxml.xpath`). All recorded XML responses are
+parsed once up front, so only the lookups are timed::
+
+    $ python tests/xpath-performance.py
+    Searching 878 XML responses 20 times...
+    errors (//aws:Error)                  0.25s
+    errors (find_errors)                  0.18s
+    paginator data (//, uncompiled)       0.76s
+    paginator data (anchored, compiled)   0.20s
+
+The recorded responses are small; the ``//`` scans grow with the size of the
+response while the anchored expressions do not.
+
+"""
+
+from __future__ import print_function
+
+import os.path
+import sys
+import time
+
+from lxml import etree
+
+# make sure that amazonproduct can be imported
+# from parent directory
+_here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(_here))
+
+from amazonproduct.processors._lxml import SearchPaginator, find_errors
+
+
+#: how many times all responses are searched
+RUNS = 20
+
+
+def scan_errors(root):
+    nspace = root.nsmap.get(None, '')
+    return root.xpath('//aws:Error', namespaces={'aws': nspace})
+
+
+class UncompiledPaginator (SearchPaginator):
+
+    """
+    Paginator as it used to be: expressions are compiled on every call.
+    """
+
+    current_page_xpath = '//aws:Items/aws:Request/aws:ItemSearchRequest/aws:ItemPage'
+    total_pages_xpath = '//aws:Items/aws:TotalPages'
+    total_results_xpath = '//aws:Items/aws:TotalResults'
+    items = '//aws:Items/aws:Item'
+
+    def __init__(self):
+        pass
+
+    def paginator_data(self, root):
+        nspace = root.nsmap.get(None, '')
+        def fetch_value(xpath, default):
+            try:
+                node = root.xpath(xpath, namespaces={'aws': nspace})[0]
+                return int(node.text)
+            except (IndexError, ValueError):
+                return default
+        return [fetch_value(*a) for a in [
+            (self.current_page_xpath, 1),
+            (self.total_pages_xpath, 0),
+            (self.total_results_xpath, 0)
+        ]]
+
+    def iterate(self, root):
+        nspace = root.nsmap.get(None, '')
+        return root.xpath(self.items, namespaces={'aws': nspace})
+
+
+class CompiledPaginator (SearchPaginator):
+
+    def __init__(self):
+        pass
+
+
+def paginate(paginator):
+    def run(root):
+        list(paginator.paginator_data(root))
+        return paginator.iterate(root)
+    return run
+
+
+def measure(fun, roots):
+    start = time.time()
+    for _ in range(RUNS):
+        for root in roots:
+            fun(root)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+
+    roots = []
+    for dirpath, _, files in os.walk(_here):
+        for name in sorted(files):
+            if name.endswith('.xml'):
+                roots.append(etree.parse(os.path.join(dirpath, name)).getroot())
+    # namespace-less responses cannot be searched with a prefix bound to ''
+    roots = [root for root in roots if root.nsmap.get(None)]
+
+    print('Searching %i XML responses %i times...' % (len(roots), RUNS))
+    for label, fun in [
+        ('errors (//aws:Error)', scan_errors),
+        ('errors (find_errors)', find_errors),
+        ('paginator data (//, uncompiled)', paginate(UncompiledPaginator())),
+        ('paginator data (anchored, compiled)', paginate(CompiledPaginator())),
+    ]:
+        print('%-36s %5.2fs' % (label, measure(fun, roots)))